@@ -0,0 +1,197 @@
+"""
+ASGI connection-handling shim ... serves the (wsgi) Pyramid app from uvicorn, as an alternative to pserve / waitress
+
+only the client connections (keep-alive, slow clients, etc...) live on the event loop: an idle or slow
+connection costs a socket on the loop, rather than a waitress channel. everything else is unchanged: the
+very same synchronous app (views, PeliasWrapper, refine_service, caches) runs on a thread pool, and each
+request holds one of those threads until it's answered, upstream wait included. upstream calls go out via an
+httpx.AsyncClient on the loop, but the calling thread blocks on the answer. so this is NOT an async / non-blocking
+mode: requests in flight are capped at the thread count, same as waitress, which is why the pool defaults to
+waitress' threads (200).
+
+run:
+  poetry install -E asgi  # uvicorn + httpx
+  PELIAS_CONFIG=config/development.ini poetry run uvicorn --factory pelias.adapter.asgi:make_app --port 45554
+
+:see: pelias/adapter/tests/bench_asgi.py for a side-by-side benchmark against waitress
+"""
+import io
+import os
+import sys
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import httpx
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from pelias.adapter.control import upstream
+
+import logging
+log = logging.getLogger(__file__)
+
+
+class AsyncUpstreamPool(upstream.UpstreamPool):
+    """
+    the (configured) upstream pool ... same hedging, breakers, per-host limits and stats, but
+    with the http calls made by an httpx.AsyncClient on the event loop (the calling thread still waits on each one)
+    """
+    def __init__(self, loop, pool):
+        super(AsyncUpstreamPool, self).__init__(
+            pool_size=pool.pool_size, max_per_host=pool.max_per_host, timeout=pool.timeout, hedging=pool.hedging,
+            breaker_failures=pool.breaker_failures, breaker_reset_secs=pool.breaker_reset_secs, backends=pool.backends
+        )
+        self.breakers = pool.breakers
+        self.loop = loop
+        self.client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=pool.pool_size)
+        )
+
+    def new_session(self, num_hosts):
+        """ no requests.Session ... send() uses the httpx client """
+        return None
+
+    def send(self, url, params, timeout):
+        """ called on a worker thread ... runs the GET on the loop, and blocks that thread until it's answered """
+        future = asyncio.run_coroutine_threadsafe(self.client.get(url, params=params, timeout=timeout), self.loop)
+        try:
+            resp = future.result(timeout + 1)
+        except TimeoutError as e:
+            future.cancel()
+            raise requests.exceptions.Timeout(e)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(e)
+        except httpx.HTTPError as e:
+            raise requests.exceptions.ConnectionError(e)
+        return to_requests_response(resp)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def to_requests_response(resp):
+    """ httpx.Response -> requests.Response, so callers (get_json, RouteStopRecords, etc...) are none the wiser """
+    ret_val = requests.Response()
+    ret_val.status_code = resp.status_code
+    ret_val.headers = CaseInsensitiveDict(resp.headers)
+    ret_val.url = str(resp.url)
+    ret_val.encoding = resp.encoding
+    ret_val.reason = resp.reason_phrase
+    ret_val._content = resp.content
+    return ret_val
+
+
+def wsgi_environ(scope, body):
+    """ ASGI http scope -> WSGI environ (PEP 3333) """
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1')
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if key in environ:
+            value = "{},{}".format(environ[key], value)
+        environ[key] = value
+    return environ
+
+
+def call_wsgi(wsgi_app, environ):
+    """ run the wsgi app (on a worker thread) ... returns (status code, headers, body) """
+    response = []
+    chunks = []
+
+    def start_response(status, headers, exc_info=None):
+        response[:] = [status, headers]
+        return chunks.append
+
+    result = wsgi_app(environ, start_response)
+    try:
+        for c in result:
+            chunks.append(c)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+
+    status, headers = response
+    headers = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+    return int(status.split()[0]), headers, b''.join(chunks)
+
+
+class AsgiShim(object):
+    """ ASGI 3 app in front of the Pyramid (wsgi) app ... each request runs on (and holds) one of the threads """
+    def __init__(self, wsgi_app, threads=200):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="asgi")
+        self.sync_pool = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+
+    async def http(self, scope, receive, send):
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+        loop = asyncio.get_running_loop()
+        status, headers, content = await loop.run_in_executor(self.executor, call_wsgi, self.wsgi_app, wsgi_environ(scope, body))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': content})
+
+    async def lifespan(self, receive, send):
+        """ startup: move upstream calls onto this loop ... shutdown: put the (blocking) pool back """
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self.sync_pool = upstream.pool
+                upstream.pool = AsyncUpstreamPool(asyncio.get_running_loop(), self.sync_pool)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if isinstance(upstream.pool, AsyncUpstreamPool):
+                    await upstream.pool.close()
+                    upstream.pool = self.sync_pool
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def make_app(config_file=None, threads=None):
+    """
+    app factory for uvicorn (--factory) ... config file and thread count default to $PELIAS_CONFIG and $PELIAS_ASGI_THREADS
+    :note: threads caps the requests in flight (see above) ... size it like waitress' threads (config/base.ini)
+    """
+    from paste.deploy import loadapp
+
+    config_file = config_file or os.environ.get('PELIAS_CONFIG', 'config/development.ini')
+    threads = threads or int(os.environ.get('PELIAS_ASGI_THREADS', 200))
+    wsgi_app = loadapp("config:{}".format(os.path.abspath(config_file)))
+    return AsgiShim(wsgi_app, threads)
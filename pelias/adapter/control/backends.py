@@ -0,0 +1,162 @@
+"""
+multiple Pelias backends behind the one (logical) pelias_instance
+
+the pelias_*_url settings (and so the cache keys, breakers, etc...) stay as they are ... each upstream call to a
+url under pelias_instance gets sent to one of the configured backends instead, with the rest of the url (e.g.,
+/v1/autocomplete?text=...) unchanged. the backend is the one with the least outstanding requests (or the lowest
+EWMA latency x outstanding requests), skipping backends that failed their last health probe, or were passively
+ejected after a run of failed calls.
+"""
+import random
+import threading
+import time
+
+import logging
+log = logging.getLogger(__file__)
+
+
+class Backend(object):
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.in_flight = 0
+        self.ewma = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.healthy = True
+        self.last_probe = None
+
+    def stats(self, now):
+        return {
+            'in_flight': self.in_flight,
+            'ewma_ms': round(self.ewma * 1000, 1),
+            'requests': self.requests,
+            'errors': self.errors,
+            'ejections': self.ejections,
+            'ejected': self.ejected_until > now,
+            'healthy': self.healthy,
+            'last_probe': self.last_probe,
+        }
+
+
+class BackendPool(object):
+    """
+    :param prefix: the (logical) pelias_instance url ... calls to urls that start with it get a backend
+    :param policy: 'least_outstanding' or 'ewma' (a plain EWMA of latency, x (outstanding requests + 1) ... no peak sensitivity)
+    :param eject_failures: eject a backend after this many calls in a row fail (0 == never)
+    :param eject_secs: ... for this long
+    :param decay: weight of the latest latency sample in the EWMA
+    """
+    def __init__(self, prefix, urls, policy='least_outstanding', eject_failures=3, eject_secs=30, decay=0.3,
+                 probe_path='/v1/autocomplete?text=portland&size=1', probe_secs=10, clock=time.monotonic):
+        self.prefix = prefix.rstrip('/')
+        self.backends = [Backend(u) for u in urls]
+        self.policy = policy
+        self.eject_failures = eject_failures
+        self.eject_secs = eject_secs
+        self.decay = decay
+        self.probe_path = probe_path
+        self.probe_secs = probe_secs
+        self.clock = clock
+        self.no_backends = 0
+
+        self._lock = threading.Lock()
+        self._timer = None
+        self._stopped = False
+
+    @property
+    def enabled(self):
+        return bool(self.backends)
+
+    def matches(self, url):
+        return self.enabled and url.startswith(self.prefix)
+
+    def score(self, backend):
+        if self.policy == 'ewma':
+            # note: the outstanding requests multiply the latency, so a backend that's piling up calls gets fewer new ones
+            ret_val = (backend.ewma * (backend.in_flight + 1), backend.in_flight)
+        else:
+            ret_val = (backend.in_flight, backend.ewma)
+        return ret_val
+
+    def pick(self):
+        """ take the best available backend (marking a call to it as outstanding) """
+        with self._lock:
+            now = self.clock()
+            available = [b for b in self.backends if b.healthy and b.ejected_until <= now]
+            if not available:
+                # note: all of them are down (or so we think) ... better to try one than fail every call
+                self.no_backends += 1
+                available = self.backends
+            best = min(self.score(b) for b in available)
+            ret_val = random.choice([b for b in available if self.score(b) == best])
+            ret_val.in_flight += 1
+            ret_val.requests += 1
+        return ret_val
+
+    def url(self, backend, url):
+        """ the backend's version of (logical) url """
+        return backend.url + url[len(self.prefix):]
+
+    def done(self, backend, secs, ok=True):
+        """ a call to backend finished (after secs) ... ok == False for an error, or a 5xx """
+        with self._lock:
+            backend.in_flight -= 1
+            backend.ewma = secs if backend.ewma == 0.0 else self.decay * secs + (1 - self.decay) * backend.ewma
+            if ok:
+                backend.failures = 0
+            else:
+                backend.errors += 1
+                backend.failures += 1
+                if 0 < self.eject_failures <= backend.failures:
+                    log.warning(f"ejecting Pelias backend {backend.url} for {self.eject_secs} secs, after {backend.failures} failed calls")
+                    backend.ejected_until = self.clock() + self.eject_secs
+                    backend.ejections += 1
+                    backend.failures = 0
+
+    def probe(self, send, timeout=5):
+        """ health check each backend ... send(url, params, timeout) is the pool's plain http GET (no breaker, no hedging) """
+        for b in self.backends:
+            try:
+                healthy = send(b.url + self.probe_path, None, timeout).status_code < 500
+            except Exception as e:
+                log.debug(e)
+                healthy = False
+            with self._lock:
+                if healthy and not b.healthy:
+                    log.info(f"Pelias backend {b.url} is healthy again")
+                elif b.healthy and not healthy:
+                    log.warning(f"Pelias backend {b.url} failed its health probe")
+                b.healthy = healthy
+                b.last_probe = time.strftime('%Y-%m-%dT%H:%M:%S')
+
+    def start_probes(self, send):
+        """ probe now (in the background), and again every probe_secs """
+        if self.probe_secs <= 0 or not self.enabled or self._stopped:
+            return
+
+        def run():
+            self.probe(send)
+            self.start_probes(send)
+
+        self._timer = threading.Timer(0 if self._timer is None else self.probe_secs, run)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def stop_probes(self):
+        self._stopped = True
+        if self._timer:
+            self._timer.cancel()
+
+    def stats(self):
+        with self._lock:
+            now = self.clock()
+            ret_val = {
+                'prefix': self.prefix,
+                'policy': self.policy,
+                'no_backends': self.no_backends,
+                'backends': {b.url: b.stats(now) for b in self.backends},
+            }
+        return ret_val
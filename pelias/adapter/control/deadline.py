@@ -0,0 +1,42 @@
+"""
+per-request deadline
+
+a single request can turn into a string of upstream calls (reverse geocode, primary, backup, wrong-city re-query,
+refine's unrefined retry), none of which know how long the request has already taken. views create a Deadline
+(a bit under waitress' channel_timeout), and pass it down explicitly ... each upstream call then gets whatever
+time is left as its timeout, and optional stages are skipped when there's not enough time left for them.
+"""
+import time
+
+
+class Deadline(object):
+    def __init__(self, secs, clock=time.monotonic):
+        self.secs = secs
+        self.clock = clock
+        self.expires = clock() + secs
+
+    def remaining(self):
+        """ secs left (never negative) """
+        return max(self.expires - self.clock(), 0.0)
+
+    def expired(self):
+        return self.remaining() <= 0.0
+
+    def has(self, secs):
+        """ is there at least secs left? (e.g., enough time to bother with an optional stage) """
+        return self.remaining() >= secs
+
+    def timeout(self, def_val=None):
+        """ timeout for the next upstream call ... the time remaining, capped at def_val (if given) """
+        ret_val = self.remaining()
+        if def_val is not None:
+            ret_val = min(ret_val, def_val)
+        return ret_val
+
+    def __repr__(self):
+        return "Deadline({:.3f} of {} secs left)".format(self.remaining(), self.secs)
+
+
+def has_time(deadline, secs):
+    """ True when there's no deadline, or it has at least secs left """
+    return deadline is None or deadline.has(secs)
@@ -0,0 +1,99 @@
+"""
+speculative fan-out: call the primary and the backup service at the same time
+
+PeliasWrapper.wrapp() only asks the backup service (e.g., search) when the primary (e.g., autocomplete) comes
+back empty ... which costs two upstream latencies back to back. with fan-out on, the backup call runs in
+parallel, and its result is simply ignored (or the call cancelled, if it hasn't started) when the primary wins.
+when the primary loses and the backup is still waiting for a pool thread, it's cancelled and run on the request's own
+thread instead ... and waiting on a running backup is bounded by the request's deadline.
+
+stats() break the wins down by query class, to see which kinds of queries are worth the extra upstream load.
+"""
+import contextvars
+import re
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import logging
+log = logging.getLogger(__file__)
+
+ADDRESS_RE = re.compile(r'^\d+[a-z]?\s+\S')
+INTERSECTION_RE = re.compile(r'\s(&|and|@)\s|&')
+
+
+def query_class(text):
+    """ rough class of a query: 'stop' (e.g., 364), 'address', 'intersection', 'name' or 'short' """
+    text = (text or '').strip().lower()
+    if len(text) < 3 and not text.isdigit():
+        ret_val = 'short'
+    elif text.isdigit():
+        ret_val = 'stop'
+    elif INTERSECTION_RE.search(text):
+        ret_val = 'intersection'
+    elif ADDRESS_RE.match(text):
+        ret_val = 'address'
+    else:
+        ret_val = 'name'
+    return ret_val
+
+
+class FanOut(object):
+    """
+    :note: enabled=False (the default) means call() is never used ... wrapp() calls the services one after the other
+    :param threads: backup calls run in parallel ... size it to the server's threads (one backup per request thread)
+    """
+    def __init__(self, enabled=False, threads=16):
+        self.enabled = enabled
+        self.threads = threads
+        self._executor = None
+        self._lock = threading.Lock()
+        self._wins = defaultdict(lambda: {'primary': 0, 'backup': 0, 'neither': 0, 'cancelled': 0, 'inline': 0, 'timeouts': 0})
+
+    def call(self, qclass, primary, backup, is_good, deadline=None):
+        """
+        run backup() in the background while running primary() on this thread
+        :param deadline: the request's Deadline ... once primary() is done, the wait on the backup is capped at what's left of it
+        :return: (primary result, backup result) ... where the backup result is None if primary() was good (or the wait timed out)
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="fan-out")
+        future = self._executor.submit(contextvars.copy_context().run, backup)
+
+        ret_val = primary()
+        alt_resp = None
+        if is_good(ret_val):
+            winner = 'primary'
+            if future.cancel():
+                self.count(qclass, 'cancelled')
+        else:
+            try:
+                if future.cancel():
+                    # note: the backup never got a pool thread ... run it here, rather than wait in line for one
+                    self.count(qclass, 'inline')
+                    alt_resp = backup()
+                else:
+                    alt_resp = future.result(deadline.remaining() if deadline else None)
+            except TimeoutError:
+                self.count(qclass, 'timeouts')
+                log.warning(f"fan-out backup call outlived the request deadline of {deadline.secs} secs")
+            except Exception as e:
+                log.warning(e)
+            winner = 'backup' if is_good(alt_resp) else 'neither'
+
+        self.count(qclass, winner)
+        return ret_val, alt_resp
+
+    def count(self, qclass, name):
+        with self._lock:
+            self._wins[qclass][name] += 1
+
+    def stats(self):
+        with self._lock:
+            ret_val = {
+                'enabled': self.enabled,
+                'threads': self.threads,
+                'wins_by_query_class': {c: dict(w) for c, w in self._wins.items()},
+            }
+        return ret_val
@@ -0,0 +1,140 @@
+"""
+adaptive concurrency limit (AIMD) for the upstream-bound views
+
+with waitress' threads = 200, a Pelias slowdown turns into 200 threads stuck on upstream calls, and a growing
+queue of client requests that time out anyway. this caps the requests in flight at a limit that adapts to
+how long they take: each one that finishes within latency_target nudges the limit up (by 1 / limit, so about
++1 per 'round' of requests), and a slow (or failed) one cuts it by the backoff factor (at most once per
+latency_target, so a single slow episode is a single cut). requests over the limit wait (up to queue_secs,
+if there's room in the queue) for a slot ... or are shed: served from the cache, else a fast 503.
+
+with upstream_latency=True, the limit follows the latency of the upstream calls themselves (see observe(), fed by
+upstream.UpstreamPool for the calls made under upstream.observed()), rather than of whole requests ... so cache hits
+and post-processing don't move it.
+"""
+import threading
+import time
+
+import logging
+log = logging.getLogger(__file__)
+
+
+class AdaptiveLimiter(object):
+    def __init__(self, enabled=False, initial=50, min_limit=5, max_limit=200, latency_target=2.0, backoff=0.9,
+                 queue_size=0, queue_secs=0.0, retry_after=2, upstream_latency=False, clock=time.monotonic):
+        self.enabled = enabled
+        self.upstream_latency = upstream_latency
+        self.min_limit = max(min_limit, 1)
+        self.max_limit = max(max_limit, self.min_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.queue_size = queue_size
+        self.queue_secs = queue_secs
+        self.retry_after = retry_after
+        self.clock = clock
+
+        self._cond = threading.Condition()
+        self._next_decrease = 0.0
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self.shed_from_cache = 0
+        self.increases = 0
+        self.decreases = 0
+
+    def acquire(self):
+        """ take a slot ... waiting (up to queue_secs) if there's room in the queue ... False means shed this request """
+        with self._cond:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                self.admitted += 1
+                return True
+            if self.waiting >= self.queue_size or self.queue_secs <= 0:
+                self.shed += 1
+                return False
+
+            self.waiting += 1
+            try:
+                end = self.clock() + self.queue_secs
+                while self.in_flight >= int(self.limit):
+                    remaining = end - self.clock()
+                    if remaining <= 0:
+                        self.shed += 1
+                        return False
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+                self.admitted += 1
+                self.queued += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self, latency=None, ok=True):
+        """ give back a slot ... and adjust the limit based on how long (latency secs) the request took, if given """
+        with self._cond:
+            if latency is not None:
+                self._adjust(latency, ok)
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def observe(self, latency, ok=True):
+        """ adjust the limit based on how long (latency secs) an upstream call took """
+        with self._cond:
+            self._adjust(latency, ok)
+
+    def _adjust(self, latency, ok):
+        """ AIMD step ... caller holds the lock """
+        busy = self.in_flight * 2 >= self.limit
+        if not ok or latency > self.latency_target:
+            now = self.clock()
+            if now >= self._next_decrease:
+                self.limit = max(self.limit * self.backoff, self.min_limit)
+                self._next_decrease = now + self.latency_target
+                self.decreases += 1
+        elif busy and self.limit < self.max_limit:
+            # note: only grow when the limit is actually being used (else it'd just drift up to max_limit)
+            self.limit = min(self.limit + 1.0 / self.limit, self.max_limit)
+            self.increases += 1
+
+    def call(self, func, *args, **kwargs):
+        """
+        func(*args, **kwargs) under the limit
+        :return: (True, func's result) ... or (False, None) when the request was shed
+        """
+        if not self.acquire():
+            return False, None
+        start = self.clock()
+        ok = False
+        try:
+            ret_val = func(*args, **kwargs)
+            ok = True
+            return True, ret_val
+        finally:
+            self.release(None if self.upstream_latency else self.clock() - start, ok)
+
+    def served_from_cache(self):
+        """ a shed request was answered from the cache (rather than with a 503) """
+        with self._cond:
+            self.shed_from_cache += 1
+
+    def stats(self):
+        with self._cond:
+            ret_val = {
+                'enabled': self.enabled,
+                'upstream_latency': self.upstream_latency,
+                'limit': int(self.limit),
+                'min_limit': self.min_limit,
+                'max_limit': self.max_limit,
+                'in_flight': self.in_flight,
+                'queue_depth': self.waiting,
+                'admitted': self.admitted,
+                'queued': self.queued,
+                'shed': self.shed,
+                'shed_from_cache': self.shed_from_cache,
+                'increases': self.increases,
+                'decreases': self.decreases,
+            }
+        return ret_val
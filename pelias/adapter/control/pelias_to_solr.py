@@ -3,10 +3,11 @@ install_aliases()
 
 from urllib.parse import urlencode
 
-from ott.utils import json_utils
 from ott.utils import html_utils
 from pelias.adapter.model.solr.solr_response import SolrResponse
 from .pelias_wrapper import PeliasWrapper
+from . import upstream
+from .deadline import has_time
 
 import logging
 log = logging.getLogger(__file__)
@@ -110,9 +111,15 @@ class PeliasToSolr(PeliasWrapper):
 
 
     @classmethod
-    def call_pelias_parse_results(cls, solr_params, url):
+    def call_pelias_parse_results(cls, solr_params, url, deadline=None):
         param_str = cls.solr_to_pelias_param_str(solr_params)
-        json = json_utils.stream_json(url, param_str)
+        if deadline is None:
+            json = upstream.stream_json(url, param_str)
+        elif deadline.expired():
+            log.warning(f"{url}?{param_str}: request deadline of {deadline.secs} secs exceeded")
+            json = {}
+        else:
+            json = upstream.stream_json(url, param_str, timeout=deadline.timeout(upstream.pool.timeout))
         cls.check_invalid_layers(json)
         #cls.fix_venues_in_pelias_response(pelias_json=json)
         cls.fixup_response(json, is_calltaker=True, is_rtp=False)
@@ -120,23 +127,25 @@ class PeliasToSolr(PeliasWrapper):
         return ret_val
 
     @classmethod
-    def call_pelias_autocomplete(cls, solr_params, auto_url):
-        ret_val = cls.call_pelias_parse_results(solr_params, auto_url)
+    def call_pelias_autocomplete(cls, solr_params, auto_url, deadline=None):
+        ret_val = cls.call_pelias_parse_results(solr_params, auto_url, deadline)
         return ret_val
 
     @classmethod
-    def call_pelias_search(cls, solr_params, search_url):
-        ret_val = cls.call_pelias_parse_results(solr_params, search_url)
+    def call_pelias_search(cls, solr_params, search_url, deadline=None):
+        ret_val = cls.call_pelias_parse_results(solr_params, search_url, deadline)
         return ret_val
 
     @classmethod
-    def call_pelias(cls, solr_params, auto_url=None, search_url=None):
+    def call_pelias(cls, solr_params, auto_url=None, search_url=None, deadline=None):
         pelias = None
         if auto_url:
-            pelias = cls.call_pelias_autocomplete(solr_params, auto_url)
+            pelias = cls.call_pelias_autocomplete(solr_params, auto_url, deadline)
 
+        # note: search is the fallback (optional) stage, so skip it when the request's deadline is near
         if search_url and (pelias is None or pelias.num_records() < 1):
-            pelias = cls.call_pelias_search(solr_params, search_url)
+            if pelias is None or has_time(deadline, cls.optional_stage_secs):
+                pelias = cls.call_pelias_search(solr_params, search_url, deadline)
 
         return pelias
 
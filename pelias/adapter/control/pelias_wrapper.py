@@ -1,10 +1,20 @@
-from ott.utils.svr.pyramid import response_utils
+import math
+from functools import lru_cache
+from urllib.parse import parse_qsl
+
 from ott.utils import html_utils
 from ott.utils import geo_utils
 from ott.utils import string_diff
 
 from . import pelias_json_queries
 from . import pelias_json_queries
+from . import upstream
+from .response_cache import ResponseCache, StaleResponse
+from .prefix_cache import PrefixCache, NegativeCache, empty_response
+from .reverse_cache import ReverseCache
+from .fan_out import FanOut, query_class
+from .deadline import has_time
+from .single_flight import SingleFlight
 
 import logging
 log = logging.getLogger(__file__)
@@ -17,6 +27,24 @@ class PeliasWrapper(object):
     rtp_agencies = []
     _rtp_agency_filter = None
 
+    # note: cache is (re)configured via config/base.ini in pyramid.views
+    response_cache = ResponseCache()
+    prefix_cache = PrefixCache()
+    negative_cache = NegativeCache()
+    reverse_cache = ReverseCache()
+    fan_out = FanOut()
+    single_flight = SingleFlight()
+    optional_stage_secs = 2.0  # skip optional stages (backup service, wrong-city re-query) with less time left on the deadline
+    cache_skip_params = ('_dc', '_')  # cache busters that don't change the Pelias response
+    negative_skip_params = ('text', 'size', 'focus.point.lat', 'focus.point.lon')  # params that don't turn a dead end alive
+
+    # note: the only properties fixup_response() labels are built from (see feature_label() and its memo)
+    label_properties = ('layer', 'id', 'name', 'label', 'street', 'neighbourhood', 'neighborhood', 'locality', 'county', 'postalcode', 'match_type')
+    label_memo = None
+
+    dedup_distance = 0.0007  # address features this close (lat & lon degrees) ...
+    dedup_likeness = 0.55    # ... and with names this alike, are dupes
+
     @classmethod
     def rtp_agency_filter(cls):
         """
@@ -53,18 +81,146 @@ class PeliasWrapper(object):
             pass
 
     @classmethod
-    def wrapp(cls, main_url, bkup_url, reverse_geo_url, query_string, def_size=10, in_recursion=False, is_calltaker=False, is_rtp=False):
-        """ will call either autocomplete or search """
+    def cache_key(cls, service_url, query_string, is_rtp=False, is_calltaker=False, skip_params=()):
+        """
+        canonical cache key for a request: (service, is_rtp, agency filter, normalized query params)
+        params are sorted and their values whitespace normalized, so 'text=5%20%20SE&size=6' == 'size=6&text=5%20SE'
+        :note: a trailing space on text is kept (as a single space) ... to Pelias autocomplete, it ends the last token
+        :param skip_params: leave these params out of the key (e.g., 'text' for a prefix cache scope)
+        """
+        params = []
+        for k, v in parse_qsl(query_string or "", keep_blank_values=True):
+            if k not in cls.cache_skip_params and k not in skip_params:
+                norm = ' '.join(v.split())
+                if k == 'text' and norm and v[-1].isspace():
+                    norm += ' '
+                params.append((k, norm))
+        agency_filter = None if is_rtp else cls.rtp_agency_filter()
+        return service_url, is_rtp, is_calltaker, agency_filter, tuple(sorted(params))
+
+    @classmethod
+    def is_cacheable(cls, rec):
+        """ only cache responses that look like a good Pelias FeatureCollection (e.g., not errors) """
+        ret_val = False
+        try:
+            if isinstance(rec, dict) and isinstance(rec.get('features'), list):
+                geocoding = rec.get('geocoding') or {}
+                ret_val = not geocoding.get('errors')
+        except Exception as e:
+            log.debug(e)
+        return ret_val
+
+    @classmethod
+    def reverse_cache_scope(cls, reverse_geo_url, query_string):
+        """
+        return (scope, lat, lon) for the reverse cache ... where scope is everything but the point (sources, layers, etc...)
+        :note: scope is None when the query doesn't have a usable point.lat / point.lon
+        """
+        ret_val = None, None, None
+        try:
+            params = dict(parse_qsl(query_string or ""))
+            lat = float(params['point.lat'])
+            lon = float(params['point.lon'])
+            if -90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0:
+                scope = cls.cache_key(reverse_geo_url, query_string, is_rtp=True, skip_params=('point.lat', 'point.lon'))
+                ret_val = scope, lat, lon
+        except (KeyError, ValueError) as e:
+            log.debug(e)
+        return ret_val
+
+    @classmethod
+    def is_autocomplete_url(cls, url):
+        return url is not None and url.rstrip('/').endswith('autocomplete')
+
+    @classmethod
+    def is_plain_text(cls, text):
+        """ prefix caching only makes sense for plain query text (e.g., not coords, not 'trimet', which gets rewritten) """
+        ret_val = False
+        if text:
+            is_trimet = len(text) <= 7 and text.lower() in "trimet"
+            ret_val = not is_trimet and not geo_utils.is_coord(text)
+        return ret_val
+
+    @classmethod
+    def call(cls, url, query_string, deadline=None):
+        """ upstream call, with whatever time is left on the request's deadline as its timeout (capped at the pool's timeout) """
+        if deadline is None:
+            ret_val = upstream.proxy_json(url, query_string)
+        elif deadline.expired():
+            ret_val = upstream.unavailable_response(f"{url}: request deadline of {deadline.secs} secs exceeded")
+        else:
+            ret_val = upstream.proxy_json(url, query_string, timeout=deadline.timeout(upstream.pool.timeout))
+        return ret_val
+
+    @classmethod
+    def cached_response(cls, url, query_string, is_rtp=False, is_calltaker=False):
+        """ whatever wrapp() / reverse() have cached for this query (even if it's expired) ... else None """
+        ret_val = None
+        if url and cls.response_cache.enabled:
+            ret_val = cls.response_cache.get(cls.cache_key(url, query_string, is_rtp, is_calltaker), allow_expired=True)
+        return ret_val
+
+    @classmethod
+    def wrapp(cls, main_url, bkup_url, reverse_geo_url, query_string, def_size=10, in_recursion=False, is_calltaker=False, is_rtp=False, refresh=False, deadline=None, in_flight=False):
+        """
+        will call either autocomplete or search
+        :param refresh: skip the cache lookups (but still cache the result) ... used to refresh stale cache entries
+        :param deadline: the request's Deadline ... upstream timeouts come from it, and optional stages get skipped when time is short
+        :param in_flight: this is the single-flight leader's call (see step 0b)
+        """
         ret_val = None
+        skipped_stage = False
+
+        # step 0: return a cached response if we've recently answered this same query
+        cache_key = None
+        if not in_recursion and cls.response_cache.enabled:
+            cache_key = cls.cache_key(main_url, query_string, is_rtp, is_calltaker)
+            if not refresh and not in_flight:
+                # note: when Pelias is down (breaker open), even expired responses beat an error
+                ret_val = cls.response_cache.get(cache_key, allow_expired=upstream.is_open(main_url))
+                if ret_val is not None:
+                    # step 0a: stale (past soft TTL) responses get served right away, and refreshed in the background
+                    if isinstance(ret_val, StaleResponse):
+                        cls.response_cache.refresh(cache_key, cls.wrapp, main_url, bkup_url, reverse_geo_url, query_string, def_size, is_calltaker=is_calltaker, is_rtp=is_rtp, refresh=True)
+                    return ret_val
+
+        # step 0b: identical queries that are already in flight wait for (and get a copy of) that one's answer
+        if not in_recursion and not in_flight and cls.single_flight.enabled:
+            flight_key = cache_key or cls.cache_key(main_url, query_string, is_rtp, is_calltaker)
+            return cls.single_flight.do(
+                flight_key, cls.wrapp, main_url, bkup_url, reverse_geo_url, query_string, def_size,
+                is_calltaker=is_calltaker, is_rtp=is_rtp, refresh=refresh, deadline=deadline, in_flight=True,
+                wait_secs=deadline.remaining() if deadline else None
+            )
 
         # step 1: break out the size and text parameters
         size = html_utils.get_numeric_value_from_qs(query_string, 'size', def_size)
         text = html_utils.get_param_value_from_qs(query_string, 'text')
 
+        plain_text = not in_recursion and cls.is_plain_text(text)
+        prefix_text = dict(parse_qsl(query_string)).get('text') if plain_text else None
+
+        # step 1a: dead ends ... if this query (or a prefix) found nothing from either service, don't bother asking again
+        negative_scope = None
+        if plain_text and cls.negative_cache.enabled:
+            services = tuple(sorted((main_url, bkup_url)))
+            negative_scope = cls.cache_key(services, query_string, is_rtp, skip_params=cls.negative_skip_params)
+            if not refresh and cls.negative_cache.get(negative_scope, prefix_text):
+                return empty_response(prefix_text)
+
+        # step 1b: type-ahead ... see whether filtering the result of a shorter (prefix) query answers this one
+        prefix_scope = None
+        if plain_text and cls.prefix_cache.enabled and cls.is_autocomplete_url(main_url):
+            prefix_scope = cls.cache_key(main_url, query_string, is_rtp, is_calltaker, skip_params=('text',))
+            if not refresh:
+                ret_val = cls.prefix_cache.get(prefix_scope, prefix_text)
+                if ret_val is not None:
+                    return ret_val
+
         # don't filter (below) if request already includes its own layers param
         has_layers = "layers" in query_string
 
-        # step 1b: filter agencies if we're in single-agency (TriMet) exclusive mode
+        # step 1c: filter agencies if we're in single-agency (TriMet) exclusive mode
         if not has_layers and not is_rtp and cls._rtp_agency_filter != SKIP:
             query_string = "{}&layers={}".format(query_string, cls.rtp_agency_filter())
 
@@ -73,7 +229,8 @@ class PeliasWrapper(object):
             x, y = geo_utils.ll_from_str(text)
             ll = geo_utils.xy_to_url_param_str(x, y, x_name="point.lon", y_name="point.lat", check_lat_lon=True)
             qs = "{}&{}".format(query_string, ll)
-            ret_val = response_utils.proxy_json(reverse_geo_url, qs)
+            ret_val = cls.call(reverse_geo_url, qs, deadline)
+            prefix_scope = negative_scope = None
 
         # step 3: call geocoder (if we didn't already reverse geocode, or if that result was null)
         if ret_val is None:
@@ -87,9 +244,31 @@ class PeliasWrapper(object):
                     query_string = query_string.replace(frm, to)
 
             # step 3b: call Pelias..and if autocomplete / search doesn't work, try the other service
-            ret_val = response_utils.proxy_json(main_url, query_string)
+            #          (with fan-out on, the other service is called in parallel ... and ignored if the primary has features)
+            alt_resp = None
+            if cls.fan_out.enabled:
+                ret_val, alt_resp = cls.fan_out.call(
+                    query_class(text),
+                    lambda: cls.call(main_url, query_string, deadline),
+                    lambda: cls.call(bkup_url, query_string, deadline),
+                    cls.has_features,
+                    deadline
+                )
+            else:
+                ret_val = cls.call(main_url, query_string, deadline)
+
             if not cls.has_features(ret_val):
-                alt_resp = response_utils.proxy_json(bkup_url, query_string)
+                prefix_scope = None
+                if alt_resp is None:
+                    if has_time(deadline, cls.optional_stage_secs):
+                        alt_resp = cls.call(bkup_url, query_string, deadline)
+                    else:
+                        skipped_stage = True
+
+                # step 3b2: neither service had anything, so remember this (prefix) as a dead end
+                if negative_scope and cls.is_cacheable(ret_val) and cls.is_cacheable(alt_resp) and not cls.has_features(alt_resp):
+                    cls.negative_cache.put(negative_scope, prefix_text)
+
                 if alt_resp and 'features' in alt_resp:
                     ret_val = alt_resp
 
@@ -100,7 +279,9 @@ class PeliasWrapper(object):
         # step 4: check whether the query result has something usable...
         if not in_recursion:
             # step 4a: if this is an admin record, let's see whether we can resub just street address
-            if cls.is_wrong_city_bug(ret_val):
+            if cls.is_wrong_city_bug(ret_val) and not has_time(deadline, cls.optional_stage_secs):
+                skipped_stage = True
+            elif cls.is_wrong_city_bug(ret_val):
                 """
                 This code addresses the WRONG CITY bug, etc...
                 https://github.com/OpenTransitTools/trimet-mod-pelias/issues/23 
@@ -115,41 +296,93 @@ class PeliasWrapper(object):
                 qs = qs.replace(' ', '%20')
 
                 # step 4c: re-call Pelias with our simple
-                r = cls.wrapp(main_url, bkup_url, reverse_geo_url, qs, def_size, is_calltaker=is_calltaker, is_rtp=is_rtp, in_recursion=True)
+                r = cls.wrapp(main_url, bkup_url, reverse_geo_url, qs, def_size, is_calltaker=is_calltaker, is_rtp=is_rtp, in_recursion=True, deadline=deadline)
                 if cls.has_features(r):
                     ret_val = r
+                    prefix_scope = None
 
         # step 5: clean up the label attribute
+        num_features = len(ret_val.get('features')) if cls.has_features(ret_val) else 0
         cls.fixup_response(ret_val, size, is_calltaker=is_calltaker, is_rtp=is_rtp)
 
+        # step 6: cache the final (fixed up) response ... unless it's a partial answer, due to the deadline
+        if skipped_stage:
+            cache_key = prefix_scope = None
+        if cache_key and cls.is_cacheable(ret_val):
+            cls.response_cache.put(cache_key, ret_val)
+
+        # step 6b: keep complete autocomplete results (not truncated at size, nothing dedup'd) for type-ahead prefix reuse
+        if prefix_scope and cls.is_cacheable(ret_val) and 0 < num_features < size and num_features == len(ret_val['features']):
+            cls.prefix_cache.put(prefix_scope, prefix_text, ret_val)
+
         return ret_val
 
     @classmethod
-    def reverse(cls, reverse_geo_url, query_string):
+    def reverse(cls, reverse_geo_url, query_string, refresh=False, deadline=None, in_flight=False):
         """
         call the reverse geocoder
         :note: pelias does not (seemingly) talk to the stops or other custom layers (just OSM, OA, etc...)
         :url: /reverse?point.lat=45.51423467680257&point.lon=-122.7097523397708
+        :param refresh: skip the cache lookups (but still cache the result) ... used to refresh stale cache entries
+        :param deadline: the request's Deadline (upstream timeouts come from it)
+        :param in_flight: this is the single-flight leader's call (see step 0a2)
         """
         #import pdb; pdb.set_trace()
         ret_val = None
 
-        # step 1: to get consistent results, we'll query just OSM data first (unless request of another source)
-        if "sources" not in query_string:
-            qs = f"{query_string}&sources=openstreetmap"
-            ret_val = response_utils.proxy_json(reverse_geo_url, qs)
+        # step 0: return a cached response if we've recently reverse geocoded this point
+        cache_key = None
+        if cls.response_cache.enabled:
+            cache_key = cls.cache_key(reverse_geo_url, query_string)
+            if not refresh and not in_flight:
+                ret_val = cls.response_cache.get(cache_key, allow_expired=upstream.is_open(reverse_geo_url))
+                if ret_val is not None:
+                    # step 0a: stale (past soft TTL) responses get served right away, and refreshed in the background
+                    if isinstance(ret_val, StaleResponse):
+                        cls.response_cache.refresh(cache_key, cls.reverse, reverse_geo_url, query_string, refresh=True)
+                    return ret_val
+
+        # step 0a2: identical reverse queries that are already in flight wait for (and get a copy of) that one's answer
+        if not in_flight and cls.single_flight.enabled:
+            flight_key = cache_key or cls.cache_key(reverse_geo_url, query_string)
+            return cls.single_flight.do(
+                flight_key, cls.reverse, reverse_geo_url, query_string, refresh=refresh, deadline=deadline, in_flight=True,
+                wait_secs=deadline.remaining() if deadline else None
+            )
+
+        # step 0b: nearby points (same quantized cell) share the raw Pelias answer, re-sorted by distance to this point
+        reverse_scope = None
+        if cls.reverse_cache.enabled:
+            reverse_scope, lat, lon = cls.reverse_cache_scope(reverse_geo_url, query_string)
+            if reverse_scope and not refresh:
+                ret_val = cls.reverse_cache.get(reverse_scope, lat, lon)
+
+        if ret_val is None:
+            # step 1: to get consistent results, we'll query just OSM data first (unless request of another source)
+            if "sources" not in query_string:
+                qs = f"{query_string}&sources=openstreetmap"
+                ret_val = cls.call(reverse_geo_url, qs, deadline)
 
-        # step 2: yet to find a result, then call the reverse geocoder without specifying openstreetmap
-        features = ret_val.get('features') if ret_val else None
-        if features is None or len(features) < 1:
-            ret_val = response_utils.proxy_json(reverse_geo_url, query_string)
-            features = ret_val.get('features')
+            # step 2: yet to find a result, then call the reverse geocoder without specifying openstreetmap
+            features = ret_val.get('features') if ret_val else None
+            if features is None or len(features) < 1:
+                ret_val = cls.call(reverse_geo_url, query_string, deadline)
+
+            # step 2b: cache the raw response for this point's cell
+            if reverse_scope and cls.is_cacheable(ret_val):
+                cls.reverse_cache.put(reverse_scope, lat, lon, ret_val)
+
+        features = ret_val.get('features')
 
         # step 3 & 4: sort addresses to the top, then fix things up
         if features:
             ret_val['features'] = cls.sort_features(features)
             cls.fixup_response(ret_val)
 
+        # step 5: cache the final (fixed up) response
+        if cache_key and cls.is_cacheable(ret_val):
+            cls.response_cache.put(cache_key, ret_val)
+
         return ret_val
 
     @classmethod
@@ -190,6 +423,34 @@ class PeliasWrapper(object):
     def get_property_value(cls, rec, *names):
         return pelias_json_queries.get_element_value(rec, *names)
 
+    @classmethod
+    def dedup_cell(cls, feature):
+        """
+        grid cell of a feature's point (or None when it doesn't have one) ... the cells are 2x dedup_distance wide,
+        so features within dedup_distance of each other are always in the same or neighboring cells
+        """
+        try:
+            lon, lat = feature['geometry']['coordinates'][:2]
+            size = cls.dedup_distance * 2
+            ret_val = (math.floor(lon / size), math.floor(lat / size))
+        except (KeyError, TypeError, ValueError, OverflowError):
+            ret_val = None
+        return ret_val
+
+    @classmethod
+    def dedup_candidates(cls, grid, unplaced, cell):
+        """ kept addresses that might be near cell (all of them for a feature w/out a point), in the order they were kept """
+        if cell is None:
+            ret_val = unplaced + [c for cands in grid.values() for c in cands]
+        else:
+            x, y = cell
+            ret_val = list(unplaced)
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    ret_val.extend(grid.get((x + dx, y + dy), ()))
+        ret_val.sort(key=lambda c: c[0])
+        return [f for i, f in ret_val]
+
     @classmethod
     def dedup_addresses(cls, features):
         """
@@ -206,8 +467,11 @@ class PeliasWrapper(object):
         if features is None or len(features) < 2:
             return features
 
-        # step a: loop thru all features, looking to cull
-        prev = []
+        # step a: loop thru all features, looking to cull ... kept addresses are indexed by grid cell, so each
+        #         feature is compared to just the ones in its neighborhood, not every previous address
+        grid = {}
+        unplaced = []
+        num_kept = 0
         for f in features:
             fprops = f.get('properties')
             fname = fprops.get('name')
@@ -216,23 +480,27 @@ class PeliasWrapper(object):
             if fprops and fprops.get('layer') in ('address'):
                 do_filter = False
 
-                if len(prev) > 0:
-                    #import pdb; pdb.set_trace()
-                    for p in prev:
-                        # step c: if the name of our feature looks a bit (50%) like a previous feature...
-                        pname = p.get('properties').get('name')
-                        name_likeness = string_diff.compare(fname, pname)
-                        if name_likeness > 0.55:
-                            # step d: ...and if our feature is very close to that previous feature, then filter it
-                            dist = 0.0007
-                            if geo_utils.are_points_nearby(f, p, decimal_diff=dist):
-                                msg = f"filter {fname}, as it looks like a dupe of {pname}"
-                                log.debug(msg)
-                                do_filter = True
-                                break
+                cell = cls.dedup_cell(f)
+                for p in cls.dedup_candidates(grid, unplaced, cell):
+                    # step c: if our feature is very close to a previous feature...
+                    if not geo_utils.are_points_nearby(f, p, decimal_diff=cls.dedup_distance):
+                        continue
+
+                    # step d: ...and its name looks a bit (50%) like that previous feature's, then filter it
+                    #         (note: the same name is as alike as it gets ... no need for the string_diff)
+                    pname = p.get('properties').get('name')
+                    if (fname == pname and isinstance(fname, str)) or string_diff.compare(fname, pname) > cls.dedup_likeness:
+                        msg = f"filter {fname}, as it looks like a dupe of {pname}"
+                        log.debug(msg)
+                        do_filter = True
+                        break
 
                 if not do_filter:
-                    prev.append(f)
+                    if cell is None:
+                        unplaced.append((num_kept, f))
+                    else:
+                        grid.setdefault(cell, []).append((num_kept, f))
+                    num_kept += 1
                     filtered.append(f)
             else:
                 filtered.append(f)
@@ -259,68 +527,113 @@ class PeliasWrapper(object):
                 if p is None:
                     continue
 
-                rename = None
-
-                # step 4: for venues, rename the venue with the neighborhood & city
-                if p.get('layer') in ('venue', 'major_employer', 'fare', 'fare_outlet'):
-                    name = cls.get_property_value(p, 'name', 'label')
-                    street = pelias_json_queries.street_name(p, include_number=False)
-                    city = pelias_json_queries.neighborhood_and_city(p, sep=' - ')
-                    rename = pelias_json_queries.append3(name, street, city)
-
-                # step 5: for stops, possibly reduce the size of the string
-                if "stops" in p.get('layer'):
-                    name = cls.get_property_value(p, 'name', 'label')
-
-                    # 5a: if we're just a single agency (and TriMet), then strip off junk
-                    if not is_rtp and "TRIMET" in p.get('id'):
-                        name = name.replace("TriMet Stop ", "")
-
-                        # backward compatible for old TORA id formatting of id::TRIMET::stops
-                        # a stop page (https://trimet.org/home/stop/4) via geocoder https://trimet.org/home/search
-                        # TODO: should probably remove this eventually
-                        if "stops:TRIMET" in p.get('id'):
-                            idz = p.get('id').replace("stops:TRIMET:", "")
-                            p['id'] = "{}::TRIMET::stops".format(idz)
-
-                    # 5b: remove "stops:" from ID to get TORA RTP to work properly
-                    #     TODO: should probably remove this and have TORA use addendum
-                    if is_rtp and "stops:" in p.get('id'):
-                        p['id'] = p.get('id').replace("stops:", "")
-
-                    # 5c: remove state and country from the label
-                    if name and len(name) > 10:
-                        city = pelias_json_queries.neighborhood_and_city(p, sep=' - ')
-                        rename = pelias_json_queries.append(name, city)
-
-                # step 6: rename routes
-                elif p.get('layer') == 'routes':
-                    name = cls.get_property_value(p, 'name', 'label')
-                    route_lbl = "Transit Route"
-                    if "TRIMET" in p.get('id'):
-                        route_lbl = "TriMet Route" 
-                    rename = f"{name} ({route_lbl})"
-                    
-                # step 6: Post Office ... add zipcode to label
-                elif p.get('layer') == 'post_office':
-                    name = cls.get_property_value(p, 'name', 'label')
-                    zipcode = cls.get_property_value(p, 'postalcode')
-                    rename = pelias_json_queries.append3(name, 'Post Office', zipcode, sep1=' ')
-
-                # step 7: default rename is to add city or region, etc...
-                else:
-                    name = cls.get_property_value(p, 'name', 'label')
-                    city = pelias_json_queries.city_neighborhood_or_county(p)
-                    rename = pelias_json_queries.append(name, city)
-
-                # step 8: append '*' to any calltaker response when dealing with  interpolated recs
-                if is_calltaker and p.get('match_type') == "interpolated":
-                    rename = "*" + rename 
-
-                # step 9: apply the rename to this record's properties dict
+                # step 4: label (and id) rewrites are a function of just a few properties ... so memoize them
+                values = tuple(p.get(n) for n in cls.label_properties)
+                try:
+                    rename, new_id = cls.label_memo(values, is_calltaker, is_rtp)
+                except TypeError:
+                    # note: unhashable property value (or a broken record) ... just run the string logic
+                    rename, new_id = cls.feature_label(values, is_calltaker, is_rtp)
+
+                # step 5: apply the id and rename to this record's properties dict
+                if new_id:
+                    p['id'] = new_id
                 if rename:
                     p[ele] = rename
 
+    @classmethod
+    def config_label_memo(cls, max_entries=10000):
+        """ bounded (LRU) memo in front of feature_label() ... max_entries=0 turns it off """
+        if max_entries > 0:
+            cls.label_memo = lru_cache(maxsize=max_entries)(cls.feature_label)
+        else:
+            cls.label_memo = cls.feature_label
+
+    @classmethod
+    def label_memo_stats(cls):
+        ret_val = {'enabled': False}
+        if hasattr(cls.label_memo, 'cache_info'):
+            info = cls.label_memo.cache_info()
+            lookups = info.hits + info.misses
+            ret_val = {
+                'enabled': True,
+                'entries': info.currsize,
+                'max_entries': info.maxsize,
+                'hits': info.hits,
+                'misses': info.misses,
+                'hit_rate': round(info.hits / lookups, 4) if lookups else 0.0,
+            }
+        return ret_val
+
+    @classmethod
+    def feature_label(cls, values, is_calltaker=False, is_rtp=False):
+        """
+        renaming / relabeling of a single feature
+        :param values: the feature's property values, in label_properties order
+        :return: (new label or None, new id or None)
+        """
+        p = dict(zip(cls.label_properties, values))
+        rename = None
+        new_id = None
+
+        # step 1: for venues, rename the venue with the neighborhood & city
+        if p.get('layer') in ('venue', 'major_employer', 'fare', 'fare_outlet'):
+            name = cls.get_property_value(p, 'name', 'label')
+            street = pelias_json_queries.street_name(p, include_number=False)
+            city = pelias_json_queries.neighborhood_and_city(p, sep=' - ')
+            rename = pelias_json_queries.append3(name, street, city)
+
+        # step 2: for stops, possibly reduce the size of the string
+        if "stops" in p.get('layer'):
+            name = cls.get_property_value(p, 'name', 'label')
+
+            # 2a: if we're just a single agency (and TriMet), then strip off junk
+            if not is_rtp and "TRIMET" in p.get('id'):
+                name = name.replace("TriMet Stop ", "")
+
+                # backward compatible for old TORA id formatting of id::TRIMET::stops
+                # a stop page (https://trimet.org/home/stop/4) via geocoder https://trimet.org/home/search
+                # TODO: should probably remove this eventually
+                if "stops:TRIMET" in p.get('id'):
+                    idz = p.get('id').replace("stops:TRIMET:", "")
+                    new_id = p['id'] = "{}::TRIMET::stops".format(idz)
+
+            # 2b: remove "stops:" from ID to get TORA RTP to work properly
+            #     TODO: should probably remove this and have TORA use addendum
+            if is_rtp and "stops:" in p.get('id'):
+                new_id = p['id'] = p.get('id').replace("stops:", "")
+
+            # 2c: remove state and country from the label
+            if name and len(name) > 10:
+                city = pelias_json_queries.neighborhood_and_city(p, sep=' - ')
+                rename = pelias_json_queries.append(name, city)
+
+        # step 3: rename routes
+        elif p.get('layer') == 'routes':
+            name = cls.get_property_value(p, 'name', 'label')
+            route_lbl = "Transit Route"
+            if "TRIMET" in p.get('id'):
+                route_lbl = "TriMet Route" 
+            rename = f"{name} ({route_lbl})"
+            
+        # step 3: Post Office ... add zipcode to label
+        elif p.get('layer') == 'post_office':
+            name = cls.get_property_value(p, 'name', 'label')
+            zipcode = cls.get_property_value(p, 'postalcode')
+            rename = pelias_json_queries.append3(name, 'Post Office', zipcode, sep1=' ')
+
+        # step 4: default rename is to add city or region, etc...
+        else:
+            name = cls.get_property_value(p, 'name', 'label')
+            city = pelias_json_queries.city_neighborhood_or_county(p)
+            rename = pelias_json_queries.append(name, city)
+
+        # step 5: append '*' to any calltaker response when dealing with  interpolated recs
+        if is_calltaker and p.get('match_type') == "interpolated":
+            rename = "*" + rename 
+
+        return rename, new_id
+
     #### TODO -- replace the routines below with 'fixup_response' above ???
     @classmethod
     def rename(cls, pelias_json, def_val=None):
@@ -340,3 +653,6 @@ class PeliasWrapper(object):
         except:
             pass
         return ret_val
+
+
+PeliasWrapper.config_label_memo()
@@ -0,0 +1,234 @@
+"""
+type-ahead (autocomplete) caches keyed on query prefixes
+
+type-ahead clients send a request per keystroke, so 'text=834 SE Lambe' usually follows 'text=834 SE Lamb'
+by a few milliseconds. when the shorter query's result was complete (e.g., not truncated at 'size'), the
+longer query's answer is that same result, filtered down to the features that still match.
+likewise, once a prefix is a dead end (nothing from either autocomplete or search), so are its extensions.
+"""
+import re
+import threading
+import time
+
+from .response_cache import ResponseCache
+
+import logging
+log = logging.getLogger(__file__)
+
+TOKEN_RE = re.compile(r"\w+")
+
+# feature properties that Pelias (roughly) matches query text against
+MATCH_PROPERTIES = ('name', 'label', 'housenumber', 'street', 'postalcode', 'neighbourhood', 'locality', 'county', 'region', 'region_a')
+
+
+def normalize_text(text):
+    """ lower case and collapse whitespace ... but keep (a single) trailing separator, since that ends the last token """
+    ret_val = ""
+    if text:
+        ret_val = ' '.join(text.lower().split())
+        if ret_val and not text[-1].isalnum():
+            ret_val += ' '
+    return ret_val
+
+
+def feature_tokens(feature):
+    """ set of (lower case) word tokens found in a feature's matchable properties """
+    p = feature.get('properties') or {}
+    vals = [str(p.get(n)) for n in MATCH_PROPERTIES if p.get(n)]
+    return set(TOKEN_RE.findall(' '.join(vals).lower()))
+
+
+def matches(text, tokens):
+    """
+    mimic Pelias autocomplete matching: every complete query token has to match a feature token,
+    while the last (partially typed) token need only be a prefix of some feature token
+    :param text: normalized query text (see normalize_text above)
+    """
+    query_tokens = TOKEN_RE.findall(text)
+    if not query_tokens:
+        return False
+
+    last = None
+    if text[-1].isalnum():
+        last = query_tokens.pop()
+
+    for t in query_tokens:
+        if t not in tokens:
+            return False
+
+    if last and not any(t.startswith(last) for t in tokens):
+        return False
+
+    return True
+
+
+def bbox(features):
+    """ [min lon, min lat, max lon, max lat] of a list of point features """
+    ret_val = None
+    try:
+        coords = [f['geometry']['coordinates'] for f in features]
+        lons = [c[0] for c in coords]
+        lats = [c[1] for c in coords]
+        ret_val = [min(lons), min(lats), max(lons), max(lats)]
+    except Exception as e:
+        log.debug(e)
+    return ret_val
+
+
+class PrefixCache(object):
+    """
+    answer an autocomplete query by filtering the cached result of a shorter (prefix) query
+
+    results only get stored when every feature can be explained by our simple token matching (see above),
+    so when Pelias matched on something we don't model (synonyms, fuzziness, stop codes), the entry never
+    gets reused. likewise, a prefix hit that filters down to nothing falls thru to Pelias.
+    :note: callers are responsible for only put()'ing complete results (e.g., fewer features than 'size')
+    """
+    def __init__(self, max_entries=2000, max_bytes=16*1024*1024, ttl=60, min_chars=2, clock=time.monotonic):
+        self.cache = ResponseCache(max_entries=max_entries, max_bytes=max_bytes, ttl=ttl, clock=clock)
+        self.min_chars = min_chars
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fallthroughs = 0
+        self.stored = 0
+        self.rejected = 0
+
+    @property
+    def enabled(self):
+        return self.cache.enabled
+
+    def put(self, scope, text, response):
+        """ remember a complete autocomplete response for text, within scope (service, params other than text, etc...) """
+        norm = normalize_text(text)
+        features = response.get('features') if response else None
+        if len(norm) < self.min_chars or not features:
+            return False
+
+        ret_val = False
+        if all(matches(norm, feature_tokens(f)) for f in features):
+            ret_val = self.cache.put((scope, norm), response)
+
+        with self._lock:
+            if ret_val:
+                self.stored += 1
+            else:
+                self.rejected += 1
+        return ret_val
+
+    def get(self, scope, text):
+        """ return the longest cached prefix's result, filtered down to features that match text (or None) """
+        norm = normalize_text(text)
+        for n in range(len(norm) - 1, self.min_chars - 1, -1):
+            cached = self.cache.get((scope, norm[:n]))
+            if cached is None:
+                continue
+
+            features = [f for f in cached.get('features') if matches(norm, feature_tokens(f))]
+            if not features:
+                with self._lock:
+                    self.fallthroughs += 1
+                return None
+
+            cached['features'] = features
+            if 'bbox' in cached:
+                cached['bbox'] = bbox(features)
+            try:
+                cached['geocoding']['query']['text'] = text
+            except (KeyError, TypeError):
+                pass
+
+            with self._lock:
+                self.hits += 1
+            return cached
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.fallthroughs
+            ret_val = {
+                'entries': len(self.cache),
+                'bytes': self.cache.stats()['bytes'],
+                'hits': self.hits,
+                'misses': self.misses,
+                'fallthroughs': self.fallthroughs,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'stored': self.stored,
+                'rejected': self.rejected,
+                'upstream_calls_saved': self.hits,
+            }
+        return ret_val
+
+
+def empty_response(text):
+    """ an empty Pelias FeatureCollection for text """
+    return {
+        'geocoding': {'query': {'text': text}},
+        'type': 'FeatureCollection',
+        'features': [],
+    }
+
+
+class NegativeCache(object):
+    """
+    remember query prefixes that came back empty from both autocomplete and search (e.g., dead ends)
+
+    prefix-monotonic: if '834 XQZ' found nothing (in a given layers / sources / is_rtp scope), then
+    '834 XQZV' won't either ... so answer it with an empty FeatureCollection, rather than two more upstream calls
+    :note: keep the TTL short, since new data (or a Pelias hiccup) could make a dead end come alive
+    """
+    def __init__(self, max_entries=5000, ttl=30, min_chars=3, calls_per_query=2, clock=time.monotonic):
+        self.cache = ResponseCache(max_entries=max_entries, max_bytes=max_entries * 1024, ttl=ttl, clock=clock)
+        self.min_chars = min_chars
+        self.calls_per_query = calls_per_query
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+
+    @property
+    def enabled(self):
+        return self.cache.enabled
+
+    def put(self, scope, text):
+        """ record text as a dead end within scope """
+        ret_val = False
+        norm = normalize_text(text).strip()
+        if len(norm) >= self.min_chars:
+            ret_val = self.cache.put((scope, norm), True)
+            if ret_val:
+                with self._lock:
+                    self.recorded += 1
+        return ret_val
+
+    def get(self, scope, text):
+        """ True if text (or any prefix of text) is a known dead end within scope """
+        norm = normalize_text(text).strip()
+        for n in range(self.min_chars, len(norm) + 1):
+            if self.cache.get((scope, norm[:n])):
+                with self._lock:
+                    self.hits += 1
+                return True
+
+        with self._lock:
+            self.misses += 1
+        return False
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            ret_val = {
+                'entries': len(self.cache),
+                'ttl': self.cache.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'recorded': self.recorded,
+                'upstream_calls_saved': self.hits * self.calls_per_query,
+            }
+        return ret_val
@@ -0,0 +1,207 @@
+"""
+in-process response cache for the Pelias wrapper
+
+bounded (by entry count and by approximate memory), thread-safe, per-entry TTL with LRU eviction.
+values are stored as serialized json, so each get() hands back a fresh copy that the caller is
+free to muck with (e.g., refine, append_hostname_to_json, etc...) without corrupting the cache
+
+entries have a soft TTL (ttl) and a hard TTL (ttl + stale_ttl). in between the two, get() still returns
+the entry, but as a StaleResponse ... the caller should serve it right away and refresh() it in the
+background. when that refresh errors (e.g., Pelias is down), nothing gets put(), so the stale entry keeps
+being served up until the hard TTL. and while the upstream's circuit breaker is open, get(allow_expired=True)
+serves entries that are past even the hard TTL (as long as they haven't been evicted).
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import logging
+log = logging.getLogger(__file__)
+
+
+class StaleResponse(dict):
+    """ a cached response that's past its soft TTL ... views mark these with a 'Warning: 110' header """
+    is_stale = True
+
+
+class CacheEntry(object):
+    __slots__ = ('body', 'size', 'stale', 'expires')
+
+    def __init__(self, body, size, stale, expires):
+        self.body = body
+        self.size = size
+        self.stale = stale
+        self.expires = expires
+
+
+class ResponseCache(object):
+    """
+    LRU cache of json-able responses
+    :note: max_entries=0 (or max_bytes=0) turns the cache off ... get() always misses, put() is a no-op
+    :note: stale_ttl=0 (the default) means entries are never served stale
+    """
+    def __init__(self, max_entries=5000, max_bytes=64*1024*1024, ttl=300, stale_ttl=0, refresh_threads=4, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.refresh_threads = refresh_threads
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._refreshing = set()
+        self._executor = None
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.inserts = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, def_val=None, allow_expired=False):
+        """
+        return a (fresh) copy of the cached value, or def_val if the key is missing or expired
+        :note: values past the soft TTL come back as a StaleResponse (see refresh() below)
+        :param allow_expired: last resort (e.g., the upstream is down) ... expired values come back as a StaleResponse
+        """
+        if not self.enabled:
+            return def_val
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return def_val
+
+            now = self.clock()
+            if entry.expires <= now and not allow_expired:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return def_val
+
+            is_stale = entry.stale <= now
+            self._entries.move_to_end(key)
+            if is_stale:
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+            body = entry.body
+
+        # note: deserialize outside of the lock ... bytes are immutable
+        ret_val = json.loads(body)
+        if is_stale:
+            ret_val = StaleResponse(ret_val)
+        return ret_val
+
+    def expiring(self, key, within=0):
+        """ is key missing, or due to go stale in less than within secs? ... just a peek, not counted as a hit or a miss """
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is None or entry.stale < self.clock() + within
+
+    def refresh(self, key, func, *args, **kwargs):
+        """
+        run func(*args, **kwargs) in the background to refresh a stale entry ... func is expected to put() the new value
+        :note: only one refresh per key is in flight at any given time
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.refresh_threads, thread_name_prefix="cache-refresh")
+
+        def do_refresh():
+            try:
+                func(*args, **kwargs)
+                with self._lock:
+                    self.refreshes += 1
+            except Exception as e:
+                log.warning(f"background refresh of {key} failed: {e}")
+                with self._lock:
+                    self.refresh_errors += 1
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._executor.submit(do_refresh)
+        return True
+
+    def put(self, key, value, ttl=None):
+        """ serialize and store value ... evicting least recently used entries to stay under the limits """
+        if not self.enabled or value is None:
+            return False
+
+        try:
+            body = json.dumps(value).encode('utf-8')
+        except (TypeError, ValueError) as e:
+            log.debug(e)
+            return False
+
+        size = len(body)
+        if size > self.max_bytes:
+            return False
+
+        stale = self.clock() + (self.ttl if ttl is None else ttl)
+        expires = stale + self.stale_ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = CacheEntry(body, size, stale, expires)
+            self._bytes += size
+            self.inserts += 1
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                old_key = next(iter(self._entries))
+                self._remove(old_key)
+                self.evictions += 1
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """ counters used to size the cache in production """
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            ret_val = {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'stale_ttl': self.stale_ttl,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+                'inserts': self.inserts,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'refreshes': self.refreshes,
+                'refresh_errors': self.refresh_errors,
+                'refreshing': len(self._refreshing),
+            }
+        return ret_val
+
+    def _remove(self, key):
+        """ note: caller must hold the lock """
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
@@ -0,0 +1,147 @@
+"""
+reverse geocode cache, keyed on a geohash (spatially quantized) cell of the requested point
+
+trip planner clients send coordinates that differ in the 6th decimal place for the same street corner,
+so an exact-match cache rarely hits. instead, points that land in the same geohash cell share the
+(raw) Pelias answer, which then gets re-sorted by distance to the exact point that was requested.
+
+geohash cell sizes (approx, at the equator):
+    6 = 1.2km x 610m,  7 = 153m x 153m,  8 = 38m x 19m,  9 = 4.8m x 4.8m
+"""
+import math
+import threading
+import time
+
+from .response_cache import ResponseCache
+
+import logging
+log = logging.getLogger(__file__)
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+EARTH_RADIUS_KM = 6371.0
+
+
+def geohash(lat, lon, precision=8):
+    """ encode lat / lon as a geohash string of 'precision' characters """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    ret_val = []
+    ch = 0
+    bit = 0
+    even = True
+    while len(ret_val) < precision:
+        rng, val = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if val >= mid:
+            ch |= 1 << (4 - bit)
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+
+        if bit < 4:
+            bit += 1
+        else:
+            ret_val.append(BASE32[ch])
+            bit = 0
+            ch = 0
+    return ''.join(ret_val)
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """ haversine (great circle) distance in kilometers """
+    p1 = math.radians(lat1)
+    p2 = math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def redistance_features(features, lat, lon):
+    """ recalculate each feature's 'distance' property (km, ala Pelias) relative to lat / lon, and sort nearest first """
+    for f in features:
+        try:
+            f_lon, f_lat = f['geometry']['coordinates'][:2]
+            f['properties']['distance'] = round(distance_km(lat, lon, f_lat, f_lon), 3)
+        except (KeyError, TypeError, ValueError) as e:
+            log.debug(e)
+    return sorted(features, key=lambda f: (f.get('properties') or {}).get('distance', float('inf')))
+
+
+class ReverseCache(object):
+    """
+    geohash cell cache of raw reverse geocoder responses
+
+    besides the configured (active) precision, a set of 'shadow' precisions track which cells have been
+    seen recently, so stats() reports the hit rate each cell size would get ... e.g., to trade precision
+    for cache efficiency
+    """
+    def __init__(self, precision=8, shadow_precisions=(6, 7, 8, 9), max_entries=5000, max_bytes=32*1024*1024, ttl=3600, clock=time.monotonic):
+        self.precision = precision
+        self.cache = ResponseCache(max_entries=max_entries, max_bytes=max_bytes, ttl=ttl, clock=clock)
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        self.shadows = {}
+        self.shadow_hits = {}
+        for p in sorted(set(shadow_precisions) | {precision}):
+            self.shadows[p] = ResponseCache(max_entries=max_entries, max_bytes=max_entries * 1024, ttl=ttl, clock=clock)
+            self.shadow_hits[p] = 0
+
+    @property
+    def enabled(self):
+        return self.cache.enabled and self.precision > 0
+
+    def get(self, scope, lat, lon):
+        """ return a copy of the cell's response (features re-sorted by distance to lat / lon), or None """
+        self.track_shadows(scope, lat, lon)
+
+        ret_val = self.cache.get((scope, geohash(lat, lon, self.precision)))
+        with self._lock:
+            if ret_val is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if ret_val is not None:
+            features = ret_val.get('features')
+            if features:
+                ret_val['features'] = redistance_features(features, lat, lon)
+            try:
+                ret_val['geocoding']['query']['point.lat'] = lat
+                ret_val['geocoding']['query']['point.lon'] = lon
+            except (KeyError, TypeError):
+                pass
+        return ret_val
+
+    def put(self, scope, lat, lon, response):
+        return self.cache.put((scope, geohash(lat, lon, self.precision)), response)
+
+    def track_shadows(self, scope, lat, lon):
+        """ would a cache of each precision have hit? (then mark the cell as seen) """
+        for p, shadow in self.shadows.items():
+            key = (scope, geohash(lat, lon, p))
+            if shadow.get(key):
+                with self._lock:
+                    self.shadow_hits[p] += 1
+            else:
+                shadow.put(key, True)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            ret_val = {
+                'precision': self.precision,
+                'entries': len(self.cache),
+                'bytes': self.cache.stats()['bytes'],
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'hit_rate_by_precision': {
+                    p: round(h / lookups, 4) if lookups else 0.0 for p, h in self.shadow_hits.items()
+                },
+            }
+        return ret_val
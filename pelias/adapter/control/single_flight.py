@@ -0,0 +1,98 @@
+"""
+single-flight request coalescing
+
+at rush hour, lots of clients ask for the same popular stop at the same moment. rather than each of them
+making its own set of upstream calls, the first caller (the leader) makes the calls, and identical
+queries that arrive while it's in flight wait for it and get their own (deep) copy of its answer. the
+leader only snapshots its answer (for those copies) when somebody actually joined its flight.
+"""
+import copy
+import json
+import threading
+
+import logging
+log = logging.getLogger(__file__)
+
+
+class Flight(object):
+    __slots__ = ('done', 'waiters', 'body', 'value', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.waiters = 0
+        self.body = None
+        self.value = None
+        self.error = None
+
+    def copy(self):
+        """ each waiter gets its own copy to muck with (append hostname, refine, etc...) """
+        if self.body is not None:
+            return json.loads(self.body)
+        return copy.deepcopy(self.value)
+
+
+class SingleFlight(object):
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.wait_timeouts = 0
+
+    def do(self, key, func, *args, wait_secs=None, **kwargs):
+        """
+        return func(*args, **kwargs) ... or, when an identical call (same key) is already in flight, a copy of its result
+        :param wait_secs: longest a waiter will wait on the leader, before making its own call (e.g., the deadline)
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = self._flights[key] = Flight()
+                self.leaders += 1
+            else:
+                flight.waiters += 1
+                self.coalesced += 1
+
+        if is_leader:
+            try:
+                ret_val = func(*args, **kwargs)
+                # note: snapshot the result before handing it back (the leader's caller will change it) ... but only
+                #       when someone joined this flight, as most are never joined (no one can join once it's popped)
+                with self._lock:
+                    self._flights.pop(key, None)
+                if flight.waiters > 0:
+                    try:
+                        flight.body = json.dumps(ret_val)
+                    except (TypeError, ValueError):
+                        flight.value = copy.deepcopy(ret_val)
+                return ret_val
+            except Exception as e:
+                flight.error = e
+                raise
+            finally:
+                with self._lock:
+                    self._flights.pop(key, None)
+                flight.done.set()
+
+        if not flight.done.wait(wait_secs):
+            with self._lock:
+                self.wait_timeouts += 1
+            return func(*args, **kwargs)
+        if flight.error is not None:
+            raise flight.error
+        return flight.copy()
+
+    def stats(self):
+        with self._lock:
+            calls = self.leaders + self.coalesced
+            ret_val = {
+                'enabled': self.enabled,
+                'in_flight': len(self._flights),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'coalesced_rate': round(self.coalesced / calls, 4) if calls else 0.0,
+                'wait_timeouts': self.wait_timeouts,
+            }
+        return ret_val
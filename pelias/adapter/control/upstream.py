@@ -0,0 +1,577 @@
+"""
+pooled, keep-alive http for every upstream call (Pelias autocomplete / search / reverse, route stops, etc...)
+
+one shared requests.Session, whose urllib3 pools are sized to the number of waitress threads (each thread
+holds at most one connection to a given host), so TCP and TLS setup to ws.trimet.org is paid once per
+connection instead of once per call. optionally:
+  - max_per_host caps the number of concurrent calls to any one host (callers wait up to the timeout)
+  - dns_ttl caches host name lookups of the upstream hosts (new connections only ... keep-alive connections never look up)
+  - hedging: when a call hasn't answered within the host's (say) p95 latency, a duplicate call is sent and
+    whichever answers first wins ... capped by a budget, as a percentage of all calls
+  - circuit breakers: after N straight failures (errors or 5xx) of a configured upstream url, calls to it fail fast
+    (CircuitOpen) for reset_secs, after which a single probe call decides whether to close the breaker again
+
+:see: config/base.ini for the upstream_* settings
+"""
+import contextvars
+import socket
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ott.utils.svr.pyramid import response_utils
+
+from .backends import BackendPool
+
+import logging
+log = logging.getLogger(__file__)
+
+# note: set (via observed()) only while a request admitted by the adaptive limiter runs ... so its upstream calls,
+#       and the hedges / fan-out backups made for it (those copy the context), feed the limiter, while background work
+#       (route stop preload & refresh, cache warming, cache refreshes) doesn't
+latency_observer = contextvars.ContextVar('latency_observer', default=None)
+
+
+def observed(observer, func, *args, **kwargs):
+    """ func(*args, **kwargs), with the latency (and success) of each upstream call it makes handed to observer(secs, ok) """
+    token = latency_observer.set(observer)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        latency_observer.reset(token)
+
+
+class UpstreamBusy(requests.exceptions.RequestException):
+    """ waited too long for one of the max_per_host slots """
+    pass
+
+
+class CircuitOpen(requests.exceptions.RequestException):
+    """ the upstream's circuit breaker is open ... the call wasn't made """
+    pass
+
+
+class CircuitBreaker(object):
+    """ closed -> (failure_threshold straight failures) -> open -> (reset_secs) -> half open -> (probe ok) -> closed """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, reset_secs=30, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_secs = reset_secs
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.probing = False
+        self.rejected = 0
+        self.transitions = Counter()
+
+    def _transition(self, state):
+        """ note: caller must hold the lock """
+        self.transitions["{}->{}".format(self.state, state)] += 1
+        log.warning(f"circuit breaker {self.name}: {self.state} -> {state}")
+        self.state = state
+
+    def allow(self):
+        """ may a call go thru? (in the half open state, only a single probe call at a time) """
+        with self._lock:
+            if self.state == self.OPEN and self.clock() >= self.opened_at + self.reset_secs:
+                self._transition(self.HALF_OPEN)
+                self.probing = False
+
+            ret_val = self.state == self.CLOSED or (self.state == self.HALF_OPEN and not self.probing)
+            if ret_val and self.state == self.HALF_OPEN:
+                self.probing = True
+            if not ret_val:
+                self.rejected += 1
+        return ret_val
+
+    def is_open(self):
+        with self._lock:
+            return self.state == self.OPEN and self.clock() < self.opened_at + self.reset_secs
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.probing = False
+            if self.state != self.CLOSED:
+                self._transition(self.CLOSED)
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self._transition(self.OPEN)
+                self.opened_at = self.clock()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'rejected': self.rejected,
+                'transitions': dict(self.transitions),
+            }
+
+
+class DnsCache(object):
+    """
+    TTL cache in front of socket.getaddrinfo ... when a lookup fails, the last good answer is used (up to 10x the TTL)
+    :note: install() replaces socket.getaddrinfo process wide, so only the given hosts (the upstreams) are cached ...
+           every other lookup (other libraries, etc...) goes straight to the real getaddrinfo, as it did before
+    :param hosts: host names to cache (None == every host)
+    """
+    def __init__(self, ttl=60, hosts=None, getaddrinfo=socket.getaddrinfo, clock=time.monotonic):
+        self.ttl = ttl
+        self.hosts = set(hosts) if hosts is not None else None
+        self.getaddrinfo = getaddrinfo
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def __call__(self, host, port, *args, **kwargs):
+        if self.hosts is not None and host not in self.hosts:
+            return self.getaddrinfo(host, port, *args, **kwargs)
+
+        key = (host, port, args, tuple(sorted(kwargs.items())))
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        try:
+            ret_val = self.getaddrinfo(host, port, *args, **kwargs)
+        except socket.gaierror:
+            with self._lock:
+                self.errors += 1
+            if entry and entry[0] + self.ttl * 9 > now:
+                return entry[1]
+            raise
+
+        with self._lock:
+            self._entries[key] = (now + self.ttl, ret_val)
+        return ret_val
+
+    def install(self):
+        socket.getaddrinfo = self
+
+    def uninstall(self):
+        if socket.getaddrinfo is self:
+            socket.getaddrinfo = self.getaddrinfo
+
+    def stats(self):
+        with self._lock:
+            return {'ttl': self.ttl, 'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'errors': self.errors}
+
+
+class Hedging(object):
+    """
+    hedged calls, to cut the tail latency caused by the occasional slow Pelias shard
+    :param percentile: hedge once a call is slower than this percentile of the host's recent latencies (0 == off)
+    :param budget_pct: at most this percentage of calls get hedged ... of the calls in the last budget_secs, so budget
+                       not used while things are calm doesn't pile up, and then burst out in a slowdown
+    :param min_samples: don't hedge until a host has this many latency samples
+    """
+    def __init__(self, percentile=0, budget_pct=0, min_samples=100, window=1000, threads=32, budget_secs=10, clock=time.monotonic):
+        self.percentile = percentile
+        self.budget_pct = budget_pct
+        self.min_samples = min_samples
+        self.threads = threads
+        self.budget_secs = budget_secs
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._latencies = defaultdict(lambda: deque(maxlen=window))
+        self._delays = {}
+        self._recent_calls = deque()
+        self._recent_hedges = deque()
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+
+    @property
+    def enabled(self):
+        return self.percentile > 0 and self.budget_pct > 0
+
+    def record(self, host, secs):
+        with self._lock:
+            samples = self._latencies[host]
+            samples.append(secs)
+            # note: re-calculate the percentile every so often, rather than sorting on every call
+            if len(samples) >= self.min_samples and (host not in self._delays or len(samples) % 50 == 0 or len(samples) == samples.maxlen):
+                s = sorted(samples)
+                self._delays[host] = s[min(int(len(s) * self.percentile / 100), len(s) - 1)]
+
+    def delay(self, host):
+        """ secs to wait before hedging a call to host ... None when there's not enough latency data yet """
+        with self._lock:
+            return self._delays.get(host)
+
+    def allow(self):
+        """ is there room in the (sliding window) budget for another hedge? """
+        with self._lock:
+            start = self.clock() - self.budget_secs
+            for recent in (self._recent_calls, self._recent_hedges):
+                while recent and recent[0] < start:
+                    recent.popleft()
+            ret_val = len(self._recent_hedges) < len(self._recent_calls) * self.budget_pct / 100
+            if ret_val:
+                self.hedges += 1
+                self._recent_hedges.append(self.clock())
+            else:
+                self.budget_denied += 1
+        return ret_val
+
+    def call(self, host, func, timeout=None):
+        """
+        return func(timeout), hedged with a second func() call if the first is slow
+        :param timeout: the first call's timeout (secs) ... the hedge only gets what's left of it, so it never runs
+                        past the first call (or the request's deadline, which that timeout is already capped at)
+        """
+        def timed(t):
+            start = time.monotonic()
+            ret_val = func(t)
+            self.record(host, time.monotonic() - start)
+            return ret_val
+
+        with self._lock:
+            self.calls += 1
+            self._recent_calls.append(self.clock())
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="hedge")
+
+        start = time.monotonic()
+        first = self._executor.submit(contextvars.copy_context().run, timed, timeout)
+        delay = self.delay(host)
+        if delay is None or wait([first], timeout=delay).done:
+            return first.result()
+
+        remaining = None if timeout is None else timeout - (time.monotonic() - start)
+        if (remaining is not None and remaining <= 0) or not self.allow():
+            return first.result()
+
+        hedge = self._executor.submit(contextvars.copy_context().run, timed, remaining)
+        for f in as_completed([first, hedge]):
+            if f.exception() is None:
+                if f is hedge:
+                    with self._lock:
+                        self.hedge_wins += 1
+                return f.result()
+        return first.result()  # note: both failed ... raise the first call's error
+
+    def stats(self):
+        with self._lock:
+            ret_val = {
+                'percentile': self.percentile,
+                'budget_pct': self.budget_pct,
+                'budget_secs': self.budget_secs,
+                'calls': self.calls,
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins,
+                'budget_denied': self.budget_denied,
+                'delay_ms': {h: round(d * 1000, 1) for h, d in self._delays.items()},
+            }
+        return ret_val
+
+
+class UpstreamPool(object):
+    """
+    shared, thread-safe connection pool
+    :param pool_size: connections kept per host ... should match the waitress 'threads' setting
+    :param max_per_host: cap on concurrent calls per host (0 == no cap, other than the pool_size)
+    :param timeout: (secs) for both connect and read, and for waiting on a max_per_host slot
+    """
+    def __init__(self, pool_size=10, max_per_host=0, timeout=10, num_hosts=10, hedging=None, breaker_failures=0, breaker_reset_secs=30, backends=None):
+        self.pool_size = pool_size
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.hedging = hedging or Hedging()
+        self.breaker_failures = breaker_failures
+        self.breaker_reset_secs = breaker_reset_secs
+        self.breakers = {}
+        self.backends = backends
+
+        self.adapter = None
+        self.session = self.new_session(num_hosts)
+
+        self._lock = threading.Lock()
+        self._host_slots = {}
+        self._in_use = Counter()
+        self.calls = Counter()
+        self.errors = Counter()
+        self.busy = Counter()
+
+    @classmethod
+    def host_name(cls, url):
+        """ 'host:port' ... ala the urllib3 pool for that url """
+        parts = urlsplit(url)
+        return "{}:{}".format(parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+
+    def add_breaker(self, url):
+        """ put a circuit breaker around url (and any url that starts with it, e.g., route stop's {url}/{id}/routes/str) """
+        if url and self.breaker_failures > 0 and url not in self.breakers:
+            self.breakers[url] = CircuitBreaker(url, self.breaker_failures, self.breaker_reset_secs)
+
+    def breaker(self, url):
+        """ the breaker for the longest configured url that url starts with ... else None """
+        ret_val = None
+        for u, b in self.breakers.items():
+            if url.startswith(u) and (ret_val is None or len(u) > len(ret_val.name)):
+                ret_val = b
+        return ret_val
+
+    def host_slots(self, host):
+        ret_val = None
+        if self.max_per_host > 0:
+            with self._lock:
+                ret_val = self._host_slots.get(host)
+                if ret_val is None:
+                    ret_val = self._host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+        return ret_val
+
+    def get(self, url, params=None, timeout=None):
+        """ GET url via the pool ... returns a requests.Response (any status code) """
+        breaker = self.breaker(url)
+        if breaker and not breaker.allow():
+            raise CircuitOpen(f"{breaker.name} is unavailable (circuit breaker is open)")
+
+        observer = latency_observer.get()
+        start = time.monotonic()
+        try:
+            if self.backends and self.backends.matches(url):
+                ret_val = self._get_backend(url, params, timeout)
+            else:
+                ret_val = self._get(url, params, timeout)
+        except Exception:
+            if breaker:
+                breaker.failure()
+            if observer:
+                observer(time.monotonic() - start, False)
+            raise
+
+        if observer:
+            observer(time.monotonic() - start, ret_val.status_code < 500)
+
+        if breaker:
+            if ret_val.status_code >= 500:
+                breaker.failure()
+            else:
+                breaker.success()
+        return ret_val
+
+    def _get_backend(self, url, params=None, timeout=None):
+        """ send a call to (logical) url to one of the Pelias backends instead """
+        backend = self.backends.pick()
+        start = time.monotonic()
+        ok = False
+        try:
+            ret_val = self._get(self.backends.url(backend, url), params, timeout)
+            ok = ret_val.status_code < 500
+            return ret_val
+        finally:
+            self.backends.done(backend, time.monotonic() - start, ok)
+
+    def _get(self, url, params=None, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        host = self.host_name(url)
+        slots = self.host_slots(host)
+        if slots and not slots.acquire(timeout=timeout):
+            with self._lock:
+                self.busy[host] += 1
+            raise UpstreamBusy(f"{host} already has {self.max_per_host} calls in flight")
+
+        with self._lock:
+            self._in_use[host] += 1
+            self.calls[host] += 1
+        try:
+            return self.send(url, params, timeout)
+        except requests.exceptions.RequestException:
+            with self._lock:
+                self.errors[host] += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_use[host] -= 1
+            if slots:
+                slots.release()
+
+    def new_session(self, num_hosts):
+        """ the requests.Session that send() uses ... its keep-alive pools hold pool_size connections per host """
+        self.adapter = HTTPAdapter(pool_connections=num_hosts, pool_maxsize=self.pool_size, pool_block=False)
+        session = requests.Session()
+        session.mount('http://', self.adapter)
+        session.mount('https://', self.adapter)
+        return session
+
+    def send(self, url, params, timeout):
+        """ the actual http call ... returns a requests.Response (or something that quacks like one) """
+        return self.session.get(url, params=params, timeout=timeout)
+
+    def get_json(self, url, query_string=None, timeout=None):
+        """
+        GET and parse a json response
+        :note: Pelias errors (e.g., 400 'invalid layers parameter') come back as json, so those are returned too
+        """
+        if query_string:
+            url = "{}?{}".format(url, query_string)
+
+        def get_json(timeout=timeout):
+            resp = self.get(url, timeout=timeout)
+            try:
+                return resp.json()
+            except ValueError:
+                resp.raise_for_status()
+                raise
+
+        if self.hedging.enabled:
+            return self.hedging.call(self.host_name(url), get_json, self.timeout if timeout is None else timeout)
+        return get_json()
+
+    def proxy_json(self, url, query_string=None, timeout=None):
+        """
+        pooled stand-in for response_utils.proxy_json ... errors become a sys_error_response()
+        :note: while url's breaker is open, an (immediate) empty Pelias response with an error message comes back
+        """
+        try:
+            ret_val = self.get_json(url, query_string, timeout)
+        except CircuitOpen as e:
+            log.debug(e)
+            ret_val = unavailable_response(str(e))
+        except Exception as e:
+            log.warning(f"{url}?{query_string}: {e}")
+            ret_val = response_utils.sys_error_response()
+        return ret_val
+
+    def stream_json(self, url, query_string=None, def_val={}, timeout=None):
+        """ pooled stand-in for json_utils.stream_json ... errors are logged and def_val is returned """
+        try:
+            ret_val = self.get_json(url, query_string, timeout)
+        except Exception as e:
+            log.warning(f"{url}?{query_string}: {e}")
+            ret_val = def_val
+        return ret_val
+
+    def stats(self):
+        """ per host connection counts: in use, idle, created (new connections) and reused (requests on an existing connection) """
+        hosts = {}
+        pools = self.adapter.poolmanager.pools if self.adapter else {}
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = "{}:{}".format(pool.host, pool.port)
+            idle = 0
+            if pool.pool is not None:
+                idle = sum(1 for c in list(pool.pool.queue) if c is not None)
+            hosts[host] = {
+                'created': pool.num_connections,
+                'requests': pool.num_requests,
+                'reused': max(pool.num_requests - pool.num_connections, 0),
+                'idle': idle,
+                'in_use': 0,
+            }
+
+        with self._lock:
+            for host, n in self._in_use.items():
+                hosts.setdefault(host, {})['in_use'] = n
+            ret_val = {
+                'pool_size': self.pool_size,
+                'max_per_host': self.max_per_host,
+                'timeout': self.timeout,
+                'calls': sum(self.calls.values()),
+                'errors': sum(self.errors.values()),
+                'busy': sum(self.busy.values()),
+                'hosts': hosts,
+            }
+        ret_val['hedging'] = self.hedging.stats()
+        ret_val['breakers'] = {u: b.stats() for u, b in self.breakers.items()}
+        if self.backends:
+            ret_val['pelias_backends'] = self.backends.stats()
+        return ret_val
+
+
+def unavailable_response(error):
+    """ local fallback: an empty Pelias response, with the error message in geocoding.errors (so it's never cached) """
+    return {
+        'geocoding': {'errors': [error]},
+        'type': 'FeatureCollection',
+        'features': []
+    }
+
+
+# note: (re)configured via config/base.ini in pyramid.views
+pool = UpstreamPool()
+dns_cache = None
+
+
+def config(pool_size=10, max_per_host=0, timeout=10, dns_ttl=0, hedge_percentile=0, hedge_budget_pct=0, breaker_failures=0, breaker_reset_secs=30, breaker_urls=(), backends=None):
+    """
+    :param backends: BackendPool of Pelias backends (health probes start here) ... None == just the one pelias_instance
+    """
+    global pool
+    global dns_cache
+
+    if pool.backends:
+        pool.backends.stop_probes()
+
+    # note: a hedged call ties up a thread for each attempt, so allow for 2 per waitress thread
+    hedging = Hedging(percentile=hedge_percentile, budget_pct=hedge_budget_pct, threads=pool_size * 2)
+    pool = UpstreamPool(
+        pool_size=pool_size, max_per_host=max_per_host, timeout=timeout, hedging=hedging,
+        breaker_failures=breaker_failures, breaker_reset_secs=breaker_reset_secs, backends=backends
+    )
+    if backends:
+        backends.start_probes(pool.send)
+    for url in breaker_urls:
+        pool.add_breaker(url)
+    if dns_cache:
+        dns_cache.uninstall()
+        dns_cache = None
+    if dns_ttl > 0:
+        urls = list(breaker_urls) + ([b.url for b in backends.backends] if backends else [])
+        dns_cache = DnsCache(ttl=dns_ttl, hosts={urlsplit(u).hostname for u in urls if u})
+        dns_cache.install()
+
+
+def get(url, params=None, timeout=None):
+    return pool.get(url, params, timeout)
+
+
+def proxy_json(url, query_string=None, timeout=None):
+    return pool.proxy_json(url, query_string, timeout)
+
+
+def stream_json(url, query_string=None, def_val={}, timeout=None):
+    return pool.stream_json(url, query_string, def_val, timeout)
+
+
+def stats():
+    ret_val = pool.stats()
+    ret_val['dns_cache'] = dns_cache.stats() if dns_cache else None
+    return ret_val
+
+
+def is_open(url):
+    """ is the circuit breaker for url open? (e.g., serve expired cache entries rather than waiting on a dead upstream) """
+    breaker = pool.breaker(url) if url else None
+    return breaker is not None and breaker.is_open()
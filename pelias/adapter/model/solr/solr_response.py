@@ -1,18 +1,41 @@
-import requests
+import io
+import csv
+import time
+import threading
 
 from ott.utils.dao.base import MinimalDao
 from ott.utils.dao.base import BaseDao
 
 from .solr_record import SolrRecord
 from .solr_stop_record import SolrStopRecord
+from pelias.adapter.control.response_cache import ResponseCache, StaleResponse
+from pelias.adapter.control import upstream
 
 import logging
 log = logging.getLogger(__file__)
 
 
 class RouteStopRecords(object):
-    cache = {}
+    """
+    route strings (e.g., "37:37:Lake Grove:;78:78:Denney/Kerr Pkwy:snow") for SOLR stop records
+
+    the request path only ever reads the cache: find_record() never makes an http call ... a miss (or a stale hit)
+    queues a fetch in the background, so the next response for that stop carries its routes.
+    optionally, preload() fills the cache (in the background) at startup, and then again every refresh_secs, with
+    each stop in a GTFS stops.txt ... the route stop service has no bulk call, so that's one (throttled) call per stop.
+    a failed (or empty) fetch is cached too, as a negative entry good for negative_ttl, so a stop the service
+    doesn't know (e.g., a non-TriMet stop id that 404s) isn't re-fetched on every request for it.
+
+    :see: https://maps.trimet.org/ti/index/stops/4/routes/str
+    """
+    cache = ResponseCache(max_entries=20000, max_bytes=8*1024*1024, ttl=86400, stale_ttl=86400)
+    timeout = 5
+    refresh_secs = 86400
+    negative_ttl = 300
+    stops_file = None
+    preload_per_sec = 10
     _url = None
+    _timer = None
 
     @classmethod
     def url(cls):
@@ -25,24 +48,114 @@ class RouteStopRecords(object):
                 cls._url = "http://maps.trimet.org/ti/index/stops"
         return cls._url
 
+    @classmethod
+    def config(cls, url=None, max_entries=20000, ttl=86400, timeout=5, threads=4, refresh_secs=86400, negative_ttl=300, stops_file=None, preload_per_sec=10):
+        """
+        :param stops_file: GTFS stops.txt (a file path or url) w/ the stops to preload
+        :param preload_per_sec: preload fetches a second (0 == no throttle)
+        """
+        cls._url = url if url and len(url) > 5 else None
+        cls.cache = ResponseCache(max_entries=max_entries, max_bytes=8*1024*1024, ttl=ttl, stale_ttl=ttl, refresh_threads=threads)
+        cls.timeout = timeout
+        cls.refresh_secs = refresh_secs
+        cls.negative_ttl = negative_ttl
+        cls.stops_file = stops_file
+        cls.preload_per_sec = preload_per_sec
+
+    @classmethod
+    def put(cls, id, routes):
+        """ cache a stop's route string ... routes=None caches a negative entry (good for negative_ttl) """
+        return cls.cache.put(id, {'routes': routes}, ttl=None if routes else cls.negative_ttl)
+
     @classmethod
     def find_record(cls, id):
-        """ see requests_cache: https://requests-cache.readthedocs.io/en/latest/user_guide.html """
+        """ cache only lookup ... on a miss, None is returned and the route string is fetched in the background """
+        ret_val = None
+        if id and cls.cache.enabled:
+            entry = cls.cache.get(id)
+            if entry is None or isinstance(entry, StaleResponse):
+                cls.cache.refresh(id, cls.fetch_record, id)
+            if entry:
+                ret_val = entry.get('routes')
+        return ret_val
+
+    @classmethod
+    def fetch_record(cls, id):
+        """ query route stop service for a single stop, and cache the result (or a negative entry, when it fails) """
         ret_val = None
         try:
-            ret_val = cls.cache.get(id)
-            if ret_val is None:
-                # step 1: query route stop service
-                rs = requests.get("{}/{}/routes/str".format(cls.url(), id))
-
-                # step 2: cache record
-                if rs and len(rs.text):
-                    #cls.cache.update()
-                    ret_val = rs.text
+            rs = upstream.get("{}/{}/routes/str".format(cls.url(), id), timeout=cls.timeout)
+            rs.raise_for_status()
+            ret_val = rs.text.strip() or None
+        finally:
+            cls.put(id, ret_val)
+        return ret_val
+
+    @classmethod
+    def stop_ids(cls, stops_txt):
+        """ stop ids from a GTFS stops.txt (csv text) ... stations, entrances, etc... (location_type > 0) are skipped """
+        ret_val = []
+        for row in csv.DictReader(io.StringIO(stops_txt), skipinitialspace=True):
+            id = (row.get('stop_id') or '').strip()
+            if id and (row.get('location_type') or '0').strip() == '0':
+                ret_val.append(id)
+        return ret_val
+
+    @classmethod
+    def read_stops(cls):
+        """ the GTFS stops.txt, from a url or a file """
+        if cls.stops_file.startswith('http'):
+            rs = upstream.get(cls.stops_file, timeout=cls.timeout)
+            rs.raise_for_status()
+            return rs.text
+        with open(cls.stops_file, encoding='utf-8-sig') as f:
+            return f.read()
+
+    @classmethod
+    def preload(cls, sleep=time.sleep):
+        """
+        bulk load: fetch each stop in stops_file that isn't cached, or will go stale before the next preload ... one at
+        a time, at most preload_per_sec a second, so a preload doesn't crowd out the misses queued by find_record()
+        :return: number of stops fetched
+        """
+        ret_val = 0
+        if not cls.stops_file:
+            log.warning("route stop preload: no GTFS stops.txt configured (route_stop_preload_stops)")
+            return ret_val
+        try:
+            ids = cls.stop_ids(cls.read_stops())
         except Exception as e:
-            log.warning(e)
+            log.warning(f"route stop preload: can't read {cls.stops_file}: {e}")
+            return ret_val
+
+        for id in ids:
+            if not cls.cache.expiring(id, cls.refresh_secs):
+                continue
+            try:
+                cls.fetch_record(id)
+            except Exception as e:
+                log.debug(f"route stop preload of {id}: {e}")
+            ret_val += 1
+            if cls.preload_per_sec > 0:
+                sleep(1.0 / cls.preload_per_sec)
+        log.info(f"route stop preload: fetched {ret_val} of {len(ids)} stops")
         return ret_val
 
+    @classmethod
+    def start_preload(cls):
+        """ preload now (in the background), and again every refresh_secs """
+        def run():
+            cls.preload()
+            cls.start_preload()
+
+        cls._timer = threading.Timer(0 if cls._timer is None else cls.refresh_secs, run)
+        cls._timer.daemon = True
+        cls._timer.start()
+
+    @classmethod
+    def stats(cls):
+        return cls.cache.stats()
+
 
 class ResponseHeader(MinimalDao):
     def __init__(self):
@@ -74,12 +187,10 @@ class Response(MinimalDao):
                 if layer:
                     if ':stops' in layer:
                         solr_rec = SolrStopRecord.pelias_to_solr(f)
-                        """
-                        if add_routes and hasattr(solr_rec, 'stop_id'):
-                            rs = RouteStopRecords.find_record(solr_rec.stop_id)
-                            solr_rec.routes = rs
-                            pass
-                        """
+                        if add_routes and solr_rec and hasattr(solr_rec, 'stop_id'):
+                            routes = RouteStopRecords.find_record(solr_rec.stop_id)
+                            if routes:
+                                solr_rec.routes = routes
                     else:
                         solr_rec = SolrRecord.pelias_to_solr(f)
 
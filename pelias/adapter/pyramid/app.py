@@ -1,6 +1,7 @@
 from pyramid.config import Configurator
 from pyramid.events import NewRequest
 
+from ott.utils import object_utils
 from ott.utils.svr.pyramid import app_utils
 
 import logging
@@ -10,8 +11,17 @@ log = logging.getLogger(__file__)
 def main(global_config, **settings):
     """ return a Pyramid WSGI application """
     #import pdb; pdb.set_trace()
+    # size the upstream connection pools to the number of waitress threads
+    threads = server_threads(global_config)
+    if threads and settings is not None:
+        settings.setdefault('upstream_pool_size', str(threads))
+
     config = Configurator(settings=settings)
 
+    # orjson (when turned on, and installed) for every renderer='json' view
+    from .renderers import json_renderer
+    config.add_renderer('json', json_renderer(settings is not None and settings.get('fast_json_renderer') == 'true'))
+
     # logging config for pserve / wsgi
     if settings and 'logging_config_file' in settings:
         from pyramid.paster import setup_logging
@@ -25,4 +35,22 @@ def main(global_config, **settings):
     if settings and settings.get('enable_cors_headers') == 'true':
         config.add_subscriber(app_utils.add_cors_headers_response_callback, NewRequest)
 
-    return config.make_wsgi_app()
+    app = config.make_wsgi_app()
+
+    # warm up the caches with hot queries, before we start serving (see warm_cache_* in config/base.ini)
+    from . import cache_warmer
+    cache_warmer.warm_from_settings(settings or {})
+
+    return app
+
+
+def server_threads(global_config, def_val=None):
+    """ waitress' 'threads' setting from the [server:main] section (following any 'use = config:base.ini') """
+    ret_val = def_val
+    try:
+        from paste.deploy.loadwsgi import loadcontext, SERVER
+        ctx = loadcontext(SERVER, "config:{}".format(global_config['__file__']))
+        ret_val = object_utils.safe_int(ctx.config().get('threads'), def_val)
+    except Exception as e:
+        log.debug(e)
+    return ret_val
@@ -0,0 +1,151 @@
+"""
+startup cache warm-up ... replay hot queries thru the real view / PeliasWrapper / refine pipeline before serving
+
+after a restart (see restart_wrapper.sh), the caches are empty and the first minutes of traffic all hit Pelias.
+hot queries come from:
+  - csv files in the tests/data format (e.g., stops.csv 'stop_code', landmarks.csv 'name', alias.csv 'NAME')
+  - an access log (Apache / waitress / etc...), where the most frequent geocoder requests win
+
+:see: config/base.ini for the warm_cache_* settings
+"""
+import ast
+import csv
+import re
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlencode, urlsplit
+
+from ott.utils import object_utils
+from pyramid.request import Request
+
+import logging
+log = logging.getLogger(__file__)
+
+CSV_COLUMNS = ('text', 'stop_code', 'name', 'NAME')
+LOG_REQUEST_RE = re.compile(r'"GET (\S+) HTTP/[\d.]+"')
+PATH_RE = re.compile(r'/(?:(rtp|refine)/)?(autocomplete|search|reverse)/?$')
+
+# report from the last warm-up (shown via /pelias/stats)
+last_report = {}
+
+
+def queries_from_csv(file_path, service='autocomplete', column=None):
+    """ each row's text (from the first of CSV_COLUMNS found in the header) becomes a /pelias/{service}?text= query """
+    ret_val = []
+    with open(file_path, newline='', encoding='utf-8') as f:
+        lines = (l for l in f if l.strip() and not l.lstrip().startswith('#'))
+        for row in csv.DictReader(lines):
+            if column is None:
+                column = next((c for c in CSV_COLUMNS if c in row), None)
+                if column is None:
+                    log.warning(f"{file_path} doesn't have any of these columns: {CSV_COLUMNS}")
+                    break
+            text = (row.get(column) or '').strip()
+            if text:
+                ret_val.append("/pelias/{}?{}".format(service, urlencode({'text': text})))
+    return ret_val
+
+
+def to_pelias_path(url):
+    """
+    normalize a logged geocoder url to our /pelias paths, else None
+    e.g., '/peliaswrap/v1/rtp/autocomplete?text=5' becomes '/pelias/rtp/autocomplete?text=5'
+    """
+    ret_val = None
+    parts = urlsplit(url)
+    path = parts.path
+    if path.rstrip('/').endswith('/pelias'):
+        path = "/pelias/autocomplete"  # note: /pelias defaults to autocomplete (see views.pelias)
+
+    m = PATH_RE.search(path)
+    if m and parts.query:
+        prefix = "/pelias/{}".format(m.group(1)) if m.group(1) else "/pelias"
+        ret_val = "{}/{}?{}".format(prefix, m.group(2), parts.query)
+    return ret_val
+
+
+def queries_from_log(file_path, max_queries=500):
+    """ the most frequently requested geocoder urls in an access log (most frequent first) """
+    counts = Counter()
+    with open(file_path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            m = LOG_REQUEST_RE.search(line)
+            if m:
+                path = to_pelias_path(m.group(1))
+                if path:
+                    counts[path] += 1
+    return [p for p, n in counts.most_common(max_queries)]
+
+
+def replay(path):
+    """ run a /pelias/... path thru the same view code a live request would """
+    from . import views
+
+    request = Request.blank(path)
+    m = PATH_RE.search(request.path)
+    request.matchdict = {'service': m.group(2)}
+    views.pelias_services(request, is_rtp=(m.group(1) == 'rtp'), refine=(m.group(1) == 'refine'))
+
+
+def warm(paths, concurrency=8, timeout=60):
+    """
+    replay paths with (at most) concurrency threads ... giving up on whatever's left after timeout seconds
+    :return: report dict with the duration and number of cache entries loaded
+    """
+    from pelias.adapter.control.pelias_wrapper import PeliasWrapper
+    global last_report
+
+    start = time.monotonic()
+    num_entries = len(PeliasWrapper.response_cache)
+    errors = 0
+
+    # note: no 'with' block, as leaving it would join the replays still running past the timeout
+    executor = ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix="cache-warmer")
+    futures = [executor.submit(replay, p) for p in paths]
+    done, not_done = wait(futures, timeout=timeout)
+    executor.shutdown(wait=False, cancel_futures=True)
+    for f in done:
+        if f.exception():
+            log.debug(f.exception())
+            errors += 1
+
+    last_report = {
+        'queries': len(paths),
+        'completed': len(done) - errors,
+        'errors': errors,
+        'timed_out': len(not_done),
+        'entries_loaded': len(PeliasWrapper.response_cache) - num_entries,
+        'secs': round(time.monotonic() - start, 3),
+    }
+    log.info(f"cache warm-up: {last_report}")
+    return last_report
+
+
+def warm_from_settings(settings):
+    """ gather hot queries from the configured csv files and access log, then warm the caches """
+    max_queries = object_utils.safe_int(settings.get('warm_cache_max_queries'), 500)
+
+    paths = []
+    for file_path in ast.literal_eval(settings.get('warm_cache_csv_files') or '[]'):
+        try:
+            paths.extend(queries_from_csv(file_path))
+        except (IOError, csv.Error) as e:
+            log.warning(f"cache warm-up can't read {file_path}: {e}")
+
+    access_log = settings.get('warm_cache_access_log')
+    if access_log:
+        try:
+            paths.extend(queries_from_log(access_log, max_queries))
+        except IOError as e:
+            log.warning(f"cache warm-up can't read {access_log}: {e}")
+
+    ret_val = None
+    paths = list(dict.fromkeys(paths))[:max_queries]
+    if paths:
+        ret_val = warm(
+            paths,
+            concurrency=object_utils.safe_int(settings.get('warm_cache_concurrency'), 8),
+            timeout=object_utils.safe_int(settings.get('warm_cache_timeout_secs'), 60)
+        )
+    return ret_val
@@ -0,0 +1,41 @@
+"""
+fast 'json' renderer for the views ... orjson when it's installed, else the stdlib json (what pyramid's own 'json' renderer uses)
+
+same structure (keys, values and key order) as the stdlib encoder, just compact and utf-8, rather than ascii with \\u escapes
+(and NaN / Infinity become null, rather than invalid json). anything orjson won't encode (e.g., ints over 64 bits) gets
+handed to the stdlib encoder.
+
+:note: poetry install -E fast ... and fast_json_renderer = true in config/base.ini
+"""
+import json
+
+from pyramid.renderers import JSON
+
+try:
+    import orjson
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+except ImportError:
+    orjson = None
+
+import logging
+log = logging.getLogger(__file__)
+
+
+def fast_dumps(value, default=None, **kw):
+    """ orjson.dumps (bytes) w/ a json.dumps (str) fallback ... pyramid's renderer helper takes either """
+    try:
+        return orjson.dumps(value, default=default, option=ORJSON_OPTIONS)
+    except TypeError as e:
+        log.debug(e)
+        return json.dumps(value, default=default, **kw)
+
+
+def json_renderer(fast=True):
+    """ the renderer factory to register as 'json' ... stdlib when fast=False, or orjson isn't installed """
+    if fast and orjson is not None:
+        ret_val = JSON(serializer=fast_dumps)
+    else:
+        if fast:
+            log.info("orjson isn't installed, so the 'json' renderer is the stdlib one")
+        ret_val = JSON()
+    return ret_val
@@ -6,7 +6,20 @@ from ott.utils.svr.pyramid import globals
 from ott.utils.svr.pyramid import response_utils
 from pelias.adapter.control.pelias_to_solr import PeliasToSolr
 from pelias.adapter.control.pelias_wrapper import PeliasWrapper
+from pelias.adapter.control.response_cache import ResponseCache, StaleResponse
+from pelias.adapter.control.prefix_cache import PrefixCache, NegativeCache
+from pelias.adapter.control.reverse_cache import ReverseCache
+from pelias.adapter.control.fan_out import FanOut
+from pelias.adapter.control.single_flight import SingleFlight
+from pelias.adapter.control.deadline import Deadline
+from pelias.adapter.control.limiter import AdaptiveLimiter
+from pelias.adapter.control import upstream
+from pelias.adapter.control.backends import BackendPool
+from pelias.adapter.model.solr.solr_response import RouteStopRecords
 from pelias.adapter.service import refine_service, pelias_service
+from pelias.adapter.service.batch_service import Batch, BatchError, run_batch, run_bulk_reverse
+from pelias.adapter.pyramid import cache_warmer
+from pyramid.events import NewResponse
 from pyramid.view import view_config
 
 log = logging.getLogger(__file__)
@@ -17,6 +30,15 @@ pelias_search_url = None
 pelias_reverse_url = None
 route_stop_str_url = None
 
+# per-request time budget (secs) ... keep it under waitress' channel_timeout
+request_deadline_secs = 25
+
+# adaptive in-flight limit for the upstream-bound views (see config_limiter)
+limiter = AdaptiveLimiter()
+
+# geocoder routes that get an ETag (and a 304 for a matching If-None-Match)
+etag_routes = ('pelias', 'pelias_proxy', 'pelias_services', 'pelias_rtp', 'pelias_refine', 'solr', 'solr_select')
+
 
 def config_globals(cfg):
     """
@@ -27,23 +49,199 @@ def config_globals(cfg):
     global pelias_search_url
     global pelias_reverse_url
     global route_stop_str_url
+    global request_deadline_secs
 
     PeliasWrapper.rtp_agencies = ast.literal_eval(cfg.registry.settings.get('agencies'))
     pelias_autocomplete_url = cfg.registry.settings.get('pelias_autocomplete_url')
     pelias_search_url = cfg.registry.settings.get('pelias_search_url')
     pelias_reverse_url = cfg.registry.settings.get('pelias_reverse_url')
     route_stop_str_url = cfg.registry.settings.get('route_stop_str_url')
+    request_deadline_secs = object_utils.safe_int(cfg.registry.settings.get('request_deadline_secs'), 25)
+    PeliasWrapper.optional_stage_secs = object_utils.safe_int(cfg.registry.settings.get('deadline_optional_stage_secs'), 2)
+
+    config_upstream(cfg.registry.settings)
+    config_cache(cfg.registry.settings)
+    config_route_stops(cfg.registry.settings)
+    config_batch(cfg.registry.settings)
+    config_limiter(cfg.registry.settings)
+
+
+def config_upstream(settings):
+    """ pooled keep-alive connections (and optional fan-out) for upstream calls ... pool size defaults to waitress' threads (see app.main) """
+    upstream.config(
+        pool_size=object_utils.safe_int(settings.get('upstream_pool_size'), 10),
+        max_per_host=object_utils.safe_int(settings.get('upstream_max_per_host'), 0),
+        timeout=object_utils.safe_int(settings.get('upstream_timeout_secs'), 10),
+        dns_ttl=object_utils.safe_int(settings.get('upstream_dns_ttl_secs'), 0),
+        hedge_percentile=object_utils.safe_int(settings.get('upstream_hedge_percentile'), 0),
+        hedge_budget_pct=object_utils.safe_int(settings.get('upstream_hedge_budget_pct'), 0),
+        breaker_failures=object_utils.safe_int(settings.get('upstream_breaker_failures'), 0),
+        breaker_reset_secs=object_utils.safe_int(settings.get('upstream_breaker_reset_secs'), 30),
+        breaker_urls=[settings.get(u) for u in ('pelias_autocomplete_url', 'pelias_search_url', 'pelias_reverse_url', 'route_stop_str_url')],
+        backends=config_backends(settings)
+    )
+    PeliasWrapper.fan_out = FanOut(
+        enabled=settings.get('speculative_fan_out') == 'true',
+        threads=object_utils.safe_int(settings.get('speculative_fan_out_threads'), object_utils.safe_int(settings.get('upstream_pool_size'), 16))
+    )
+    PeliasWrapper.single_flight = SingleFlight(enabled=settings.get('single_flight', 'true') == 'true')
+
+
+def config_backends(settings):
+    """
+    Pelias backends (pelias_backends) standing in for the one pelias_instance ... calls to the pelias_*_url urls go to
+    one of them (same path + query string). None when there's no pelias_backends setting
+    """
+    ret_val = None
+    urls = (settings.get('pelias_backends') or '').split()
+    search_url = settings.get('pelias_search_url')
+    if urls and search_url and '/v1/' in search_url:
+        ret_val = BackendPool(
+            prefix=search_url.rsplit('/v1/', 1)[0],
+            urls=urls,
+            policy=settings.get('pelias_backend_policy', 'least_outstanding'),
+            eject_failures=object_utils.safe_int(settings.get('pelias_backend_eject_failures'), 3),
+            eject_secs=object_utils.safe_int(settings.get('pelias_backend_eject_secs'), 30),
+            probe_path=settings.get('pelias_backend_probe_path', '/v1/autocomplete?text=portland&size=1'),
+            probe_secs=object_utils.safe_int(settings.get('pelias_backend_probe_secs'), 10)
+        )
+    return ret_val
+
+
+def config_cache(settings):
+    """ size the response caches in front of PeliasWrapper.wrapp() and .reverse() """
+    PeliasWrapper.response_cache = ResponseCache(
+        max_entries=object_utils.safe_int(settings.get('cache_max_entries'), 5000),
+        max_bytes=object_utils.safe_int(settings.get('cache_max_mb'), 64) * 1024 * 1024,
+        ttl=object_utils.safe_int(settings.get('cache_ttl_secs'), 300),
+        stale_ttl=object_utils.safe_int(settings.get('cache_stale_secs'), 0),
+        refresh_threads=object_utils.safe_int(settings.get('cache_refresh_threads'), 4)
+    )
+    PeliasWrapper.prefix_cache = PrefixCache(
+        max_entries=object_utils.safe_int(settings.get('prefix_cache_max_entries'), 2000),
+        ttl=object_utils.safe_int(settings.get('prefix_cache_ttl_secs'), 60)
+    )
+    PeliasWrapper.negative_cache = NegativeCache(
+        max_entries=object_utils.safe_int(settings.get('negative_cache_max_entries'), 5000),
+        ttl=object_utils.safe_int(settings.get('negative_cache_ttl_secs'), 30)
+    )
+    PeliasWrapper.config_label_memo(object_utils.safe_int(settings.get('label_memo_max_entries'), 10000))
+    PeliasWrapper.reverse_cache = ReverseCache(
+        precision=object_utils.safe_int(settings.get('reverse_cache_precision'), 8),
+        shadow_precisions=ast.literal_eval(settings.get('reverse_cache_shadow_precisions', '[6, 7, 8, 9]')),
+        max_entries=object_utils.safe_int(settings.get('reverse_cache_max_entries'), 5000),
+        ttl=object_utils.safe_int(settings.get('reverse_cache_ttl_secs'), 3600)
+    )
+
+
+def config_route_stops(settings):
+    """ route strings for SOLR stop records ... never fetched on the request path (optionally preloaded in the background) """
+    RouteStopRecords.config(
+        url=settings.get('route_stop_str_url'),
+        max_entries=object_utils.safe_int(settings.get('route_stop_cache_max_entries'), 20000),
+        ttl=object_utils.safe_int(settings.get('route_stop_cache_ttl_secs'), 86400),
+        timeout=object_utils.safe_int(settings.get('route_stop_timeout_secs'), 5),
+        threads=object_utils.safe_int(settings.get('route_stop_threads'), 4),
+        refresh_secs=object_utils.safe_int(settings.get('route_stop_refresh_secs'), 86400),
+        negative_ttl=object_utils.safe_int(settings.get('route_stop_negative_ttl_secs'), 300),
+        stops_file=settings.get('route_stop_preload_stops'),
+        preload_per_sec=object_utils.safe_int(settings.get('route_stop_preload_per_sec'), 10)
+    )
+    if RouteStopRecords.cache.enabled and settings.get('route_stop_preload') == 'true':
+        RouteStopRecords.start_preload()
+
+
+def config_batch(settings):
+    """ limits for the /pelias/batch/{service} endpoint ... the batch deadline defaults to the request deadline """
+    Batch.config(
+        max_items=object_utils.safe_int(settings.get('batch_max_items'), 200),
+        concurrency=object_utils.safe_int(settings.get('batch_concurrency'), 8),
+        threads=object_utils.safe_int(settings.get('batch_threads'), 16),
+        item_deadline_secs=object_utils.safe_int(settings.get('batch_item_deadline_secs'), 10),
+        deadline_secs=object_utils.safe_int(settings.get('batch_deadline_secs'), request_deadline_secs),
+        reverse_precision=object_utils.safe_int(settings.get('bulk_reverse_precision'), 9)
+    )
+
+
+def config_limiter(settings):
+    """
+    adaptive (AIMD) limit on upstream-bound requests in flight ... max (and the starting limit) defaults to the upstream
+    pool size (waitress threads). the limit follows the latency of the upstream calls made by the admitted requests
+    (see limited()), not of whole requests
+    """
+    global limiter
+    max_limit = object_utils.safe_int(settings.get('limiter_max'), object_utils.safe_int(settings.get('upstream_pool_size'), 200))
+    limiter = AdaptiveLimiter(
+        enabled=settings.get('limiter_enabled') == 'true',
+        upstream_latency=True,
+        initial=object_utils.safe_int(settings.get('limiter_initial'), max_limit),
+        min_limit=object_utils.safe_int(settings.get('limiter_min'), 10),
+        max_limit=max_limit,
+        latency_target=object_utils.safe_int(settings.get('limiter_latency_target_ms'), 2000) / 1000.0,
+        queue_size=object_utils.safe_int(settings.get('limiter_queue_size'), 0),
+        queue_secs=object_utils.safe_int(settings.get('limiter_queue_ms'), 0) / 1000.0,
+        retry_after=object_utils.safe_int(settings.get('limiter_retry_after_secs'), 2)
+    )
+
+
+def limited(request, func, fallback=None):
+    """
+    call func() under the adaptive limit ... when over it, shed the request: fallback() (e.g., a cached response),
+    else a fast 503 w/ a Retry-After header
+    """
+    if not limiter.enabled:
+        return func()
+
+    admitted, ret_val = limiter.call(upstream.observed, limiter.observe if limiter.upstream_latency else None, func)
+    if not admitted:
+        ret_val = fallback() if fallback else None
+        if ret_val is not None:
+            limiter.served_from_cache()
+        else:
+            request.response.status = 503
+            request.response.headers['Retry-After'] = str(limiter.retry_after)
+            request.response.cache_control.prevent_auto = True
+            ret_val = upstream.unavailable_response("too many requests in flight ... try again in {} secs".format(limiter.retry_after))
+    return ret_val
+
+
+def cached_response(service, request, is_rtp=False):
+    """ shed requests get whatever wrapp() / reverse() has cached for them (even if expired) """
+    if service == "reverse":
+        ret_val = PeliasWrapper.cached_response(pelias_reverse_url, request.query_string)
+    else:
+        url = pelias_search_url if service == "search" else pelias_autocomplete_url
+        ret_val = PeliasWrapper.cached_response(url, request.query_string, is_rtp)
+    return ret_val
 
 
 def do_view_config(cfg):
     config_globals(cfg)
     cfg.add_route('pelias', '/pelias')
     cfg.add_route('pelias_proxy', '/proxy')
+    cfg.add_route('pelias_stats', '/pelias/stats')
+    cfg.add_route('pelias_batch', '/pelias/batch/{service}')
+    cfg.add_route('pelias_bulk_reverse', '/pelias/reverse/bulk')
     cfg.add_route('pelias_services', '/pelias/{service}')
     cfg.add_route('pelias_rtp', '/pelias/rtp/{service}')
     cfg.add_route('solr', '/solr')
     cfg.add_route('solr_select', '/solr/{select}')
     cfg.add_route('pelias_refine', '/pelias/refine/{service}')
+    cfg.add_subscriber(add_etag_response, NewResponse)
+
+
+def add_etag_response(event):
+    """
+    ETag (hash of the rendered body) on geocoder json responses ... webob's conditional response then
+    turns a request with a matching If-None-Match into a 304 with no body
+    :note: the response cache holds what PeliasWrapper returns, but the views add to that (the hostname, refine's
+           re-ordering, the SOLR conversion) before it's rendered ... so there's no hash at cache time to reuse
+    """
+    route = getattr(event.request, 'matched_route', None)
+    response = event.response
+    if route and route.name in etag_routes and response.status_code == 200 and response.content_type == 'application/json' and response.etag is None:
+        response.md5_etag()
+        response.conditional_response = True
 
 
 @view_config(route_name='solr', renderer='json', http_cache=globals.CACHE_LONG)
@@ -79,18 +277,19 @@ def solr_json(request):
         solr_params['wt'] = wt
 
         # step 2: wrap call to Pelias and get SOLR response
-        ret_val = PeliasToSolr.call_pelias(solr_params, pelias_autocomplete_url, pelias_search_url)
+        ret_val = PeliasToSolr.call_pelias(solr_params, pelias_autocomplete_url, pelias_search_url, Deadline(request_deadline_secs))
         return ret_val
 
-    ret_val = None
+    def solr_response():
+        try:
+            json = solr_api(request)
+            ret_val = response_utils.dao_response(json)
+        except Exception as e:
+            log.warning(e)
+            ret_val = response_utils.sys_error_response()
+        return ret_val
 
-    try:
-        json = solr_api(request)
-        ret_val = response_utils.dao_response(json)
-    except Exception as e:
-        log.warning(e)
-        ret_val = response_utils.sys_error_response()
-    return ret_val
+    return limited(request, solr_response)
 
 
 @view_config(route_name='solr_select', renderer='json', http_cache=globals.CACHE_LONG)
@@ -113,21 +312,30 @@ def pelias_services(request, is_rtp=False, refine=False):
     except:
         service = "autocomplete"
 
-    # step 2: call the wrapper
-    if refine:
-        ret_val = refine_service.refine(request, service=service, is_rtp=is_rtp)
-    elif service == "autocomplete":
-        ret_val = PeliasWrapper.wrapp(pelias_autocomplete_url, pelias_search_url, pelias_reverse_url, request.query_string, is_rtp=is_rtp)
-    elif service == "search":
-        ret_val = PeliasWrapper.wrapp(pelias_search_url, pelias_autocomplete_url, pelias_reverse_url, request.query_string, is_rtp=is_rtp)
-    elif service == "reverse":
-        ret_val = PeliasWrapper.reverse(pelias_reverse_url, request.query_string)
-    else:
-        ret_val = response_utils.sys_error_response()
+    # step 2: call the wrapper (every upstream call shares the request's deadline)
+    def geocode():
+        deadline = Deadline(request_deadline_secs)
+        if refine:
+            ret_val = refine_service.refine(request, service=service, is_rtp=is_rtp, deadline=deadline)
+        elif service == "autocomplete":
+            ret_val = PeliasWrapper.wrapp(pelias_autocomplete_url, pelias_search_url, pelias_reverse_url, request.query_string, is_rtp=is_rtp, deadline=deadline)
+        elif service == "search":
+            ret_val = PeliasWrapper.wrapp(pelias_search_url, pelias_autocomplete_url, pelias_reverse_url, request.query_string, is_rtp=is_rtp, deadline=deadline)
+        elif service == "reverse":
+            ret_val = PeliasWrapper.reverse(pelias_reverse_url, request.query_string, deadline=deadline)
+        else:
+            ret_val = response_utils.sys_error_response()
+        return ret_val
+
+    # step 2b: over the (adaptive) in-flight limit, answer from the cache ... else with a fast 503
+    ret_val = limited(request, geocode, None if refine else lambda: cached_response(service, request, is_rtp))
 
     # step 3: append the hostname to the response
     json_utils.append_hostname_to_json(ret_val)
 
+    # step 3b: flag stale cached responses (e.g., Pelias is slow or down, and we're refreshing in the background)
+    mark_stale_response(request, ret_val)
+
     """
     TODO: WIP find and add stops / in/out / etc... 
     x = object_utils.find_elements('properties', ret_val)
@@ -138,6 +346,85 @@ def pelias_services(request, is_rtp=False, refine=False):
     return ret_val
 
 
+def mark_stale_response(request, ret_val):
+    """ RFC 7234 'Warning: 110' header for responses served from the cache past their TTL """
+    if isinstance(ret_val, StaleResponse):
+        request.response.headers['Warning'] = '110 - "Response is Stale"'
+
+
+@view_config(route_name='pelias_stats', renderer='json')
+def pelias_stats(request):
+    """ cache counters (hits, misses, evictions, etc...) and warm-up report, used to size things in production """
+    ret_val = {
+        'response_cache': PeliasWrapper.response_cache.stats(),
+        'prefix_cache': PeliasWrapper.prefix_cache.stats(),
+        'negative_cache': PeliasWrapper.negative_cache.stats(),
+        'reverse_cache': PeliasWrapper.reverse_cache.stats(),
+        'label_memo': PeliasWrapper.label_memo_stats(),
+        'fan_out': PeliasWrapper.fan_out.stats(),
+        'single_flight': PeliasWrapper.single_flight.stats(),
+        'route_stop_cache': RouteStopRecords.stats(),
+        'upstream': upstream.stats(),
+        'limiter': limiter.stats(),
+        'batch': Batch.stats(),
+        'cache_warmer': cache_warmer.last_report,
+    }
+    return ret_val
+
+
+@view_config(route_name='pelias_batch', renderer='json', request_method='POST')
+def pelias_batch(request):
+    """
+    POST a json array of query objects (or query strings) to /pelias/batch/{search|autocomplete|reverse}
+    optional ?refine=true (run each item through refine) and ?rtp=true
+    :return: json array, in input order ... each item is {"status": 200, "response": {...}} or {"status": 4xx/5xx, "error": "..."}
+    """
+    try:
+        items = request.json_body
+    except ValueError:
+        items = None
+
+    def batch():
+        try:
+            ret_val = run_batch(
+                items,
+                service=request.matchdict.get('service'),
+                is_rtp=request.params.get('rtp') == 'true',
+                refine=request.params.get('refine') == 'true'
+            )
+        except BatchError as e:
+            request.response.status = e.status
+            ret_val = {'error': str(e)}
+        return ret_val
+
+    return limited(request, batch)
+
+
+@view_config(route_name='pelias_bulk_reverse', renderer='json', request_method='POST')
+def pelias_bulk_reverse(request):
+    """
+    POST a json array of points ([lat, lon] or {"lat": .., "lon": ..}) to /pelias/reverse/bulk
+    query params (e.g., ?layers=address&size=1) apply to every point
+    :return: json array of FeatureCollections, one per point (in input order)
+    """
+    try:
+        points = request.json_body
+    except ValueError:
+        points = None
+
+    def bulk_reverse():
+        try:
+            ret_val = run_bulk_reverse(points, pelias_reverse_url, dict(request.params))
+            for r in ret_val:
+                json_utils.append_hostname_to_json(r)
+        except BatchError as e:
+            request.response.status = e.status
+            ret_val = {'error': str(e)}
+        return ret_val
+
+    return limited(request, bulk_reverse)
+
+
 @view_config(route_name='pelias', renderer='json', http_cache=globals.CACHE_LONG)
 @view_config(route_name='pelias_proxy', renderer='json', http_cache=globals.CACHE_LONG)
 def pelias(request):
@@ -0,0 +1,286 @@
+"""
+batch geocoding: many queries in one (POST) request
+
+back-office jobs geocode thousands of rows (e.g., tests/data/landmarks.csv) ... rather than one http call
+per row, they POST a json array of query objects to /pelias/batch/{service}, and get back an array of
+results (in input order), each with its own status. every item runs through the same pipeline as a single
+request (PeliasWrapper.wrapp / .reverse, or refine), on a bounded (shared) worker pool.
+
+bulk reverse: trip planners reverse geocode every leg endpoint of an itinerary ... so they POST the list of
+points to /pelias/reverse/bulk instead. identical / nearby points (same geohash cell) are only reverse
+geocoded once, and the answer gets re-distanced to each of the other points in that cell.
+"""
+import copy
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from typing import Any, Literal
+
+from pyramid.encode import urlencode
+from pyramid.request import Request
+
+from pelias.adapter.control import upstream
+from pelias.adapter.control.deadline import Deadline
+from pelias.adapter.control.pelias_wrapper import PeliasWrapper
+from pelias.adapter.control.reverse_cache import geohash, redistance_features
+from pelias.adapter.service import pelias_service, refine_service
+
+logger = getLogger(__name__)
+
+SERVICES = ("autocomplete", "search", "reverse")
+
+
+class BatchError(ValueError):
+    """ the batch as a whole is bad (not a list, too big, etc...) ... status is the http status to answer with """
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+class Batch(object):
+    """
+    :note: configured via config/base.ini (batch_*) in pyramid.views
+    """
+    max_items = 200
+    concurrency = 8
+    threads = 16
+    item_deadline_secs = 10
+    deadline_secs = 25
+    reverse_precision = 9
+
+    _executor = None
+    _lock = threading.Lock()
+    _stats = Counter()
+
+    @classmethod
+    def config(cls, max_items=200, concurrency=8, threads=16, item_deadline_secs=10, deadline_secs=25, reverse_precision=9):
+        cls.max_items = max_items
+        cls.concurrency = max(concurrency, 1)
+        cls.threads = max(threads, 1)
+        cls.item_deadline_secs = item_deadline_secs
+        cls.deadline_secs = deadline_secs
+        cls.reverse_precision = reverse_precision
+        with cls._lock:
+            if cls._executor:
+                cls._executor.shutdown(wait=False)
+            cls._executor = None
+            cls._stats = Counter()
+
+    @classmethod
+    def executor(cls):
+        with cls._lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(max_workers=cls.threads, thread_name_prefix="batch")
+            return cls._executor
+
+    @classmethod
+    def count(cls, **kwargs):
+        with cls._lock:
+            cls._stats.update(kwargs)
+
+    @classmethod
+    def stats(cls) -> dict[str, Any]:
+        with cls._lock:
+            ret_val = {
+                'max_items': cls.max_items,
+                'concurrency': cls.concurrency,
+                'threads': cls.threads,
+                'reverse_precision': cls.reverse_precision,
+            }
+            ret_val.update(cls._stats)
+        return ret_val
+
+
+def check_size(items: Any, what: str = "query objects"):
+    if not isinstance(items, list):
+        raise BatchError("the request body should be a json array of {}".format(what))
+    if len(items) > Batch.max_items:
+        raise BatchError("batch of {} items is over the limit of {}".format(len(items), Batch.max_items), 413)
+
+
+def bounded_map(func, args_list: list) -> list:
+    """ [func(*args) for args in args_list] on the shared worker pool ... at most Batch.concurrency at a time """
+    slots = threading.BoundedSemaphore(Batch.concurrency)
+    executor = Batch.executor()
+
+    def run(args):
+        try:
+            return func(*args)
+        finally:
+            slots.release()
+
+    futures = []
+    for args in args_list:
+        slots.acquire()
+        futures.append(executor.submit(run, args))
+    return [f.result() for f in futures]
+
+
+def item_params(item: Any) -> dict[str, Any]:
+    """ a batch item is a query object (e.g., {"text": "834 SE Lambert", "size": 1}) ... or just the query text """
+    if isinstance(item, str):
+        item = {"text": item}
+    if not isinstance(item, dict) or not item:
+        raise ValueError("batch items must be query objects (or strings)")
+    return {k: v for k, v in item.items() if v is not None}
+
+
+def response_status(response: Any) -> int:
+    """
+    an item's status, from what the geocoder handed back ... it answers errors with a body, not an exception:
+    - sys_error_response(): the call to Pelias failed, so 502 ... depending on the ott.utils version, that's either
+      a (pyramid) Response w/ an error status, or a dict w/ 'errors' / 'error' / 'has_errors'
+    - unavailable_response() / Pelias' own errors ('geocoding.errors'): Pelias is down (breaker open), out of time, etc..., so 503
+    """
+    ret_val = 200
+    if isinstance(response, dict):
+        geocoding = response.get("geocoding")
+        if response.get("errors") or response.get("error") or response.get("has_errors"):
+            ret_val = 502
+        elif isinstance(geocoding, dict) and geocoding.get("errors"):
+            ret_val = 503
+    elif not isinstance(response, list):
+        status = getattr(response, "status_code", None)
+        if not isinstance(status, int) or status >= 400:
+            ret_val = 502
+    return ret_val
+
+
+def response_json(response: Any) -> Any:
+    """ the item's response as json ... a Response (e.g., from sys_error_response()) gives up its json body, if any """
+    ret_val = response
+    if response is not None and not isinstance(response, (dict, list)):
+        try:
+            ret_val = response.json_body
+        except Exception:
+            ret_val = None
+    return ret_val
+
+
+def geocode_item(item: Any, service: str, is_rtp: bool, refine: bool, deadline: Deadline) -> dict[str, Any]:
+    """ geocode one item, exactly as if it was its own GET request ... never raises """
+    try:
+        params = item_params(item)
+    except ValueError as e:
+        return {"status": 400, "error": str(e)}
+
+    if deadline.expired():
+        return {"status": 504, "error": "batch deadline exceeded before this item was started"}
+
+    item_deadline = Deadline(min(Batch.item_deadline_secs, deadline.remaining()))
+    try:
+        request = Request.blank("/pelias/{}?{}".format(service, urlencode(params, doseq=True)))
+        if refine:
+            response = refine_service.refine(request, service=service, is_rtp=is_rtp, deadline=item_deadline)
+        else:
+            response = pelias_service.get_pelias_response(service=service, request=request, is_rtp=is_rtp, deadline=item_deadline)
+        ret_val = {"status": response_status(response), "response": response_json(response)}
+        if ret_val["status"] != 200:
+            ret_val["error"] = "geocoding this item failed upstream"
+    except Exception as e:
+        logger.warning(e)
+        ret_val = {"status": 500, "error": "geocoding this item failed"}
+    return ret_val
+
+
+def run_batch(items: Any,
+              service: Literal["autocomplete", "search", "reverse"] = "search",
+              is_rtp: bool = False,
+              refine: bool = False) -> list[dict[str, Any]]:
+    """
+    geocode a list of query objects, at most Batch.concurrency at a time
+    :return: one {"status": ..., "response" (or "error"): ...} per item, in input order
+    :raises BatchError: when the batch itself is bad
+    """
+    if service not in SERVICES:
+        raise BatchError("unknown service '{}' (should be one of {})".format(service, ", ".join(SERVICES)), 404)
+    check_size(items)
+
+    deadline = Deadline(Batch.deadline_secs)
+    ret_val = bounded_map(geocode_item, [(item, service, is_rtp, refine, deadline) for item in items])
+    statuses = Counter("items_{}".format(r["status"]) for r in ret_val)
+    Batch.count(batches=1, items=len(ret_val), **statuses)
+    return ret_val
+
+
+def point_lat_lon(point: Any) -> tuple[float, float]:
+    """ a point is [lat, lon] ... or {"lat": .., "lon": ..} (or {"point.lat": .., "point.lon": ..}) """
+    try:
+        if isinstance(point, dict):
+            lat = point.get("lat", point.get("point.lat"))
+            lon = point.get("lon", point.get("point.lon"))
+        else:
+            lat, lon = point
+        lat = float(lat)
+        lon = float(lon)
+    except (TypeError, ValueError):
+        raise ValueError("points should be [lat, lon] or {{\"lat\": .., \"lon\": ..}}, not {}".format(point))
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+        raise ValueError("point {}, {} is out of range".format(lat, lon))
+    return lat, lon
+
+
+def reverse_point(reverse_geo_url: str, params: dict[str, Any], lat: float, lon: float, deadline: Deadline) -> dict[str, Any]:
+    """ PeliasWrapper.reverse() for one point (so, the same OSM-first / fallback policy, caches, etc...) ... never raises """
+    if deadline.expired():
+        return upstream.unavailable_response("bulk reverse deadline exceeded before this point was started")
+    try:
+        query_string = urlencode(dict(params, **{"point.lat": lat, "point.lon": lon}))
+        item_deadline = Deadline(min(Batch.item_deadline_secs, deadline.remaining()))
+        ret_val = PeliasWrapper.reverse(reverse_geo_url, query_string, deadline=item_deadline)
+        if response_status(ret_val) == 502:
+            ret_val = upstream.unavailable_response("reverse geocoding this point failed upstream")
+    except Exception as e:
+        logger.warning(e)
+        ret_val = upstream.unavailable_response("reverse geocoding this point failed")
+    return ret_val
+
+
+def nearby_response(response: dict[str, Any], lat: float, lon: float) -> dict[str, Any]:
+    """ copy of a (nearby) point's response, with the feature distances relative to lat / lon """
+    ret_val = copy.deepcopy(response)
+    features = ret_val.get("features")
+    if features:
+        ret_val["features"] = PeliasWrapper.sort_features(redistance_features(features, lat, lon))
+    return ret_val
+
+
+def run_bulk_reverse(points: Any, reverse_geo_url: str, params: dict[str, Any] | None = None) -> list[dict[str, Any]]:
+    """
+    reverse geocode a list of points, with the shared params (layers, size, sources, etc...) on each call
+    :return: one FeatureCollection per point, in input order (bad points get an empty one, w/ geocoding.errors)
+    :raises BatchError: when the list itself is bad
+    """
+    check_size(points, "points")
+    params = {k: v for k, v in (params or {}).items() if k not in ("point.lat", "point.lon")}
+    ret_val: list[Any] = [None] * len(points)
+
+    # step 1: group identical / nearby points (same geohash cell) ... precision 0 only groups identical points
+    groups: dict[Any, list[tuple[int, float, float]]] = {}
+    for i, point in enumerate(points):
+        try:
+            lat, lon = point_lat_lon(point)
+        except ValueError as e:
+            ret_val[i] = upstream.unavailable_response(str(e))
+            continue
+        cell = geohash(lat, lon, Batch.reverse_precision) if Batch.reverse_precision > 0 else (lat, lon)
+        groups.setdefault(cell, []).append((i, lat, lon))
+
+    # step 2: reverse geocode the first point of each group, concurrently
+    deadline = Deadline(Batch.deadline_secs)
+    members = list(groups.values())
+    responses = bounded_map(reverse_point, [(reverse_geo_url, params, m[0][1], m[0][2], deadline) for m in members])
+
+    # step 3: the rest of each group gets a copy (re-distanced to its own point, unless it's the very same point)
+    for group, response in zip(members, responses):
+        first, first_lat, first_lon = group[0]
+        ret_val[first] = response
+        for i, lat, lon in group[1:]:
+            if (lat, lon) == (first_lat, first_lon):
+                ret_val[i] = copy.deepcopy(response)
+            else:
+                ret_val[i] = nearby_response(response, lat, lon)
+
+    Batch.count(bulk_reverse=1, points=len(points), points_deduped=sum(len(g) - 1 for g in members))
+    return ret_val
@@ -4,22 +4,23 @@ from typing import Literal, Any
 from ott.utils import json_utils
 from ott.utils.svr.pyramid import response_utils
 from pelias.adapter.control.pelias_wrapper import PeliasWrapper
+from pelias.adapter.control.deadline import Deadline
 from pyramid.request import Request
 logger = getLogger(__name__)
 
 
 
-def get_pelias_response(service:Literal["autocomplete", "search", "reverse"], request:Request, is_rtp:bool=False) -> dict[str, Any]:
+def get_pelias_response(service:Literal["autocomplete", "search", "reverse"], request:Request, is_rtp:bool=False, deadline:Deadline|None=None) -> dict[str, Any]:
     from pelias.adapter.pyramid.views import pelias_autocomplete_url, pelias_reverse_url, pelias_search_url
     logger.debug(f"query: {request.query_string} ")
 
     # step 2: call the wrapper
     if service == "autocomplete":
-        ret_val = PeliasWrapper.wrapp(pelias_autocomplete_url, pelias_search_url, pelias_reverse_url, request.query_string, is_rtp=is_rtp)
+        ret_val = PeliasWrapper.wrapp(pelias_autocomplete_url, pelias_search_url, pelias_reverse_url, request.query_string, is_rtp=is_rtp, deadline=deadline)
     elif service == "search":
-        ret_val = PeliasWrapper.wrapp(pelias_search_url, pelias_autocomplete_url, pelias_reverse_url, request.query_string, is_rtp=is_rtp)
+        ret_val = PeliasWrapper.wrapp(pelias_search_url, pelias_autocomplete_url, pelias_reverse_url, request.query_string, is_rtp=is_rtp, deadline=deadline)
     elif service == "reverse":
-        ret_val = PeliasWrapper.reverse(pelias_reverse_url, request.query_string)
+        ret_val = PeliasWrapper.reverse(pelias_reverse_url, request.query_string, deadline=deadline)
     else:
         ret_val = response_utils.sys_error_response()
 
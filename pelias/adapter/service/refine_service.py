@@ -5,6 +5,8 @@ from pyramid.encode import urlencode
 from pyramid.interfaces import IMultiDict, IRequest
 from pyramid.request import Request
 
+from pelias.adapter.control.deadline import Deadline, has_time
+from pelias.adapter.control.pelias_wrapper import PeliasWrapper
 from pelias.adapter.service import pelias_service
 from pelias.adapter.service.util import is_address, remove_non_digits, prioritize_stops, \
     is_intersection, remove_duplicate_features, prioritize_addresses, EvaluatesAs
@@ -20,8 +22,9 @@ DEFAULT_SIZE = 10
 
 def get_response_and_features(request: Request,
                               service: Literal["autocomplete", "search", "reverse"] = "autocomplete",
-                              is_rtp: bool = False) -> tuple[dict[str, Any], list[dict[str, Any]]]:
-    ret_val = pelias_service.get_pelias_response(service=service, request=request, is_rtp=is_rtp)
+                              is_rtp: bool = False,
+                              deadline: Deadline | None = None) -> tuple[dict[str, Any], list[dict[str, Any]]]:
+    ret_val = pelias_service.get_pelias_response(service=service, request=request, is_rtp=is_rtp, deadline=deadline)
     _features = ret_val.get("features", [])
     return ret_val, _features
 
@@ -131,7 +134,8 @@ def refactor_pelias_request(request: Request, new_params: dict) -> Request:
 
 def refine(request: Request | IRequest,
            service: Literal["autocomplete", "search", "reverse"] = "autocomplete",
-           is_rtp: bool = False) -> dict[str, Any]:
+           is_rtp: bool = False,
+           deadline: Deadline | None = None) -> dict[str, Any]:
     """Refine and enhance Pelias geocoding results based on query analysis.
     
     This function analyzes the query, adjusts Pelias parameters for better results,
@@ -141,6 +145,7 @@ def refine(request: Request | IRequest,
         request: Pyramid Request object containing query parameters
         service: Pelias service endpoint to use ("autocomplete", "search", or "reverse")
         is_rtp: If True, disables TriMet-specific prioritization for RTP requests
+        deadline: The request's Deadline, passed on to the Pelias calls
         
     Returns:
         dict[str, Any]: Pelias GeoJSON response with refined and prioritized features
@@ -156,7 +161,7 @@ def refine(request: Request | IRequest,
         
     Notes:
         - Temporarily increases size to 10 if original request was smaller
-        - If refined query returns no results, retries without refinement
+        - If refined query returns no results, retries without refinement (time permitting)
         - Stop requests prioritize matching stop_id/stop_code
         - Address/intersection queries prioritize best matches
     """
@@ -186,7 +191,7 @@ def refine(request: Request | IRequest,
     if query_type is EvaluatesAs.STREET_ADDRESS or is_stop_request or query_type is EvaluatesAs.INTERSECTION:
         request = refactor_pelias_request(request=request, new_params=new_params)
 
-    ret_val, _features = get_response_and_features(service=service, request=request, is_rtp=is_rtp)
+    ret_val, _features = get_response_and_features(service=service, request=request, is_rtp=is_rtp, deadline=deadline)
 
     # after the first request, we'll use feature.property.name to normalize
     # and remove dupes
@@ -196,12 +201,12 @@ def refine(request: Request | IRequest,
         features = _features
     # if the custom layers query resulted in none, try again without the layers filter
 
-    if not features:
+    if not features and has_time(deadline, PeliasWrapper.optional_stage_secs):
         # no features returned WITH refinement, let's try again WITHOUT refinement
 
         request = refactor_pelias_request(request, original_params)
 
-        ret_val, _features = get_response_and_features(service=service, request=request, is_rtp=is_rtp)
+        ret_val, _features = get_response_and_features(service=service, request=request, is_rtp=is_rtp, deadline=deadline)
 
         features = remove_duplicate_features(_features, query_type)
 
@@ -9,11 +9,50 @@ This module provides helper functions for:
 
 import enum
 import re
+from functools import lru_cache
 from logging import getLogger
 from typing import Optional, Any, Literal
 
 logger = getLogger(__name__)
 
+# Directional and street type abbreviations, to their full names
+ADDRESS_ABBREVIATIONS = {
+    "n": "north",
+    "s": "south",
+    "e": "east",
+    "w": "west",
+    "nw": "northwest",
+    "ne": "northeast",
+    "sw": "southwest",
+    "se": "southeast",
+    "st": "street",
+    "street": "street",
+    "ave": "avenue",
+    "av": "avenue",
+    "aven": "avenue",
+    "avenue": "avenue",
+    "blvd": "boulevard",
+    "rd": "road",
+    "dr": "drive",
+    "ln": "lane",
+    "ct": "court",
+    "cir": "circle",
+    "hwy": "highway",
+    "pl": "place",
+    "ter": "terrace",
+    "pkwy": "parkway",
+}
+
+# A word (plus an optional period after it, e.g., "St.")
+ADDRESS_WORD = re.compile(r"(\w+)\.?")
+
+# A period run into more text (e.g., "s.e" or "st..") ... expanding the abbreviation one at a time, in table order,
+# glues those words together (e.g., "s.e" -> "southe"), so those addresses take the pattern by pattern path
+ADDRESS_GLUE = re.compile(r"\.[\w.]")
+ADDRESS_PATTERNS = [(re.compile(r"\b" + abbr + r"\b\.?"), full) for abbr, full in ADDRESS_ABBREVIATIONS.items()]
+
+NORMALIZE_ADDRESS_MEMO_SIZE = 10000
+
 
 def remove_non_digits(text: Optional[str], to_int: bool = False):
     """Extract only digits from a string.
@@ -68,49 +107,30 @@ def normalize_address(addr: str) -> str:
     if not addr:
         return ""
 
-    addr = addr.lower().strip()
+    return _normalize_address(addr)
 
-    # Directional abbreviations to full names (word boundaries ensure exact matches)
-    directions = {
-        r"\bn\b": "north",
-        r"\bs\b": "south",
-        r"\be\b": "east",
-        r"\bw\b": "west",
-        r"\bnw\b": "northwest",
-        r"\bne\b": "northeast",
-        r"\bsw\b": "southwest",
-        r"\bse\b": "southeast",
-    }
 
-    # Street type abbreviations to full names
-    streets = {
-        r"\bst\b": "street",
-        r"\bstreet\b": "street",
-        r"\bave\b": "avenue",
-        r"\bav\b": "avenue",
-        r"\baven\b": "avenue",
-        r"\bavenue\b": "avenue",
-        r"\bblvd\b": "boulevard",
-        r"\brd\b": "road",
-        r"\bdr\b": "drive",
-        r"\bln\b": "lane",
-        r"\bct\b": "court",
-        r"\bcir\b": "circle",
-        r"\bhwy\b": "highway",
-        r"\bpl\b": "place",
-        r"\bter\b": "terrace",
-        r"\bpkwy\b": "parkway",
-    }
+def _expand_abbreviation(match: re.Match) -> str:
+    """Full name for an abbreviated word (dropping its period), else the word as is."""
+    full = ADDRESS_ABBREVIATIONS.get(match.group(1))
+    return match.group(0) if full is None else full
+
 
-    # Merge both dictionaries and apply all replacements
-    # Also handles optional periods after abbreviations (e.g., "St." -> "street")
-    for pattern, repl in {**directions, **streets}.items():
-        addr = re.sub(pattern + r"\.?", repl, addr)
+@lru_cache(maxsize=NORMALIZE_ADDRESS_MEMO_SIZE)
+def _normalize_address(addr: str) -> str:
+    """normalize_address, in a single pass over the words ... memoized, as the same labels come back again and again."""
+    addr = addr.lower().strip()
+
+    # Expand each abbreviation (and drop a period after it, e.g., "St." -> "street")
+    if ADDRESS_GLUE.search(addr) is None:
+        addr = ADDRESS_WORD.sub(_expand_abbreviation, addr)
+    else:
+        for pattern, full in ADDRESS_PATTERNS:
+            addr = pattern.sub(full, addr)
 
     # Collapse multiple spaces into one and apply title case
-    addr = re.sub(r"\s+", " ", addr).strip().title()
-    
-    return addr
+    return " ".join(addr.split()).title()
+
 
 def intersection_parts(query: str):
     """Extract the two street names from an intersection query.
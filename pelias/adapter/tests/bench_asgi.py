@@ -0,0 +1,144 @@
+"""
+side-by-side benchmark: waitress (pserve, threads = 200) vs. the ASGI connection-handling shim (uvicorn, PELIAS_ASGI_THREADS = 200)
+
+both servers run the same config (caches off), in front of the fake Pelias (see fake_pelias.py) ... then each
+gets hit with 1k concurrent connections. the fake's latency is either a fixed number of ms, or a latency model
+(e.g., lognormal:50:0.5), seeded so runs are repeatable.
+
+usage: poetry install -E asgi
+       poetry run python pelias/adapter/tests/bench_asgi.py [num_requests] [concurrency] [pelias_latency_ms | model] [error_rate]
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+import subprocess
+
+import httpx
+
+from pelias.adapter.tests.fake_pelias import FakePelias
+
+CONFIG_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', 'config'))
+
+FAKE_PELIAS_PORT = 45590
+WAITRESS_PORT = 45591
+ASGI_PORT = 45592
+
+CONFIG = """
+[DEFAULT]
+pelias_instance = http://127.0.0.1:{pelias_port}
+
+[server:main]
+use = config:{config_dir}/base.ini
+port = {port}
+
+[app:main]
+use = config:{config_dir}/base.ini
+cache_max_entries = 0
+prefix_cache_max_entries = 0
+negative_cache_max_entries = 0
+reverse_cache_precision = 0
+route_stop_preload = false
+upstream_hedge_percentile = 0
+"""
+
+
+def start_server(name, port, config_file):
+    env = dict(os.environ, PELIAS_CONFIG=config_file, PELIAS_ASGI_THREADS='200')
+    if name == 'waitress':
+        cmd = [sys.executable, '-m', 'pyramid.scripts.pserve', config_file]
+    else:
+        cmd = [sys.executable, '-m', 'uvicorn', '--factory', 'pelias.adapter.asgi:make_app',
+               '--port', str(port), '--backlog', '4096', '--log-level', 'warning', '--no-access-log']
+    return subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_for(url, secs=30):
+    async with httpx.AsyncClient() as client:
+        end = time.monotonic() + secs
+        while time.monotonic() < end:
+            try:
+                await client.get(url)
+                return True
+            except httpx.HTTPError:
+                await asyncio.sleep(0.25)
+    return False
+
+
+async def load(port, num_requests, concurrency):
+    """ num_requests over concurrency connections ... returns (req / sec, p50 ms, p99 ms, errors) """
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for i in range(num_requests):
+        queue.put_nowait("http://127.0.0.1:{}/pelias/autocomplete?text={}%20SE%20Lambert".format(port, random.randint(1, 99999)))
+
+    async def worker(client):
+        nonlocal errors
+        while not queue.empty():
+            url = queue.get_nowait()
+            start = time.monotonic()
+            try:
+                resp = await client.get(url)
+                if resp.status_code != 200:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.monotonic() - start)
+
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        start = time.monotonic()
+        await asyncio.gather(*(worker(client) for i in range(concurrency)))
+        secs = time.monotonic() - start
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000
+    return num_requests / secs, p50, p99, errors
+
+
+async def bench(num_requests, concurrency, latency, error_rate=0.0):
+    fake = FakePelias(latency=latency, error_rate=error_rate, seed=1, port=FAKE_PELIAS_PORT)
+    server = await fake.serve()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, port in (('waitress', WAITRESS_PORT), ('asgi', ASGI_PORT)):
+            config_file = os.path.join(tmp, '{}.ini'.format(name))
+            with open(config_file, 'w') as f:
+                f.write(CONFIG.format(pelias_port=FAKE_PELIAS_PORT, config_dir=CONFIG_DIR, port=port))
+
+            proc = start_server(name, port, config_file)
+            try:
+                if await wait_for("http://127.0.0.1:{}/pelias/stats".format(port)):
+                    await load(port, min(num_requests, 500), 50)  # warm up
+                    results[name] = await load(port, num_requests, concurrency)
+                else:
+                    print("{} didn't start".format(name))
+            finally:
+                proc.terminate()
+                proc.wait()
+    server.close()
+    print("fake Pelias: {}".format(fake.stats()))
+    return results
+
+
+def main():
+    num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    latency = sys.argv[3] if len(sys.argv) > 3 else '50'
+    if ':' not in latency:
+        latency = 'fixed:' + latency
+    error_rate = float(sys.argv[4]) if len(sys.argv) > 4 else 0.0
+
+    print("{} requests, {} concurrent connections, fake Pelias latency {} (ms), error rate {}".format(num_requests, concurrency, latency, error_rate))
+    results = asyncio.run(bench(num_requests, concurrency, latency, error_rate))
+    print("{:10} {:>10} {:>10} {:>10} {:>8}".format("server", "req/sec", "p50 ms", "p99 ms", "errors"))
+    for name, (rps, p50, p99, errors) in results.items():
+        print("{:10} {:10.0f} {:10.1f} {:10.1f} {:8}".format(name, rps, p50, p99, errors))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+benchmark PeliasWrapper.dedup_addresses (grid indexed) vs. the old compare-to-every-kept-address loop,
+on synthetic Pelias responses of 10 to 1000 features (OA / OSM style dupes of nearby addresses)
+
+usage: poetry run python pelias/adapter/tests/bench_dedup.py [num_runs]
+"""
+import sys
+import random
+import timeit
+
+from ott.utils import geo_utils
+from ott.utils import string_diff
+
+from pelias.adapter.control.pelias_wrapper import PeliasWrapper
+
+STREETS = ('SE Cesar Chavez', 'NW 118th', 'SE Lambert', 'N Lombard', 'SW Broadway', 'NE Sandy', 'SE Hawthorne', 'NE Alberta')
+SUFFIXES = (('Blvd', 'Boulevard'), ('Ct', 'Court'), ('St', 'Street'), ('Ave', 'Avenue'))
+
+
+def synthetic(size, seed=1):
+    """ size features around Portland: mostly addresses, a third of them near-dupes of another one, plus some venues """
+    rnd = random.Random(seed)
+    ret_val = []
+    while len(ret_val) < size:
+        lon = -122.68 + rnd.uniform(-0.1, 0.1)
+        lat = 45.52 + rnd.uniform(-0.1, 0.1)
+        street = rnd.choice(STREETS)
+        short, long = rnd.choice(SUFFIXES)
+        num = rnd.randint(100, 20000)
+        if rnd.random() < 0.1:
+            ret_val.append(feature('venue', f"{street} Market", lon, lat))
+            continue
+        ret_val.append(feature('address', f"{num} {street} {short}", lon, lat))
+        if rnd.random() < 0.33:
+            ret_val.append(feature('address', f"{num} {street} {long}", lon + rnd.uniform(-0.0004, 0.0004), lat + rnd.uniform(-0.0004, 0.0004)))
+    return ret_val[:size]
+
+
+def feature(layer, name, lon, lat):
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+        'properties': {'layer': layer, 'name': name, 'label': name + ', Portland, OR, USA'},
+    }
+
+
+def quadratic(features):
+    """ the old dedup_addresses: every address vs. every kept address """
+    if features is None or len(features) < 2:
+        return features
+    filtered = []
+    prev = []
+    for f in features:
+        fprops = f.get('properties')
+        fname = fprops.get('name')
+        if fprops and fprops.get('layer') in ('address'):
+            do_filter = False
+            for p in prev:
+                if string_diff.compare(fname, p.get('properties').get('name')) > 0.55:
+                    if geo_utils.are_points_nearby(f, p, decimal_diff=0.0007):
+                        do_filter = True
+                        break
+            if not do_filter:
+                prev.append(f)
+                filtered.append(f)
+        else:
+            filtered.append(f)
+    return filtered
+
+
+def main():
+    num_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print(f"{'features':>8} {'kept':>6} {'old ms':>10} {'grid ms':>10} {'speedup':>8}")
+    for size in (10, 50, 100, 250, 500, 1000):
+        features = synthetic(size)
+        kept = PeliasWrapper.dedup_addresses(features)
+        assert kept == quadratic(features), "grid dedup doesn't match the old one"
+        old = timeit.timeit(lambda: quadratic(features), number=num_runs) / num_runs * 1000
+        new = timeit.timeit(lambda: PeliasWrapper.dedup_addresses(features), number=num_runs) / num_runs * 1000
+        print(f"{size:8} {len(kept):6} {old:10.2f} {new:10.2f} {old / new:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+benchmark PeliasWrapper.fixup_response ... with and without the per-feature label memo
+
+usage: poetry run python pelias/adapter/tests/bench_fixup.py [num_requests]
+"""
+import os
+import sys
+import copy
+import json
+import glob
+import timeit
+
+from pelias.adapter.control.pelias_wrapper import PeliasWrapper
+
+
+def load_responses():
+    """ the Pelias FeatureCollections in tests/data """
+    ret_val = []
+    for f in sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'data', '*.json'))):
+        with open(f) as fp:
+            j = json.load(fp)
+        if isinstance(j, dict) and j.get('features'):
+            ret_val.append(j)
+    return ret_val
+
+
+def bench(responses, num_requests, memo_size):
+    """ avg. usecs per fixup_response() call, over num_requests (pre-copied) responses """
+    PeliasWrapper.config_label_memo(memo_size)
+    copies = [copy.deepcopy(responses[i % len(responses)]) for i in range(num_requests)]
+    it = iter(copies)
+    secs = timeit.timeit(lambda: PeliasWrapper.fixup_response(next(it), size=10, is_rtp=True), number=num_requests)
+    return secs / num_requests * 1000000
+
+
+def main():
+    num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    responses = load_responses()
+    print(f"fixup_response over {num_requests} requests ({len(responses)} distinct responses)")
+
+    no_memo = bench(responses, num_requests, 0)
+    memo = bench(responses, num_requests, 10000)
+    print(f"  no memo: {no_memo:8.1f} usecs / request")
+    print(f"  memo:    {memo:8.1f} usecs / request   {PeliasWrapper.label_memo_stats()}")
+    print(f"  saved:   {no_memo - memo:8.1f} usecs / request ({(1 - memo / no_memo) * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+benchmark the 'json' renderer's serializer: stdlib json.dumps (pyramid's default) vs. renderers.fast_dumps (orjson)
+
+each of the Pelias responses in tests/data is encoded as is, and with its features repeated out to num_features
+(ala a large 'size' request) ... allocations are tracemalloc's peak bytes for one encode
+
+usage: poetry run pip install orjson
+       poetry run python pelias/adapter/tests/bench_json.py [num_encodes] [num_features]
+"""
+import os
+import sys
+import json
+import glob
+import timeit
+import tracemalloc
+
+from pelias.adapter.pyramid.renderers import fast_dumps
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def load_responses(num_features):
+    """ (name, response) for the Pelias FeatureCollections in tests/data ... plus a num_features copy of each """
+    ret_val = []
+    for f in sorted(glob.glob(os.path.join(DATA, '*.json'))):
+        with open(f) as fp:
+            j = json.load(fp)
+        if not isinstance(j, dict) or not j.get('features'):
+            continue
+        name = os.path.basename(f)
+        ret_val.append((name, j))
+        big = dict(j, features=[j['features'][i % len(j['features'])] for i in range(num_features)])
+        ret_val.append(("{} x{}".format(name, num_features), big))
+    return ret_val
+
+
+def peak_bytes(func, value):
+    tracemalloc.start()
+    func(value)
+    ret_val = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return ret_val
+
+
+def main():
+    num_encodes = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    num_features = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    encoders = (('json.dumps', json.dumps), ('fast_dumps', fast_dumps))
+    print("{:40} {:>12} {:>14} {:>14} {:>10}".format("response", "encoder", "usecs/encode", "peak KB", "body KB"))
+    for name, value in load_responses(num_features):
+        for enc_name, enc in encoders:
+            secs = timeit.timeit(lambda: enc(value), number=num_encodes)
+            print("{:40} {:>12} {:14.1f} {:14.1f} {:10.1f}".format(
+                name, enc_name, secs / num_encodes * 1e6, peak_bytes(enc, value) / 1024, len(enc(value)) / 1024
+            ))
+
+
+if __name__ == "__main__":
+    main()
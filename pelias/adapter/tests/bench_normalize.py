@@ -0,0 +1,64 @@
+"""
+microbenchmark util.normalize_address (one pass over the words, plus a memo) vs. the old re.sub per abbreviation,
+over the feature labels (and query texts) in tests/data/test_util_data.json
+
+usage: poetry run python pelias/adapter/tests/bench_normalize.py [num_runs]
+"""
+import os
+import re
+import sys
+import json
+import timeit
+
+from pelias.adapter.service import util
+
+DATA = os.path.join(os.path.dirname(__file__), 'data', 'test_util_data.json')
+
+
+def load_addresses():
+    """ the labels (and query texts) that refine_service would normalize """
+    ret_val = []
+    with open(DATA) as f:
+        data = json.load(f)
+    for text, response in data.items():
+        ret_val.append(text)
+        for feature in response.get('features', []):
+            label = feature.get('properties', {}).get('label')
+            if label:
+                ret_val.append(label.lower().strip())
+    return ret_val
+
+
+def regex_normalize(addr):
+    """ the old normalize_address: a re.sub per abbreviation """
+    if not addr:
+        return ""
+    addr = addr.lower().strip()
+    for abbr, full in util.ADDRESS_ABBREVIATIONS.items():
+        addr = re.sub(r"\b" + abbr + r"\b\.?", full, addr)
+    return re.sub(r"\s+", " ", addr).strip().title()
+
+
+def bench(func, addresses, num_runs):
+    """ avg. usecs per address """
+    secs = timeit.timeit(lambda: [func(a) for a in addresses], number=num_runs)
+    return secs / num_runs / len(addresses) * 1000000
+
+
+def main():
+    num_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    addresses = load_addresses()
+    assert [regex_normalize(a) for a in addresses] == [util.normalize_address(a) for a in addresses]
+    print(f"normalize_address over {len(addresses)} addresses ({len(set(addresses))} distinct), {num_runs} runs")
+
+    old = bench(regex_normalize, addresses, num_runs)
+    one_pass = bench(util._normalize_address.__wrapped__, addresses, num_runs)
+    util._normalize_address.cache_clear()
+    memo = bench(util.normalize_address, addresses, num_runs)
+    print(f"  re.sub per abbreviation: {old:6.2f} usecs / address")
+    print(f"  one pass:                {one_pass:6.2f} usecs / address ({old / one_pass:.1f}x)")
+    print(f"  one pass + memo:         {memo:6.2f} usecs / address ({old / memo:.1f}x)   {util._normalize_address.cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+a fake Pelias (http) server, for load testing / benchmarking the adapter offline (and reproducibly)
+
+serves /v1/autocomplete, /v1/search and /v1/reverse (under any path prefix, e.g., /pelias/v1/search) from fixture
+json files ... a recorded fixture for the exact query (see 'record' below) when there is one, else a default one
+per service (e.g., tests/data/search13135.json). features are trimmed to the 'size' param. each response can be
+delayed (a latency model), turned into an error (error_rate) or into an empty result (empty_rate).
+
+latency models (ms):
+    fixed:50                 always 50ms
+    uniform:20:80            anywhere from 20 to 80ms
+    normal:50:10             mean 50ms, std dev 10ms
+    lognormal:50:0.5         median 50ms, sigma 0.5 (a long tail)
+    bimodal:40:2000:1        40ms ... except 1% of calls take 2 secs (e.g., a slow Pelias shard)
+
+usage:
+    poetry run python pelias/adapter/tests/fake_pelias.py serve --port 45590 --latency lognormal:50:0.5 --error-rate 0.01 --seed 1
+    poetry run pserve config/fake_pelias.ini   (the adapter, pointed at the fake)
+
+    # record fixtures from a real Pelias (served by 'serve --fixtures <dir>' for those same queries)
+    poetry run python pelias/adapter/tests/fake_pelias.py record --pelias https://ws.trimet.org/pelias --fixtures /tmp/fixtures \\
+        "autocomplete?text=834 SE Lambert" "search?text=pdx" "reverse?point.lat=45.5&point.lon=-122.6"
+"""
+import os
+import re
+import sys
+import json
+import math
+import random
+import asyncio
+import argparse
+import threading
+import urllib.request
+from collections import Counter
+from urllib.parse import urlsplit, parse_qsl, urlencode, quote
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+SERVICES = ('autocomplete', 'search', 'reverse')
+DEFAULT_FIXTURES = {
+    'autocomplete': 'autocomplete-hop-fastpass.json',
+    'search': 'search13135.json',
+    'reverse': 'search13135.json',
+}
+EMPTY_FIXTURE = 'autocomplete_no_results.json'
+
+
+def latency_model(spec, rng):
+    """ 'name:arg:arg...' (see above) -> function returning a delay in secs """
+    name, *args = (spec or 'fixed:0').split(':')
+    args = [float(a) for a in args]
+    if name == 'fixed':
+        ret_val = lambda: args[0]
+    elif name == 'uniform':
+        ret_val = lambda: rng.uniform(args[0], args[1])
+    elif name == 'normal':
+        ret_val = lambda: max(rng.gauss(args[0], args[1]), 0.0)
+    elif name == 'lognormal':
+        mu = math.log(args[0])
+        ret_val = lambda: rng.lognormvariate(mu, args[1])
+    elif name == 'bimodal':
+        ret_val = lambda: args[1] if rng.random() * 100 < args[2] else args[0]
+    else:
+        raise ValueError("unknown latency model '{}' (should be fixed, uniform, normal, lognormal or bimodal)".format(spec))
+    return lambda: ret_val() / 1000.0
+
+
+def fixture_name(service, params):
+    """ file name of the recorded fixture for a query, e.g., search-834_se_lambert.json or reverse-45.5000_-122.6000.json """
+    if service == 'reverse':
+        try:
+            key = "{:.4f}_{:.4f}".format(float(params.get('point.lat')), float(params.get('point.lon')))
+        except (TypeError, ValueError):
+            key = ''
+    else:
+        key = re.sub(r'[^a-z0-9]+', '_', (params.get('text') or '').lower()).strip('_')
+    return "{}-{}.json".format(service, key)
+
+
+class FakePelias(object):
+    """
+    :param fixtures: dir of recorded fixtures (see fixture_name) ... the defaults always come from tests/data
+    :param seed: seeds the latency / error / empty draws, for reproducible runs
+    """
+    def __init__(self, fixtures=None, latency='fixed:0', error_rate=0.0, error_status=500, empty_rate=0.0, seed=None, host='127.0.0.1', port=0):
+        self.fixtures = fixtures
+        self.rng = random.Random(seed)
+        self.latency = latency_model(latency, self.rng)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.empty_rate = empty_rate
+        self.host = host
+        self.port = port
+
+        self.counts = Counter()
+        self._bodies = {}
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(self.host, self.port)
+
+    def load(self, path, size=None):
+        """ fixture body (bytes), w/ features trimmed to size ... cached """
+        key = (path, size)
+        ret_val = self._bodies.get(key)
+        if ret_val is None:
+            with open(path) as f:
+                j = json.load(f)
+            if size is not None and len(j.get('features') or []) > size:
+                j['features'] = j['features'][:size]
+            ret_val = self._bodies[key] = json.dumps(j).encode('utf-8')
+        return ret_val
+
+    def fixture(self, service, params):
+        if self.fixtures:
+            path = os.path.join(self.fixtures, fixture_name(service, params))
+            if os.path.exists(path):
+                return path
+        return os.path.join(DATA, DEFAULT_FIXTURES[service])
+
+    def respond(self, target):
+        """ (status, body, delay secs) for a GET of target (path + query string) """
+        parts = urlsplit(target)
+        params = dict(parse_qsl(parts.query))
+        service = parts.path.rstrip('/').rsplit('/', 1)[-1]
+        if service not in SERVICES or '/v1/' not in parts.path:
+            self.counts['not_found'] += 1
+            return 404, json.dumps({'geocoding': {'errors': ['not found: ' + parts.path]}}).encode('utf-8'), 0.0
+
+        self.counts[service] += 1
+        delay = self.latency()
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.counts['errors'] += 1
+            body = {'geocoding': {'errors': ['fake Pelias error (error_rate {})'.format(self.error_rate)]}, 'type': 'FeatureCollection', 'features': []}
+            return self.error_status, json.dumps(body).encode('utf-8'), delay
+
+        if self.empty_rate and self.rng.random() < self.empty_rate:
+            self.counts['empty'] += 1
+            return 200, self.load(os.path.join(DATA, EMPTY_FIXTURE)), delay
+
+        try:
+            size = int(params['size']) if 'size' in params else None
+        except ValueError:
+            size = None
+        return 200, self.load(self.fixture(service, params), size), delay
+
+    async def handle(self, reader, writer):
+        """ bare bones http/1.1 (GET only, keep-alive) """
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                lines = head.decode('latin-1').split('\r\n')
+                method, target, _ = lines[0].split(' ', 2)
+                keep_alive = 'connection: close' not in head.decode('latin-1').lower()
+
+                status, body, delay = self.respond(target) if method == 'GET' else (405, b'{}', 0.0)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                writer.write(
+                    "HTTP/1.1 {} {}\r\nContent-Type: application/json; charset=utf-8\r\nContent-Length: {}\r\n{}\r\n".format(
+                        status, 'OK' if status == 200 else 'Error', len(body), '' if keep_alive else 'Connection: close\r\n'
+                    ).encode('latin-1') + body
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        """ start serving on the current loop (port 0 == any free port ... see self.port after) """
+        self._server = await asyncio.start_server(self.handle, self.host, self.port, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self._server
+
+    def start(self):
+        """ serve from a background thread (e.g., in tests) ... returns self, once it's listening """
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.serve())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="fake-pelias", daemon=True)
+        self._thread.start()
+        started.wait(10)
+        return self
+
+    def stop(self):
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(10)
+            self._loop = None
+
+    def stats(self):
+        return dict(self.counts)
+
+
+def record(pelias_url, queries, fixtures, timeout=30):
+    """ GET each 'service?query' from a real Pelias, and save it as a fixture ... returns the file names """
+    os.makedirs(fixtures, exist_ok=True)
+    ret_val = []
+    for q in queries:
+        service, _, query = q.partition('?')
+        params = dict(parse_qsl(query))
+        url = "{}/v1/{}?{}".format(pelias_url.rstrip('/'), service, urlencode(params, quote_via=quote))
+        with urllib.request.urlopen(url, timeout=timeout) as resp:
+            body = resp.read()
+        name = fixture_name(service, params)
+        with open(os.path.join(fixtures, name), 'wb') as f:
+            f.write(body)
+        ret_val.append(name)
+    return ret_val
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="fake Pelias server (and fixture recorder)")
+    sub = parser.add_subparsers(dest='cmd', required=True)
+
+    s = sub.add_parser('serve')
+    s.add_argument('--host', default='127.0.0.1')
+    s.add_argument('--port', type=int, default=45590)
+    s.add_argument('--fixtures', help="dir of recorded fixtures")
+    s.add_argument('--latency', default='fixed:0', help="latency model, e.g. lognormal:50:0.5")
+    s.add_argument('--error-rate', type=float, default=0.0)
+    s.add_argument('--error-status', type=int, default=500)
+    s.add_argument('--empty-rate', type=float, default=0.0)
+    s.add_argument('--seed', type=int)
+
+    r = sub.add_parser('record')
+    r.add_argument('--pelias', required=True, help="e.g. https://ws.trimet.org/pelias")
+    r.add_argument('--fixtures', required=True)
+    r.add_argument('queries', nargs='+', help="e.g. 'search?text=pdx'")
+
+    args = parser.parse_args(argv)
+    if args.cmd == 'record':
+        for name in record(args.pelias, args.queries, args.fixtures):
+            print(name)
+        return
+
+    fake = FakePelias(
+        fixtures=args.fixtures, latency=args.latency, error_rate=args.error_rate, error_status=args.error_status,
+        empty_rate=args.empty_rate, seed=args.seed, host=args.host, port=args.port
+    )
+
+    async def run():
+        server = await fake.serve()
+        print("fake Pelias on {}/v1 (latency {})".format(fake.url, args.latency), flush=True)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        print(fake.stats())
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
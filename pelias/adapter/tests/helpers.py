@@ -26,3 +26,29 @@ class TestMultiDict(dict):
             else:
                 return [value]
         return []
+
+
+class FakeClock:
+    """Manually advanced clock (a time.monotonic stand-in), so TTL / deadline tests don't have to sleep."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeResponse:
+    """Just enough of a requests.Response for the upstream callers."""
+
+    def __init__(self, status_code=200, text="", json=None):
+        self.status_code = status_code
+        self.text = text
+        self._json = json
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError("{} error".format(self.status_code))
+
+    def json(self):
+        return self._json
@@ -0,0 +1,69 @@
+"""Tests for the pelias.adapter.asgi connection-handling shim (its wsgi bridge ... no servers needed)."""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("httpx")
+
+from pelias.adapter.asgi import AsgiShim, AsyncUpstreamPool, wsgi_environ
+from pelias.adapter.control.upstream import UpstreamPool
+
+
+def echo_app(environ, start_response):
+    """ tiny wsgi app that echoes back bits of its environ """
+    body = "{REQUEST_METHOD} {PATH_INFO}?{QUERY_STRING} {HTTP_IF_NONE_MATCH}".format(**environ).encode()
+    start_response("200 OK", [("Content-Type", "text/plain"), ("ETag", '"abc"')])
+    return [body]
+
+
+SCOPE = {
+    "type": "http",
+    "method": "GET",
+    "path": "/pelias/autocomplete",
+    "query_string": b"text=834%20SE",
+    "headers": [(b"if-none-match", b'"abc"'), (b"host", b"localhost:45554")],
+    "server": ("127.0.0.1", 45554),
+    "client": ("10.0.0.1", 5555),
+}
+
+
+def test_wsgi_environ():
+    environ = wsgi_environ(SCOPE, b"")
+    assert environ["PATH_INFO"] == "/pelias/autocomplete"
+    assert environ["QUERY_STRING"] == "text=834%20SE"
+    assert environ["HTTP_IF_NONE_MATCH"] == '"abc"'
+    assert environ["HTTP_HOST"] == "localhost:45554"
+    assert environ["REMOTE_ADDR"] == "10.0.0.1"
+    assert environ["SERVER_PORT"] == "45554"
+
+
+def test_asgi_shim_serves_the_wsgi_app():
+    app = AsgiShim(echo_app, threads=2)
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(SCOPE, receive, send))
+    assert sent[0]["status"] == 200
+    assert (b"etag", b'"abc"') in sent[0]["headers"]
+    assert sent[1]["body"] == b'GET /pelias/autocomplete?text=834%20SE "abc"'
+
+
+def test_async_pool_keeps_the_configured_pool_settings():
+    pool = UpstreamPool(pool_size=20, breaker_failures=3)
+    pool.add_breaker("http://localhost/v1/search")
+
+    loop = asyncio.new_event_loop()
+    try:
+        async_pool = AsyncUpstreamPool(loop, pool)
+        assert async_pool.breakers is pool.breakers
+        assert async_pool.session is None
+        assert async_pool.stats()["hosts"] == {}
+        loop.run_until_complete(async_pool.close())
+    finally:
+        loop.close()
@@ -0,0 +1,122 @@
+"""Tests for pelias.adapter.control.backends module."""
+
+import pytest
+
+from pelias.adapter.control.backends import BackendPool
+from pelias.adapter.tests.helpers import FakeClock, FakeResponse
+
+PREFIX = "https://ws.trimet.org/pelias"
+URLS = ["http://pelias-a:4000", "http://pelias-b:4000/"]
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def make_pool(clock, **kwargs):
+    return BackendPool(PREFIX, URLS, clock=clock, **kwargs)
+
+
+def test_matches_and_url(clock):
+    pool = make_pool(clock)
+    assert pool.matches(PREFIX + "/v1/autocomplete?text=zoo")
+    assert not pool.matches("http://maps.trimet.org/ti/index/stops")
+
+    b = pool.backends[1]
+    assert b.url == "http://pelias-b:4000"
+    assert pool.url(b, PREFIX + "/v1/reverse?point.lat=45.5&point.lon=-122.6") == "http://pelias-b:4000/v1/reverse?point.lat=45.5&point.lon=-122.6"
+
+
+def test_no_backends_is_disabled(clock):
+    pool = BackendPool(PREFIX, [], clock=clock)
+    assert not pool.enabled
+    assert not pool.matches(PREFIX + "/v1/search")
+
+
+def test_least_outstanding(clock):
+    pool = make_pool(clock)
+    first = pool.pick()
+    second = pool.pick()
+    assert first is not second
+
+    pool.done(first, 0.05)
+    assert pool.pick() is first
+
+
+def test_ewma_prefers_the_faster_backend(clock):
+    pool = make_pool(clock, policy="ewma")
+    a, b = pool.backends
+    for _ in range(5):
+        for backend, secs in ((a, 0.5), (b, 0.05)):
+            backend.in_flight += 1
+            pool.done(backend, secs)
+
+    assert all(pool.pick() is b for _ in range(3))
+
+    # note: ... until b has enough calls outstanding that a looks better
+    assert b.in_flight == 3
+    for _ in range(10):
+        pool.pick()
+    assert a.in_flight > 0
+
+
+def test_passive_ejection(clock):
+    pool = make_pool(clock, eject_failures=3, eject_secs=30)
+    a, b = pool.backends
+    for _ in range(3):
+        a.in_flight += 1
+        pool.done(a, 0.01, ok=False)
+
+    assert pool.stats()["backends"]["http://pelias-a:4000"]["ejected"]
+    assert all(pool.pick() is b for _ in range(5))
+
+    clock.now += 31
+    assert pool.stats()["backends"]["http://pelias-a:4000"]["ejected"] is False
+    assert pool.pick() is a
+
+
+def test_a_success_resets_the_failure_count(clock):
+    pool = make_pool(clock, eject_failures=2)
+    a = pool.backends[0]
+    for ok in (False, True, False):
+        a.in_flight += 1
+        pool.done(a, 0.01, ok=ok)
+    assert a.ejections == 0
+    assert a.errors == 2
+
+
+def test_probe_marks_unhealthy_backends(clock):
+    pool = make_pool(clock)
+    probed = []
+
+    def send(url, params, timeout):
+        probed.append(url)
+        if "pelias-a" in url:
+            raise ConnectionError("down")
+        return FakeResponse(200)
+
+    pool.probe(send)
+    assert probed == ["http://pelias-a:4000/v1/autocomplete?text=portland&size=1", "http://pelias-b:4000/v1/autocomplete?text=portland&size=1"]
+    assert all(pool.pick() is pool.backends[1] for _ in range(5))
+
+    pool.probe(lambda url, params, timeout: FakeResponse(200))
+    assert pool.backends[0].healthy
+
+
+def test_all_down_still_picks_one(clock):
+    pool = make_pool(clock)
+    pool.probe(lambda url, params, timeout: FakeResponse(503))
+    assert pool.pick() in pool.backends
+    assert pool.stats()["no_backends"] == 1
+
+
+def test_stats(clock):
+    pool = make_pool(clock)
+    b = pool.pick()
+    pool.done(b, 0.1, ok=False)
+    stats = pool.stats()
+    assert stats["prefix"] == PREFIX
+    assert stats["backends"][b.url]["requests"] == 1
+    assert stats["backends"][b.url]["errors"] == 1
+    assert stats["backends"][b.url]["ewma_ms"] == 100.0
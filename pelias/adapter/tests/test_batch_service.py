@@ -0,0 +1,234 @@
+"""Tests for pelias.adapter.service.batch_service module."""
+
+import threading
+import time
+
+import pytest
+
+from pelias.adapter.service import batch_service
+from pelias.adapter.service.batch_service import Batch, BatchError, item_params, point_lat_lon, response_status, run_batch, run_bulk_reverse
+
+
+@pytest.fixture(autouse=True)
+def batch_config():
+    Batch.config(max_items=10, concurrency=3, threads=4, item_deadline_secs=5, deadline_secs=10, reverse_precision=9)
+    yield
+    Batch.config()
+
+
+@pytest.fixture
+def fake_pelias(monkeypatch):
+    """ echo the query text back as a single feature (and remember the deadlines each item got) """
+    calls = []
+
+    def get_pelias_response(service, request, is_rtp=False, deadline=None):
+        calls.append((service, request.params.get('text'), is_rtp, deadline))
+        text = request.params.get('text')
+        if text == 'boom':
+            raise RuntimeError("pelias blew up")
+        if text == 'down':
+            return {"geocoding": {"errors": ["circuit open"]}, "type": "FeatureCollection", "features": []}
+        if text == 'broken':
+            return {"errors": ["system error"], "status_code": 500}
+        if text == 'broken_response':
+            return ErrorResponse()
+        time.sleep(0.01)
+        return {"type": "FeatureCollection", "features": [{"properties": {"name": text}}]}
+
+    monkeypatch.setattr(batch_service.pelias_service, "get_pelias_response", get_pelias_response)
+    return calls
+
+
+class ErrorResponse:
+    """ sys_error_response(), as a (pyramid) Response """
+    status_code = 500
+    json_body = {"status_code": 500, "has_errors": True, "status_message": "System Error"}
+
+
+@pytest.mark.parametrize("response,status", [
+    ({"type": "FeatureCollection", "features": []}, 200),
+    ([], 200),
+    ({"errors": ["system error"]}, 502),
+    ({"error": "system error"}, 502),
+    ({"has_errors": True}, 502),
+    ({"geocoding": {"errors": ["circuit open"]}, "features": []}, 503),
+    (ErrorResponse(), 502),
+    (None, 502),
+])
+def test_response_status(response, status):
+    assert response_status(response) == status
+
+
+def names(results):
+    return [r["response"]["features"][0]["properties"]["name"] for r in results]
+
+
+class TestItemParams:
+    def test_query_object(self):
+        assert item_params({"text": "zoo", "size": 1, "layers": None}) == {"text": "zoo", "size": 1}
+
+    def test_string(self):
+        assert item_params("zoo") == {"text": "zoo"}
+
+    @pytest.mark.parametrize("item", [None, 5, [], {}])
+    def test_bad_items(self, item):
+        with pytest.raises(ValueError):
+            item_params(item)
+
+
+class TestRunBatch:
+    def test_results_are_in_input_order(self, fake_pelias):
+        items = [{"text": "stop {}".format(i)} for i in range(10)]
+        results = run_batch(items, service="search")
+        assert [r["status"] for r in results] == [200] * 10
+        assert names(results) == ["stop {}".format(i) for i in range(10)]
+        assert all(c[0] == "search" for c in fake_pelias)
+
+    def test_per_item_status(self, fake_pelias):
+        results = run_batch(["zoo", 5, "boom", {"text": "pdx"}], service="autocomplete")
+        assert [r["status"] for r in results] == [200, 400, 500, 200]
+        assert "error" in results[1] and "error" in results[2]
+
+        stats = Batch.stats()
+        assert stats["batches"] == 1
+        assert stats["items"] == 4
+        assert stats["items_200"] == 2
+
+    def test_upstream_errors_are_not_empty_results(self, fake_pelias):
+        results = run_batch(["zoo", "down", "broken"])
+        assert [r["status"] for r in results] == [200, 503, 502]
+        assert all("error" in r for r in results[1:])
+        assert results[1]["response"]["geocoding"]["errors"] == ["circuit open"]
+        assert Batch.stats()["items_503"] == 1
+
+    def test_error_responses_become_json(self, fake_pelias):
+        results = run_batch(["broken_response"])
+        assert results[0]["status"] == 502
+        assert results[0]["response"] == ErrorResponse.json_body
+
+    def test_concurrency_is_bounded(self, monkeypatch):
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def get_pelias_response(service, request, is_rtp=False, deadline=None):
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.pop()
+            return {"features": []}
+
+        monkeypatch.setattr(batch_service.pelias_service, "get_pelias_response", get_pelias_response)
+        run_batch(["q{}".format(i) for i in range(10)], service="search")
+        assert max(peak) <= Batch.concurrency
+
+    def test_item_deadline_is_capped_by_the_batch(self, fake_pelias):
+        run_batch(["zoo"], service="search")
+        deadline = fake_pelias[0][3]
+        assert 0 < deadline.secs <= Batch.item_deadline_secs
+
+    def test_items_after_the_batch_deadline(self, fake_pelias):
+        Batch.config(max_items=10, concurrency=1, deadline_secs=0)
+        results = run_batch(["zoo", "pdx"], service="search")
+        assert [r["status"] for r in results] == [504, 504]
+        assert fake_pelias == []
+
+    def test_refine(self, monkeypatch):
+        refined = []
+        monkeypatch.setattr(batch_service.refine_service, "refine",
+                            lambda request, service, is_rtp, deadline: refined.append(service) or {"features": []})
+        results = run_batch(["zoo"], service="autocomplete", refine=True)
+        assert results == [{"status": 200, "response": {"features": []}}]
+        assert refined == ["autocomplete"]
+
+    def test_not_a_list(self):
+        with pytest.raises(BatchError) as e:
+            run_batch({"text": "zoo"})
+        assert e.value.status == 400
+
+    def test_too_many_items(self):
+        with pytest.raises(BatchError) as e:
+            run_batch(["zoo"] * 11)
+        assert e.value.status == 413
+
+    def test_unknown_service(self):
+        with pytest.raises(BatchError) as e:
+            run_batch(["zoo"], service="geocode")
+        assert e.value.status == 404
+
+
+@pytest.fixture
+def fake_reverse(monkeypatch):
+    """ a street (~16m) and an address (~33m) near each point asked for (w/ bogus distances) ... remembers the query strings """
+    calls = []
+
+    def reverse(reverse_geo_url, query_string, deadline=None):
+        calls.append(query_string)
+        params = dict(p.split("=") for p in query_string.split("&"))
+        lat, lon = float(params["point.lat"]), float(params["point.lon"])
+        return {"type": "FeatureCollection", "features": [
+            {"geometry": {"coordinates": [lon + 0.0002, lat]}, "properties": {"layer": "street", "distance": 1.0}},
+            {"geometry": {"coordinates": [lon, lat + 0.0003]}, "properties": {"layer": "address", "distance": 1.0}},
+        ]}
+
+    monkeypatch.setattr(batch_service.PeliasWrapper, "reverse", reverse)
+    return calls
+
+
+class TestPointLatLon:
+    @pytest.mark.parametrize("point", [[45.5, -122.6], (45.5, -122.6), {"lat": 45.5, "lon": -122.6},
+                                       {"point.lat": "45.5", "point.lon": "-122.6"}])
+    def test_formats(self, point):
+        assert point_lat_lon(point) == (45.5, -122.6)
+
+    @pytest.mark.parametrize("point", [None, [45.5], {"lat": 45.5}, ["x", "y"], [95.0, -122.6]])
+    def test_bad_points(self, point):
+        with pytest.raises(ValueError):
+            point_lat_lon(point)
+
+
+class TestBulkReverse:
+    def test_one_feature_collection_per_point(self, fake_reverse):
+        points = [[45.5, -122.6], [45.6, -122.7], {"lat": 45.7, "lon": -122.8}]
+        results = run_bulk_reverse(points, "http://pelias/v1/reverse", {"layers": "address,street"})
+        assert len(results) == 3
+        assert len(fake_reverse) == 3
+        assert all("layers=address%2Cstreet" in qs for qs in fake_reverse)
+        assert [r["features"][1]["geometry"]["coordinates"][1] for r in results] == pytest.approx([45.5003, 45.6003, 45.7003])
+
+    def test_nearby_points_are_deduped(self, fake_reverse):
+        # the 2nd point is ~1m from the 1st (same precision 9 cell), the 3rd is the same point as the 1st
+        points = [[45.51423, -122.70975], [45.514235, -122.709755], [45.51423, -122.70975], [45.6, -122.7]]
+        results = run_bulk_reverse(points, "http://pelias/v1/reverse")
+        assert len(fake_reverse) == 2
+        assert len(results) == 4
+        assert results[0] == results[2]
+        assert results[1] is not results[0]
+
+        # the nearby point's distances are its own, and addresses still sort to the top
+        assert [f["properties"]["distance"] for f in results[0]["features"]] == [1.0, 1.0]
+        assert [f["properties"]["layer"] for f in results[1]["features"]] == ["address", "street"]
+        assert [f["properties"]["distance"] for f in results[1]["features"]] == [0.033, 0.016]
+        assert Batch.stats()["points_deduped"] == 2
+
+    def test_precision_zero_only_dedupes_identical_points(self, fake_reverse):
+        Batch.config(reverse_precision=0)
+        run_bulk_reverse([[45.51423, -122.70975], [45.514235, -122.709755], [45.51423, -122.70975]], "url")
+        assert len(fake_reverse) == 2
+
+    def test_bad_points_get_an_error_response(self, fake_reverse):
+        results = run_bulk_reverse([[45.5, -122.6], "nope"], "url")
+        assert results[0]["features"]
+        assert results[1]["features"] == []
+        assert results[1]["geocoding"]["errors"]
+
+    def test_point_params_are_replaced(self, fake_reverse):
+        run_bulk_reverse([[45.5, -122.6]], "url", {"point.lat": "1", "point.lon": "2", "size": "1"})
+        assert fake_reverse == ["size=1&point.lat=45.5&point.lon=-122.6"]
+
+    def test_too_many_points(self):
+        with pytest.raises(BatchError) as e:
+            run_bulk_reverse([[45.5, -122.6]] * 11, "url")
+        assert e.value.status == 413
@@ -0,0 +1,70 @@
+"""Tests for pelias.adapter.pyramid.cache_warmer module (the query gathering bits ... no Pelias server needed)."""
+
+import pytest
+
+from pelias.adapter.pyramid.cache_warmer import queries_from_csv, queries_from_log, to_pelias_path
+
+
+def test_queries_from_stops_csv():
+    queries = queries_from_csv('pelias/adapter/tests/data/stops.csv')
+    assert queries[:2] == ['/pelias/autocomplete?text=364', '/pelias/autocomplete?text=3326']
+
+
+def test_queries_from_alias_csv():
+    queries = queries_from_csv('pelias/adapter/tests/data/alias.csv', service='search')
+    assert queries[0] == '/pelias/search?text=Oregon+City+Transit+Center'
+    assert '/pelias/search?text=PDX' in queries
+    assert all(q.startswith('/pelias/search?text=') for q in queries)
+
+
+def test_queries_from_csv_missing_column(tmp_path):
+    f = tmp_path / "x.csv"
+    f.write_text("a,b\n1,2\n")
+    assert queries_from_csv(str(f)) == []
+
+
+@pytest.mark.parametrize("url,expected", [
+    ("/pelias/autocomplete?text=5", "/pelias/autocomplete?text=5"),
+    ("/peliaswrap/v1/rtp/autocomplete?text=5", "/pelias/rtp/autocomplete?text=5"),
+    ("/pelias/refine/search?text=834%20SE", "/pelias/refine/search?text=834%20SE"),
+    ("/pelias?text=6", "/pelias/autocomplete?text=6"),
+    ("/pelias/reverse?point.lat=45.5&point.lon=-122.6", "/pelias/reverse?point.lat=45.5&point.lon=-122.6"),
+    ("/pelias/autocomplete", None),
+    ("/solr/select?q=2", None),
+])
+def test_to_pelias_path(url, expected):
+    assert to_pelias_path(url) == expected
+
+
+def test_queries_from_log_most_frequent_first(tmp_path):
+    f = tmp_path / "access.log"
+    f.write_text(
+        '1.2.3.4 - - [18/Oct/2026:07:00:00] "GET /pelias/search?text=pdx HTTP/1.1" 200 512\n'
+        + '1.2.3.4 - - [18/Oct/2026:07:00:01] "GET /peliaswrap/v1/rtp/autocomplete?text=5 HTTP/1.1" 200 512\n' * 3
+        + '1.2.3.4 - - [18/Oct/2026:07:00:02] "GET /solr/select?q=2 HTTP/1.1" 200 512\n'
+        + 'garbage line\n'
+    )
+    assert queries_from_log(str(f)) == ['/pelias/rtp/autocomplete?text=5', '/pelias/search?text=pdx']
+    assert queries_from_log(str(f), max_queries=1) == ['/pelias/rtp/autocomplete?text=5']
+
+
+def test_warm_gives_up_after_timeout(monkeypatch):
+    import threading
+    import time
+
+    from pelias.adapter.pyramid import cache_warmer
+
+    release = threading.Event()
+
+    def replay(path):
+        if 'slow' in path:
+            release.wait(10)
+
+    monkeypatch.setattr(cache_warmer, "replay", replay)
+    start = time.monotonic()
+    report = cache_warmer.warm(['/pelias/autocomplete?text=fast', '/pelias/autocomplete?text=slow'] * 2, concurrency=2, timeout=0.2)
+    release.set()
+
+    assert time.monotonic() - start < 2
+    assert report['completed'] == 2
+    assert report['timed_out'] == 2
@@ -0,0 +1,166 @@
+"""Tests for pelias.adapter.control.deadline module."""
+
+import pytest
+
+from pelias.adapter.control import upstream
+from pelias.adapter.control.deadline import Deadline, has_time
+from pelias.adapter.control.pelias_wrapper import PeliasWrapper
+from pelias.adapter.control.pelias_to_solr import PeliasToSolr
+from pelias.adapter.control.response_cache import ResponseCache
+from pelias.adapter.control.prefix_cache import PrefixCache, NegativeCache
+from pelias.adapter.control.single_flight import SingleFlight
+from pelias.adapter.tests.helpers import FakeClock
+
+
+def test_remaining_and_expired():
+    clock = FakeClock()
+    deadline = Deadline(25, clock=clock)
+    assert deadline.remaining() == 25
+    assert not deadline.expired()
+
+    clock.now += 30
+    assert deadline.remaining() == 0
+    assert deadline.expired()
+
+
+def test_timeout_is_the_time_left_capped_at_default():
+    clock = FakeClock()
+    deadline = Deadline(25, clock=clock)
+    assert deadline.timeout() == 25
+    assert deadline.timeout(10) == 10
+
+    clock.now += 20
+    assert deadline.timeout(10) == 5
+
+
+def test_has_time_for_optional_stages():
+    clock = FakeClock()
+    deadline = Deadline(25, clock=clock)
+    assert has_time(deadline, 2)
+    clock.now += 24
+    assert not has_time(deadline, 2)
+    assert has_time(None, 2)
+
+
+# ============================================================================
+# optional stages get skipped when the deadline is near
+# ============================================================================
+
+AUTO = "http://pelias/v1/autocomplete"
+SEARCH = "http://pelias/v1/search"
+REVERSE = "http://pelias/v1/reverse"
+
+NOTHING = {"type": "FeatureCollection", "features": []}
+ADDRESS = {
+    "type": "FeatureCollection",
+    "features": [{
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [-122.68, 45.52]},
+        "properties": {"layer": "address", "name": "834 SE Lambert St", "label": "834 SE Lambert St, Portland, OR, USA"},
+    }],
+}
+
+
+@pytest.fixture
+def wrapper(monkeypatch):
+    """ PeliasWrapper w/ a fresh response cache (and nothing else in the way), whose upstream calls are recorded """
+    monkeypatch.setattr(PeliasWrapper, "response_cache", ResponseCache())
+    monkeypatch.setattr(PeliasWrapper, "prefix_cache", PrefixCache(max_entries=0))
+    monkeypatch.setattr(PeliasWrapper, "negative_cache", NegativeCache(max_entries=0))
+    monkeypatch.setattr(PeliasWrapper, "single_flight", SingleFlight(enabled=False))
+    monkeypatch.setattr(PeliasWrapper, "optional_stage_secs", 2.0)
+
+    calls = []
+    answers = {}
+
+    def call(cls, url, query_string, deadline=None):
+        calls.append(url)
+        return answers.get(url, NOTHING)
+
+    monkeypatch.setattr(PeliasWrapper, "call", classmethod(call))
+    return calls, answers
+
+
+def test_backup_service_is_skipped_when_time_is_short(wrapper):
+    calls, answers = wrapper
+    PeliasWrapper.wrapp(AUTO, SEARCH, REVERSE, "text=zzzz", is_rtp=True, deadline=Deadline(1))
+    assert calls == [AUTO]
+
+    calls.clear()
+    PeliasWrapper.wrapp(AUTO, SEARCH, REVERSE, "text=zzzz", is_rtp=True, deadline=Deadline(25))
+    assert calls == [AUTO, SEARCH]
+
+
+def test_wrong_city_requery_is_skipped_when_time_is_short(wrapper, monkeypatch):
+    calls, answers = wrapper
+    answers[AUTO] = ADDRESS
+    monkeypatch.setattr(PeliasWrapper, "is_wrong_city_bug", classmethod(lambda cls, response: True))
+    monkeypatch.setattr("pelias.adapter.control.pelias_json_queries.find_parsed_text", lambda response: {"number": "834", "street": "SE Lambert"})
+
+    PeliasWrapper.wrapp(AUTO, SEARCH, REVERSE, "text=834 SE Lambert, Sherwood", is_rtp=True, deadline=Deadline(1))
+    assert calls == [AUTO]
+
+    calls.clear()
+    PeliasWrapper.wrapp(AUTO, SEARCH, REVERSE, "text=834 SE Lambert, Tigard", is_rtp=True, deadline=Deadline(25))
+    assert calls == [AUTO, AUTO]
+
+
+def test_partial_answers_are_not_cached(wrapper):
+    calls, answers = wrapper
+    PeliasWrapper.wrapp(AUTO, SEARCH, REVERSE, "text=zzzz", is_rtp=True, deadline=Deadline(1))
+    assert len(PeliasWrapper.response_cache) == 0
+
+    # note: ... and the complete answer (with the backup service's say) is
+    PeliasWrapper.wrapp(AUTO, SEARCH, REVERSE, "text=zzzz", is_rtp=True, deadline=Deadline(25))
+    assert len(PeliasWrapper.response_cache) == 1
+
+
+def test_solr_search_fallback_is_skipped_when_time_is_short(monkeypatch):
+    calls = []
+
+    class NoRecords:
+        def num_records(self):
+            return 0
+
+    def call(cls, solr_params, url, deadline=None):
+        calls.append(url)
+        return NoRecords()
+
+    monkeypatch.setattr(PeliasToSolr, "optional_stage_secs", 2.0)
+    monkeypatch.setattr(PeliasToSolr, "call_pelias_parse_results", classmethod(call))
+
+    PeliasToSolr.call_pelias({"q": "zzzz"}, AUTO, SEARCH, deadline=Deadline(1))
+    assert calls == [AUTO]
+
+    calls.clear()
+    PeliasToSolr.call_pelias({"q": "zzzz"}, AUTO, SEARCH, deadline=Deadline(25))
+    assert calls == [AUTO, SEARCH]
+
+
+def test_upstream_timeout_is_capped_by_the_pool_timeout(monkeypatch):
+    timeouts = []
+    monkeypatch.setattr(upstream, "proxy_json", lambda url, qs, timeout=None: timeouts.append(timeout) or NOTHING)
+
+    clock = FakeClock()
+    deadline = Deadline(25, clock=clock)
+    PeliasWrapper.call(AUTO, "text=zoo", deadline)
+    clock.now += 20
+    PeliasWrapper.call(AUTO, "text=zoo", deadline)
+    assert timeouts == [upstream.pool.timeout, 5]
+
+
+def test_expired_deadline_never_calls_upstream(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("upstream was called")
+
+    monkeypatch.setattr(upstream, "proxy_json", fail)
+    monkeypatch.setattr(upstream, "stream_json", fail)
+    monkeypatch.setattr(PeliasToSolr, "solr_to_pelias_param_str", classmethod(lambda cls, solr_params: "text=zoo"))
+    monkeypatch.setattr(PeliasToSolr, "parse_json", classmethod(lambda cls, json, solr_params=None: json))
+
+    clock = FakeClock()
+    deadline = Deadline(1, clock=clock)
+    clock.now += 2
+    ret_val = PeliasWrapper.call(AUTO, "text=zoo", deadline)
+    assert ret_val["geocoding"]["errors"]
+    assert PeliasToSolr.call_pelias_parse_results({"q": "zoo"}, AUTO, deadline) == {}
@@ -0,0 +1,113 @@
+"""Tests for PeliasWrapper.dedup_addresses (grid indexed address dedup)."""
+
+import random
+
+import pytest
+
+from ott.utils import geo_utils
+from ott.utils import string_diff
+
+from pelias.adapter.control.pelias_wrapper import PeliasWrapper
+
+STREETS = ("SE Cesar Chavez", "NW 118th", "SE Lambert", "N Lombard", "SW Broadway", "NE Sandy", "SE Hawthorne", "NE Alberta")
+SUFFIXES = (("Blvd", "Boulevard"), ("Ct", "Court"), ("St", "Street"), ("Ave", "Avenue"))
+
+
+def feature(layer, name, lon, lat):
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [lon, lat]},
+        "properties": {"layer": layer, "name": name, "label": name + ", Portland, OR, USA"},
+    }
+
+
+def synthetic(size, seed):
+    """ size features around Portland: mostly addresses, a third of them near-dupes of another one, plus some venues """
+    rnd = random.Random(seed)
+    ret_val = []
+    while len(ret_val) < size:
+        lon = -122.68 + rnd.uniform(-0.1, 0.1)
+        lat = 45.52 + rnd.uniform(-0.1, 0.1)
+        street = rnd.choice(STREETS)
+        short, long = rnd.choice(SUFFIXES)
+        num = rnd.randint(100, 20000)
+        if rnd.random() < 0.1:
+            ret_val.append(feature("venue", f"{street} Market", lon, lat))
+            continue
+        ret_val.append(feature("address", f"{num} {street} {short}", lon, lat))
+        if rnd.random() < 0.33:
+            ret_val.append(feature("address", f"{num} {street} {long}", lon + rnd.uniform(-0.0004, 0.0004), lat + rnd.uniform(-0.0004, 0.0004)))
+    return ret_val[:size]
+
+
+def quadratic(features):
+    """ reference: the original dedup_addresses, which compares every address to every kept address """
+    if features is None or len(features) < 2:
+        return features
+    filtered = []
+    prev = []
+    for f in features:
+        fprops = f.get("properties")
+        if fprops and fprops.get("layer") in ("address"):
+            do_filter = False
+            for p in prev:
+                if string_diff.compare(fprops.get("name"), p.get("properties").get("name")) > 0.55:
+                    if geo_utils.are_points_nearby(f, p, decimal_diff=0.0007):
+                        do_filter = True
+                        break
+            if not do_filter:
+                prev.append(f)
+                filtered.append(f)
+        else:
+            filtered.append(f)
+    return filtered
+
+
+def names(features):
+    return [f["properties"]["name"] for f in features]
+
+
+def test_nearby_lookalike_is_filtered():
+    features = [
+        feature("address", "1114 SE Cesar Chavez Blvd", -122.62284, 45.51524),
+        feature("venue", "Cesar Chavez Market", -122.62284, 45.51524),
+        feature("address", "1114 SE Cesar Chavez Boulevard", -122.62290, 45.51530),
+    ]
+    assert names(PeliasWrapper.dedup_addresses(features)) == ["1114 SE Cesar Chavez Blvd", "Cesar Chavez Market"]
+
+
+def test_far_apart_or_different_names_are_kept():
+    features = [
+        feature("address", "1505 NW 118th Ct", -122.80000, 45.53000),
+        feature("address", "1505 NW 118th Ct", -122.70000, 45.53000),
+        feature("address", "8 N Lombard Street", -122.80010, 45.53010),
+    ]
+    assert PeliasWrapper.dedup_addresses(features) == features
+
+
+def test_dupes_across_grid_cells():
+    # note: either side of a cell boundary ... still within dedup_distance of each other
+    size = PeliasWrapper.dedup_distance * 2
+    lon = -61000 * size
+    features = [
+        feature("address", "1505 NW 118th Ct", lon - 0.0001, 45.53),
+        feature("address", "1505 NW 118th Court", lon + 0.0001, 45.53),
+    ]
+    assert len(PeliasWrapper.dedup_addresses(features)) == 1
+
+
+def test_features_without_points():
+    features = [
+        {"properties": {"layer": "address", "name": "1505 NW 118th Ct"}},
+        feature("address", "1505 NW 118th Ct", -122.8, 45.53),
+    ]
+    assert PeliasWrapper.dedup_cell(features[0]) is None
+    assert PeliasWrapper.dedup_candidates({}, [(0, features[0])], None) == [features[0]]
+
+
+@pytest.mark.parametrize("size", [10, 100, 300])
+def test_matches_the_quadratic_dedup(size):
+    features = synthetic(size, seed=size)
+    kept = PeliasWrapper.dedup_addresses(features)
+    assert kept == quadratic(features)
+    assert len(kept) < len(features)
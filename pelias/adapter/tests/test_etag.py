@@ -0,0 +1,42 @@
+"""Tests for the geocoder routes' ETag / If-None-Match (304) handling (pelias.adapter.pyramid.views.add_etag_response)."""
+
+from types import SimpleNamespace
+
+from webob import Request, Response
+
+from pelias.adapter.pyramid.views import add_etag_response
+
+BODY = b'{"type": "FeatureCollection", "features": []}'
+
+
+def new_response(route="pelias_services", status=200, content_type="application/json", body=BODY, headers=None):
+    request = Request.blank("/pelias/autocomplete?text=zoo", headers=headers or {})
+    request.matched_route = SimpleNamespace(name=route) if route else None
+    response = Response(body=body, status=status, content_type=content_type)
+    add_etag_response(SimpleNamespace(request=request, response=response))
+    return request, response
+
+
+def test_etag_is_a_hash_of_the_body():
+    request, response = new_response()
+    assert response.etag
+    assert response.etag == new_response()[1].etag
+    assert response.etag != new_response(body=b'{"features": [1]}')[1].etag
+
+
+def test_matching_if_none_match_is_a_304():
+    etag = new_response()[1].etag
+    request, response = new_response(headers={"If-None-Match": '"{}"'.format(etag)})
+    conditional = request.get_response(response)
+    assert conditional.status_code == 304
+    assert conditional.body == b""
+
+    request, response = new_response(headers={"If-None-Match": '"stale"'})
+    assert request.get_response(response).status_code == 200
+
+
+def test_skipped_responses():
+    assert new_response(status=500)[1].etag is None
+    assert new_response(content_type="text/html", body=b"<html/>")[1].etag is None
+    assert new_response(route="pelias_stats")[1].etag is None
+    assert new_response(route=None)[1].etag is None
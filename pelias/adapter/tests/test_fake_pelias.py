@@ -0,0 +1,83 @@
+"""Tests for the fake Pelias server (pelias/adapter/tests/fake_pelias.py)."""
+
+import json
+import random
+import urllib.error
+import urllib.request
+
+import pytest
+
+from pelias.adapter.tests.fake_pelias import FakePelias, fixture_name, latency_model
+
+
+@pytest.fixture
+def fake():
+    ret_val = FakePelias().start()
+    yield ret_val
+    ret_val.stop()
+
+
+def get(url):
+    try:
+        with urllib.request.urlopen(url, timeout=10) as resp:
+            return resp.status, json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_serves_fixtures(fake):
+    status, j = get(fake.url + "/v1/search?text=13135")
+    assert status == 200
+    assert len(j["features"]) == 10
+
+    status, j = get(fake.url + "/pelias/v1/autocomplete?text=hop&size=3")
+    assert status == 200
+    assert len(j["features"]) == 3
+
+    status, j = get(fake.url + "/v1/geocode?text=zoo")
+    assert status == 404
+
+    assert fake.stats() == {"search": 1, "autocomplete": 1, "not_found": 1}
+
+
+def test_recorded_fixture(tmp_path):
+    body = {"type": "FeatureCollection", "features": [{"type": "Feature", "properties": {"name": "Oregon Zoo"}}]}
+    (tmp_path / fixture_name("search", {"text": "Oregon Zoo"})).write_text(json.dumps(body))
+    fake = FakePelias(fixtures=str(tmp_path)).start()
+    try:
+        assert get(fake.url + "/v1/search?text=oregon%20zoo")[1] == body
+        assert len(get(fake.url + "/v1/search?text=pdx")[1]["features"]) == 10
+    finally:
+        fake.stop()
+
+
+def test_errors_and_empty_results():
+    fake = FakePelias(error_rate=0.5, empty_rate=0.5, seed=1).start()
+    try:
+        results = [get(fake.url + "/v1/autocomplete?text=zoo") for _ in range(40)]
+    finally:
+        fake.stop()
+
+    stats = fake.stats()
+    assert sum(1 for status, j in results if status == 500) == stats["errors"] > 0
+    assert sum(1 for status, j in results if status == 200 and not j["features"]) == stats["empty"] > 0
+
+
+def test_latency_models():
+    rng = random.Random(1)
+    assert latency_model("fixed:50", rng)() == 0.05
+    assert all(0.02 <= latency_model("uniform:20:80", rng)() <= 0.08 for _ in range(100))
+    assert all(latency_model("normal:5:50", rng)() >= 0 for _ in range(100))
+
+    slow = [latency_model("bimodal:40:2000:10", rng)() for _ in range(1000)]
+    assert set(slow) == {0.04, 2.0}
+    assert 50 < slow.count(2.0) < 150
+
+    with pytest.raises(ValueError):
+        latency_model("pareto:1", rng)
+
+
+def test_seeded_runs_repeat():
+    a = latency_model("lognormal:50:0.5", random.Random(7))
+    b = latency_model("lognormal:50:0.5", random.Random(7))
+    assert [a() for _ in range(10)] == [b() for _ in range(10)]
@@ -0,0 +1,126 @@
+"""Tests for pelias.adapter.control.fan_out module."""
+
+import threading
+
+import pytest
+
+from pelias.adapter.control.deadline import Deadline
+from pelias.adapter.control.fan_out import FanOut, query_class
+
+
+def has_features(rec):
+    return bool(rec and rec.get("features"))
+
+
+FOUND = {"features": [{"properties": {"name": "x"}}]}
+EMPTY = {"features": []}
+
+
+@pytest.mark.parametrize("text,expected", [
+    ("364", "stop"),
+    ("5", "stop"),
+    ("pd", "short"),
+    ("834 SE Lambert", "address"),
+    ("1931 NE Sandy Blvd", "address"),
+    ("SE Lambert & 9th", "intersection"),
+    ("Burnside and Broadway", "intersection"),
+    ("pdx", "name"),
+    ("Zoo", "name"),
+])
+def test_query_class(text, expected):
+    assert query_class(text) == expected
+
+
+def test_primary_wins_and_backup_is_ignored():
+    fan_out = FanOut(enabled=True)
+    ret_val, alt_resp = fan_out.call("name", lambda: FOUND, lambda: EMPTY, has_features)
+    assert ret_val == FOUND
+    assert alt_resp is None
+    assert fan_out.stats()["wins_by_query_class"]["name"]["primary"] == 1
+
+
+def test_backup_wins():
+    fan_out = FanOut(enabled=True)
+    ret_val, alt_resp = fan_out.call("address", lambda: EMPTY, lambda: FOUND, has_features)
+    assert ret_val == EMPTY
+    assert alt_resp == FOUND
+    assert fan_out.stats()["wins_by_query_class"]["address"]["backup"] == 1
+
+
+def test_calls_run_in_parallel():
+    """ the primary can only finish once the backup has started """
+    fan_out = FanOut(enabled=True)
+    backup_started = threading.Event()
+
+    def primary():
+        assert backup_started.wait(5)
+        return EMPTY
+
+    def backup():
+        backup_started.set()
+        return EMPTY
+
+    fan_out.call("stop", primary, backup, has_features)
+    assert fan_out.stats()["wins_by_query_class"]["stop"]["neither"] == 1
+
+
+def test_failed_backup_counts_as_neither():
+    fan_out = FanOut(enabled=True)
+
+    def backup():
+        raise IOError("503")
+
+    ret_val, alt_resp = fan_out.call("name", lambda: EMPTY, backup, has_features)
+    assert alt_resp is None
+    assert fan_out.stats()["wins_by_query_class"]["name"]["neither"] == 1
+
+
+def test_queued_backup_runs_inline():
+    """ every pool thread is busy, so the backup is still queued when the primary comes back empty """
+    fan_out = FanOut(enabled=True, threads=1)
+    busy, release = threading.Event(), threading.Event()
+
+    def blocker():
+        busy.set()
+        release.wait(5)
+
+    fan_out.call("name", lambda: busy.wait(5) and FOUND, blocker, has_features)  # note: occupies the only pool thread
+
+    backup_thread = []
+
+    def backup():
+        backup_thread.append(threading.current_thread())
+        return FOUND
+
+    try:
+        ret_val, alt_resp = fan_out.call("name", lambda: EMPTY, backup, has_features)
+    finally:
+        release.set()
+    assert alt_resp == FOUND
+    assert backup_thread == [threading.current_thread()]
+    wins = fan_out.stats()["wins_by_query_class"]["name"]
+    assert wins["inline"] == 1
+    assert wins["backup"] == 1
+
+
+def test_wait_on_backup_is_bounded_by_the_deadline():
+    fan_out = FanOut(enabled=True)
+    backup_started, release = threading.Event(), threading.Event()
+
+    def primary():
+        assert backup_started.wait(5)
+        return EMPTY
+
+    def backup():
+        backup_started.set()
+        release.wait(5)
+        return FOUND
+
+    try:
+        ret_val, alt_resp = fan_out.call("address", primary, backup, has_features, Deadline(0.05))
+    finally:
+        release.set()
+    assert alt_resp is None
+    wins = fan_out.stats()["wins_by_query_class"]["address"]
+    assert wins["timeouts"] == 1
+    assert wins["neither"] == 1
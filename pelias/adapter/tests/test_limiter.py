@@ -0,0 +1,144 @@
+"""Tests for pelias.adapter.control.limiter module."""
+
+import threading
+
+import pytest
+
+from pelias.adapter.control.limiter import AdaptiveLimiter
+from pelias.adapter.tests.helpers import FakeClock
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+class TestAdaptiveLimiter:
+    def test_limit_bounds(self):
+        limiter = AdaptiveLimiter(initial=500, min_limit=5, max_limit=100)
+        assert limiter.stats()["limit"] == 100
+        limiter = AdaptiveLimiter(initial=1, min_limit=5, max_limit=100)
+        assert limiter.stats()["limit"] == 5
+
+    def test_sheds_over_the_limit(self, clock):
+        limiter = AdaptiveLimiter(initial=2, min_limit=1, clock=clock)
+        assert limiter.acquire()
+        assert limiter.acquire()
+        assert not limiter.acquire()
+
+        stats = limiter.stats()
+        assert stats["in_flight"] == 2
+        assert stats["admitted"] == 2
+        assert stats["shed"] == 1
+
+        limiter.release(0.1)
+        assert limiter.acquire()
+
+    def test_slow_requests_cut_the_limit(self, clock):
+        limiter = AdaptiveLimiter(initial=100, min_limit=10, latency_target=2.0, backoff=0.9, clock=clock)
+        limiter.acquire()
+        limiter.release(5.0)
+        assert limiter.stats()["limit"] == 90
+
+        # note: one cut per latency_target secs ... a burst of slow requests from the same slowdown is one cut
+        limiter.acquire()
+        limiter.release(5.0)
+        assert limiter.stats()["limit"] == 90
+
+        clock.now += 2.0
+        limiter.acquire()
+        limiter.release(5.0)
+        assert limiter.stats()["limit"] == 81
+        assert limiter.stats()["decreases"] == 2
+
+    def test_errors_cut_the_limit(self, clock):
+        limiter = AdaptiveLimiter(initial=100, min_limit=10, clock=clock)
+        limiter.acquire()
+        limiter.release(0.01, ok=False)
+        assert limiter.stats()["limit"] == 90
+
+    def test_never_below_min(self, clock):
+        limiter = AdaptiveLimiter(initial=10, min_limit=10, clock=clock)
+        limiter.acquire()
+        limiter.release(99.0)
+        assert limiter.stats()["limit"] == 10
+
+    def test_fast_requests_grow_a_busy_limit(self, clock):
+        limiter = AdaptiveLimiter(initial=4, min_limit=1, max_limit=6, clock=clock)
+        for _ in range(100):
+            for _ in range(int(limiter.limit)):
+                limiter.acquire()
+            for _ in range(limiter.in_flight):
+                limiter.release(0.05)
+        assert limiter.stats()["limit"] == 6
+
+    def test_idle_limit_does_not_drift_up(self, clock):
+        limiter = AdaptiveLimiter(initial=50, min_limit=1, max_limit=200, clock=clock)
+        for _ in range(1000):
+            limiter.acquire()
+            limiter.release(0.05)
+        assert limiter.stats()["limit"] == 50
+        assert limiter.stats()["increases"] == 0
+
+    def test_queued_request_gets_the_next_slot(self):
+        limiter = AdaptiveLimiter(initial=1, min_limit=1, queue_size=1, queue_secs=5.0)
+        assert limiter.acquire()
+        admitted = []
+        waiter = threading.Thread(target=lambda: admitted.append(limiter.acquire()))
+        waiter.start()
+        while limiter.stats()["queue_depth"] == 0:
+            pass
+
+        # note: the queue is full, so this one's shed right away
+        assert not limiter.acquire()
+
+        limiter.release(0.01)
+        waiter.join(5)
+        assert admitted == [True]
+        assert limiter.stats()["queued"] == 1
+
+    def test_queued_request_times_out(self):
+        limiter = AdaptiveLimiter(initial=1, min_limit=1, queue_size=5, queue_secs=0.01)
+        assert limiter.acquire()
+        assert not limiter.acquire()
+        assert limiter.stats()["shed"] == 1
+        assert limiter.stats()["queue_depth"] == 0
+
+    def test_call(self, clock):
+        limiter = AdaptiveLimiter(initial=1, min_limit=1, max_limit=1, clock=clock)
+        assert limiter.call(lambda x: x * 2, 21) == (True, 42)
+        assert limiter.stats()["in_flight"] == 0
+
+        limiter.acquire()
+        assert limiter.call(lambda: 42) == (False, None)
+
+    def test_upstream_latency_ignores_request_time(self, clock):
+        limiter = AdaptiveLimiter(initial=100, min_limit=10, upstream_latency=True, clock=clock)
+
+        def slow():
+            clock.now += 5.0
+            return 42
+
+        # note: a slow request (e.g., slow post-processing) w/ no slow upstream call leaves the limit alone
+        assert limiter.call(slow) == (True, 42)
+        assert limiter.stats()["limit"] == 100
+
+        def slow_upstream():
+            limiter.observe(5.0)
+            return 42
+
+        assert limiter.call(slow_upstream) == (True, 42)
+        assert limiter.stats()["limit"] == 90
+        assert limiter.stats()["in_flight"] == 0
+
+    def test_call_releases_on_error(self, clock):
+        limiter = AdaptiveLimiter(initial=20, min_limit=1, clock=clock)
+
+        def boom():
+            raise RuntimeError("boom")
+
+        with pytest.raises(RuntimeError):
+            limiter.call(boom)
+        stats = limiter.stats()
+        assert stats["in_flight"] == 0
+        assert stats["limit"] == 18
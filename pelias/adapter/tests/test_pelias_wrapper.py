@@ -0,0 +1,103 @@
+"""Tests for pelias.adapter.control.pelias_wrapper module (the bits that don't need a Pelias server)."""
+
+import copy
+import glob
+import json
+import os
+
+import pytest
+
+from pelias.adapter.control.pelias_wrapper import PeliasWrapper
+
+AUTO = "http://pelias/v1/autocomplete"
+DATA = os.path.join(os.path.dirname(__file__), "data")
+
+# note: stop and route features (w/ the ids that get rewritten), on top of whatever's in the fixtures
+TRANSIT = [
+    {"type": "Feature", "geometry": {"type": "Point", "coordinates": [-122.6, 45.5]}, "properties": {
+        "layer": "stops", "id": "stops:TRIMET:13135", "name": "TriMet Stop SE Lambert & 9th", "label": "TriMet Stop SE Lambert & 9th, Portland, OR, USA",
+        "locality": "Portland", "neighbourhood": "Sellwood"}},
+    {"type": "Feature", "geometry": {"type": "Point", "coordinates": [-122.5, 45.4]}, "properties": {
+        "layer": "stops", "id": "stops:CTRAN:2170", "name": "Fisher's Landing TC", "label": "Fisher's Landing TC, Vancouver, WA, USA", "locality": "Vancouver"}},
+    {"type": "Feature", "geometry": {"type": "Point", "coordinates": [-122.7, 45.6]}, "properties": {
+        "layer": "routes", "id": "routes:TRIMET:100", "name": "MAX Blue Line", "label": "MAX Blue Line"}},
+    {"type": "Feature", "geometry": {"type": "Point", "coordinates": [-122.7, 45.6]}, "properties": {
+        "layer": "routes", "id": "routes:SMART:1X", "name": "1X Barbur", "label": "1X Barbur"}},
+]
+
+
+def key(query_string):
+    return PeliasWrapper.cache_key(AUTO, query_string, is_rtp=True)
+
+
+def test_cache_key_normalizes_params():
+    assert key("text=834%20SE%20Lambert&size=6") == key("size=6&text=834%20%20SE%20Lambert")
+    assert key("text=834%20SE%20Lambert&_dc=123") == key("text=834%20SE%20Lambert")
+    assert key("text=834%20SE%20Lambert") != key("text=834%20SE%20Lambert&size=6")
+
+
+def test_cache_key_keeps_a_trailing_space_on_text():
+    # note: to Pelias autocomplete, a trailing space means the last token is complete ... a different answer
+    assert key("text=834%20SE%20Lambert") != key("text=834%20SE%20Lambert%20")
+    assert key("text=834%20SE%20Lambert%20") == key("text=834%20SE%20Lambert%20%20%20")
+    assert key("text=834%20SE%20Lambert%20") == key("text=%20834%20SE%20Lambert%20")
+
+
+def fixtures():
+    ret_val = []
+    for path in sorted(glob.glob(os.path.join(DATA, "*.json"))):
+        with open(path) as f:
+            j = json.load(f)
+        if PeliasWrapper.has_features(j):
+            ret_val.append(j)
+    ret_val.append({"type": "FeatureCollection", "features": TRANSIT})
+    return ret_val
+
+
+@pytest.fixture
+def memo():
+    PeliasWrapper.config_label_memo()
+    yield PeliasWrapper.label_memo
+    PeliasWrapper.config_label_memo()
+
+
+@pytest.mark.parametrize("is_calltaker,is_rtp", [(False, False), (True, False), (False, True)])
+def test_memoized_labels_match_feature_label(memo, is_calltaker, is_rtp):
+    for j in fixtures():
+        # note: fixup twice w/ the memo (a miss, then a hit), and once w/out it
+        memoized = [copy.deepcopy(j), copy.deepcopy(j)]
+        for m in memoized:
+            PeliasWrapper.fixup_response(m, size=100, is_calltaker=is_calltaker, is_rtp=is_rtp)
+        PeliasWrapper.config_label_memo(max_entries=0)
+        plain = copy.deepcopy(j)
+        PeliasWrapper.fixup_response(plain, size=100, is_calltaker=is_calltaker, is_rtp=is_rtp)
+        PeliasWrapper.config_label_memo()
+
+        assert memoized[0] == plain
+        assert memoized[1] == plain
+
+    assert memo.cache_info().hits > 0
+
+
+def test_id_rewrites_are_memoized_too(memo):
+    j = {"type": "FeatureCollection", "features": copy.deepcopy(TRANSIT)}
+    PeliasWrapper.fixup_response(j, is_rtp=False)
+    assert j["features"][0]["properties"]["id"] == "13135::TRIMET::stops"
+
+    for _ in range(2):
+        j = {"type": "FeatureCollection", "features": copy.deepcopy(TRANSIT)}
+        PeliasWrapper.fixup_response(j, is_rtp=True)
+        assert j["features"][0]["properties"]["id"] == "TRIMET:13135"
+        assert j["features"][1]["properties"]["id"] == "CTRAN:2170"
+
+
+def test_changed_properties_miss_the_memo(memo):
+    p = TRANSIT[0]["properties"]
+    values = tuple(p.get(n) for n in PeliasWrapper.label_properties)
+    renamed = tuple("Milwaukie" if v == "Portland" else v for v in values)
+
+    first, _ = memo(values, False, False)
+    assert memo(values, False, False)[0] == first
+    assert memo(renamed, False, False)[0] != first
+    assert memo.cache_info().misses == 2
+    assert memo.cache_info().hits == 1
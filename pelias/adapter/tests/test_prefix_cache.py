@@ -0,0 +1,181 @@
+"""Tests for pelias.adapter.control.prefix_cache module."""
+
+import pytest
+
+from pelias.adapter.control.prefix_cache import PrefixCache, NegativeCache, normalize_text, feature_tokens, matches, bbox, empty_response
+
+SCOPE = ("https://ws-st.trimet.org/pelias/v1/autocomplete", False, False, None, (("size", "10"),))
+
+
+def address(number, street, lon=-122.65, lat=45.5):
+    name = f"{number} {street}"
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [lon, lat]},
+        "properties": {
+            "layer": "address",
+            "name": name,
+            "housenumber": number,
+            "street": street,
+            "label": f"{name}, Portland",
+            "locality": "Portland",
+        }
+    }
+
+
+def response(text, *features):
+    return {
+        "geocoding": {"query": {"text": text}},
+        "type": "FeatureCollection",
+        "features": list(features),
+        "bbox": bbox(features),
+    }
+
+
+@pytest.fixture
+def cache():
+    c = PrefixCache()
+    c.put(SCOPE, "834 SE Lamb", response(
+        "834 SE Lamb",
+        address("834", "SE Lambert St", lon=-122.64),
+        address("834", "SE Lamb Ave", lon=-122.60),
+    ))
+    return c
+
+
+@pytest.mark.parametrize("text,expected", [
+    ("834 SE Lamb", "834 se lamb"),
+    ("  834   SE Lamb", "834 se lamb"),
+    ("834 SE Lamb ", "834 se lamb "),
+    ("834 SE Lamb,", "834 se lamb, "),
+    ("", ""),
+    (None, ""),
+])
+def test_normalize_text(text, expected):
+    assert normalize_text(text) == expected
+
+
+def test_feature_tokens():
+    tokens = feature_tokens(address("834", "SE Lambert St"))
+    assert {"834", "se", "lambert", "st", "portland"} <= tokens
+
+
+@pytest.mark.parametrize("text,expected", [
+    ("834 se lamb", True),     # partial last token
+    ("834 se lambert", True),
+    ("834 se lambert ", True),  # trailing space completes the last token
+    ("834 se lamb ", False),    # 'lamb' as a complete token doesn't match 'lambert'
+    ("834 ne lamb", False),
+    ("835 se lamb", False),
+    ("", False),
+])
+def test_matches(text, expected):
+    assert matches(text, feature_tokens(address("834", "SE Lambert St"))) is expected
+
+
+def test_prefix_hit_filters_features(cache):
+    ret_val = cache.get(SCOPE, "834 SE Lambe")
+    assert ret_val is not None
+    assert [f["properties"]["name"] for f in ret_val["features"]] == ["834 SE Lambert St"]
+    assert ret_val["geocoding"]["query"]["text"] == "834 SE Lambe"
+    assert ret_val["bbox"] == [-122.64, 45.5, -122.64, 45.5]
+    assert cache.stats()["hits"] == 1
+
+
+def test_prefix_hit_keeps_all_matches(cache):
+    ret_val = cache.get(SCOPE, "834 SE Lamb ")
+    assert [f["properties"]["name"] for f in ret_val["features"]] == ["834 SE Lamb Ave"]
+
+
+def test_filtered_to_nothing_falls_through(cache):
+    assert cache.get(SCOPE, "834 SE Lambx") is None
+    assert cache.stats()["fallthroughs"] == 1
+
+
+def test_no_cached_prefix_is_a_miss(cache):
+    assert cache.get(SCOPE, "1931 NE Sandy") is None
+    assert cache.get(SCOPE, "834 SE Lamb") is None  # same text isn't a (shorter) prefix
+    assert cache.stats()["misses"] == 2
+
+
+def test_different_scope_is_a_miss(cache):
+    other_scope = SCOPE[:-1] + ((("size", "5"),),)
+    assert cache.get(other_scope, "834 SE Lambe") is None
+
+
+def test_unexplained_features_are_not_stored():
+    """ Pelias matched something our token model can't (e.g., a synonym), so don't trust a filter of it """
+    c = PrefixCache()
+    stored = c.put(SCOPE, "834 Southeast La", response("834 Southeast La", address("834", "SE Lambert St")))
+    assert stored is False
+    assert c.get(SCOPE, "834 Southeast Lam") is None
+    assert c.stats()["rejected"] == 1
+
+
+def test_short_text_not_stored():
+    c = PrefixCache(min_chars=2)
+    assert c.put(SCOPE, "8", response("8", address("8", "SE Lambert St"))) is False
+
+
+def test_hit_is_an_independent_copy(cache):
+    first = cache.get(SCOPE, "834 SE Lambe")
+    first["features"][0]["properties"]["name"] = "changed"
+    second = cache.get(SCOPE, "834 SE Lambe")
+    assert second["features"][0]["properties"]["name"] == "834 SE Lambert St"
+
+
+# ============================================================================
+# NegativeCache tests
+# ============================================================================
+
+NEGATIVE_SCOPE = (("autocomplete_url", "search_url"), True, False, None, (("layers", "address"),))
+
+
+def test_negative_cache_hits_on_extensions():
+    c = NegativeCache()
+    assert c.put(NEGATIVE_SCOPE, "834 XQZ") is True
+    assert c.get(NEGATIVE_SCOPE, "834 XQZ") is True
+    assert c.get(NEGATIVE_SCOPE, "834 xqzv") is True
+    assert c.get(NEGATIVE_SCOPE, "834  XQZV Street") is True
+    assert c.get(NEGATIVE_SCOPE, "834 XQ") is False
+
+
+def test_negative_cache_respects_scope():
+    c = NegativeCache()
+    c.put(NEGATIVE_SCOPE, "834 XQZ")
+    other_scope = NEGATIVE_SCOPE[:-1] + ((("layers", "venue"),),)
+    assert c.get(other_scope, "834 XQZV") is False
+
+
+def test_negative_cache_min_chars():
+    c = NegativeCache(min_chars=3)
+    assert c.put(NEGATIVE_SCOPE, "83") is False
+    assert c.get(NEGATIVE_SCOPE, "834") is False
+
+
+def test_negative_cache_ttl():
+    now = [0.0]
+    c = NegativeCache(ttl=30, clock=lambda: now[0])
+    c.put(NEGATIVE_SCOPE, "834 XQZ")
+    now[0] += 31
+    assert c.get(NEGATIVE_SCOPE, "834 XQZV") is False
+
+
+def test_negative_cache_counts_saved_calls():
+    c = NegativeCache(calls_per_query=2)
+    c.put(NEGATIVE_SCOPE, "834 XQZ")
+    c.get(NEGATIVE_SCOPE, "834 XQZV")
+    c.get(NEGATIVE_SCOPE, "834 XQZVW")
+    c.get(NEGATIVE_SCOPE, "1931 NE Sandy")
+
+    stats = c.stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["upstream_calls_saved"] == 4
+
+
+def test_empty_response():
+    ret_val = empty_response("834 XQZV")
+    assert ret_val["type"] == "FeatureCollection"
+    assert ret_val["features"] == []
+    assert ret_val["geocoding"]["query"]["text"] == "834 XQZV"
@@ -18,6 +18,7 @@ from pelias.adapter.service.refine_service import (
     TRANSIT_LAYERS,
 )
 from pelias.adapter.service.util import EvaluatesAs
+from pelias.adapter.control.deadline import Deadline
 from pelias.adapter.tests.helpers import TestMultiDict
 
 
@@ -243,7 +244,8 @@ def test_get_response_and_features_passes_parameters(mock_get_response, mock_req
     mock_get_response.assert_called_once_with(
         service="autocomplete",
         request=mock_request,
-        is_rtp=True
+        is_rtp=True,
+        deadline=None
     )
 
 
@@ -385,6 +387,24 @@ def test_refine_retries_without_layers_if_no_results(mock_refactor, mock_get_res
     assert mock_get_response.call_count == 2
 
 
+@patch('pelias.adapter.service.refine_service.get_response_and_features')
+@patch('pelias.adapter.service.refine_service.refactor_pelias_request')
+def test_refine_skips_retry_when_deadline_is_near(mock_refactor, mock_get_response):
+    """Test refine doesn't retry without layer filters when the request's deadline is near."""
+    request = DummyRequest()
+    request.GET = TestMultiDict([('text', '123 Main St'), ('size', '10')])
+    request.environ = {'QUERY_STRING': 'text=123+Main+St&size=10'}
+
+    mock_refactor.return_value = request
+    mock_get_response.return_value = ({"features": []}, [])
+
+    deadline = Deadline(1)
+    result = refine(request, "search", False, deadline=deadline)
+
+    assert result["features"] == []
+    mock_get_response.assert_called_once_with(service="search", request=request, is_rtp=False, deadline=deadline)
+
+
 @patch('pelias.adapter.service.refine_service.get_response_and_features')
 @patch('pelias.adapter.service.refine_service.prioritize_stops')
 def test_refine_prioritizes_stops_for_number_query(mock_prioritize, mock_get_response):
@@ -3,6 +3,10 @@
 Comprehensive tests for all utility functions used in Pelias result refinement.
 """
 
+import json
+import os
+import re
+
 import pytest
 
 from pelias.adapter.service.util import (
@@ -79,6 +83,80 @@ def test_normalize_address_handles_all_directions():
     assert "Southwest" in normalize_address("sw main")
 
 
+@pytest.mark.parametrize("addr,expected", [
+    ("st.louis", "Streetlouis"),
+    ("s.e. main st.", "Southe. Main Street"),
+    ("n.n main", "Northnorth Main"),
+    ("1st st..", "1St Street"),
+    ("ave.. main", "Avenue Main"),
+    ("Main\tSt\n", "Main Street"),
+])
+def test_normalize_address_periods(addr, expected):
+    """Test that periods run into more text come out as they did with a re.sub per abbreviation."""
+    assert normalize_address(addr) == expected
+
+
+def original_normalize_address(addr):
+    """Reference: the original normalize_address, a re.sub per pattern (w/ its own tables, not util's)."""
+    if not addr:
+        return ""
+
+    addr = addr.lower().strip()
+    directions = {
+        r"\bn\b": "north",
+        r"\bs\b": "south",
+        r"\be\b": "east",
+        r"\bw\b": "west",
+        r"\bnw\b": "northwest",
+        r"\bne\b": "northeast",
+        r"\bsw\b": "southwest",
+        r"\bse\b": "southeast",
+    }
+    streets = {
+        r"\bst\b": "street",
+        r"\bstreet\b": "street",
+        r"\bave\b": "avenue",
+        r"\bav\b": "avenue",
+        r"\baven\b": "avenue",
+        r"\bavenue\b": "avenue",
+        r"\bblvd\b": "boulevard",
+        r"\brd\b": "road",
+        r"\bdr\b": "drive",
+        r"\bln\b": "lane",
+        r"\bct\b": "court",
+        r"\bcir\b": "circle",
+        r"\bhwy\b": "highway",
+        r"\bpl\b": "place",
+        r"\bter\b": "terrace",
+        r"\bpkwy\b": "parkway",
+    }
+    for pattern, repl in {**directions, **streets}.items():
+        addr = re.sub(pattern + r"\.?", repl, addr)
+    return re.sub(r"\s+", " ", addr).strip().title()
+
+
+def util_data_addresses():
+    """The query texts and feature labels in test_util_data.json."""
+    ret_val = []
+    with open(os.path.join(os.path.dirname(__file__), "data", "test_util_data.json")) as f:
+        data = json.load(f)
+    for text, response in data.items():
+        ret_val.append(text)
+        for feature in response.get("features", []):
+            label = feature.get("properties", {}).get("label")
+            if label:
+                ret_val.append(label.lower().strip())
+    return ret_val
+
+
+def test_normalize_address_matches_test_util_data():
+    """Test the one pass normalizer against the original re.sub per pattern, on the labels in test_util_data.json."""
+    addresses = util_data_addresses()
+    assert len(addresses) > 50
+    for addr in addresses:
+        assert normalize_address(addr) == original_normalize_address(addr)
+
+
 def test_normalize_address_handles_all_street_types():
     """Test that common street type abbreviations are expanded."""
     assert "Street" in normalize_address("main st")
@@ -0,0 +1,69 @@
+"""Tests for pelias.adapter.pyramid.renderers module."""
+
+import glob
+import json
+import os
+
+import pytest
+
+from pelias.adapter.pyramid import renderers
+from pelias.adapter.pyramid.renderers import fast_dumps, json_renderer
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def fixtures():
+    ret_val = []
+    for f in sorted(glob.glob(os.path.join(DATA, '*.json'))):
+        with open(f) as fp:
+            ret_val.append(json.load(fp))
+    return ret_val
+
+
+def render(renderer, value):
+    return renderer(None)(value, {'request': None})
+
+
+@pytest.mark.skipif(renderers.orjson is None, reason="orjson isn't installed")
+class TestFastDumps:
+    @pytest.mark.parametrize("value", fixtures())
+    def test_same_structure_as_stdlib(self, value):
+        body = fast_dumps(value)
+        assert isinstance(body, bytes)
+        assert json.loads(body) == value
+        assert list(json.loads(body)) == list(value)
+
+    def test_non_str_keys(self):
+        assert json.loads(fast_dumps({1: 'a', None: 'b'})) == json.loads(json.dumps({1: 'a', None: 'b'}))
+
+    def test_big_ints_fall_back_to_stdlib(self):
+        assert fast_dumps({'n': 2 ** 70}) == json.dumps({'n': 2 ** 70})
+
+    def test_dict_subclasses(self):
+        class Stale(dict):
+            pass
+        assert json.loads(fast_dumps(Stale(features=[]))) == {'features': []}
+
+    def test_default(self):
+        class Dao(object):
+            def __json__(self, request):
+                return {'id': 1}
+
+        body = render(json_renderer(), {'dao': Dao()})
+        assert json.loads(body) == {'dao': {'id': 1}}
+
+
+class TestJsonRenderer:
+    @pytest.mark.parametrize("fast", [True, False])
+    def test_renders_the_fixtures(self, fast):
+        for value in fixtures():
+            assert json.loads(render(json_renderer(fast), value)) == value
+
+    def test_stdlib_fallback(self, monkeypatch):
+        monkeypatch.setattr(renderers, "orjson", None)
+        body = render(json_renderer(), {'features': []})
+        assert body == json.dumps({'features': []})
+
+    def test_unserializable(self):
+        with pytest.raises(TypeError):
+            render(json_renderer(), {'x': object()})
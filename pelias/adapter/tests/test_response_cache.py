@@ -0,0 +1,221 @@
+"""Tests for pelias.adapter.control.response_cache module."""
+
+import threading
+
+import pytest
+
+from pelias.adapter.control.response_cache import ResponseCache, StaleResponse
+from pelias.adapter.tests.helpers import FakeClock
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def feature_collection(name):
+    return {"type": "FeatureCollection", "features": [{"properties": {"name": name}}]}
+
+
+def test_get_miss_then_hit(clock):
+    cache = ResponseCache(clock=clock)
+    assert cache.get("k") is None
+    cache.put("k", feature_collection("a"))
+    assert cache.get("k") == feature_collection("a")
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["entries"] == 1
+
+
+def test_get_returns_independent_copies(clock):
+    """Callers mutate the response, which must not leak back into the cache."""
+    cache = ResponseCache(clock=clock)
+    cache.put("k", feature_collection("a"))
+
+    first = cache.get("k")
+    first["features"][0]["properties"]["name"] = "changed"
+    first["hostname"] = "xyz"
+
+    assert cache.get("k") == feature_collection("a")
+
+
+def test_ttl_expiration(clock):
+    cache = ResponseCache(ttl=10, clock=clock)
+    cache.put("k", feature_collection("a"))
+
+    clock.now += 9
+    assert cache.get("k") is not None
+    clock.now += 2
+    assert cache.get("k") is None
+    assert cache.stats()["expirations"] == 1
+    assert len(cache) == 0
+
+
+def test_per_entry_ttl(clock):
+    cache = ResponseCache(ttl=10, clock=clock)
+    cache.put("short", feature_collection("a"), ttl=1)
+    cache.put("long", feature_collection("b"))
+
+    clock.now += 5
+    assert cache.get("short") is None
+    assert cache.get("long") is not None
+
+
+def test_lru_eviction_by_entry_count(clock):
+    cache = ResponseCache(max_entries=2, clock=clock)
+    cache.put("a", feature_collection("a"))
+    cache.put("b", feature_collection("b"))
+    cache.get("a")  # touch 'a', so 'b' becomes least recently used
+    cache.put("c", feature_collection("c"))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_eviction_by_memory_cap(clock):
+    value = feature_collection("x" * 100)
+    cache = ResponseCache(max_bytes=300, clock=clock)
+    for k in range(5):
+        cache.put(k, value)
+
+    stats = cache.stats()
+    assert stats["bytes"] <= 300
+    assert stats["entries"] < 5
+    assert stats["evictions"] == 5 - stats["entries"]
+
+
+def test_oversized_value_not_cached(clock):
+    cache = ResponseCache(max_bytes=10, clock=clock)
+    assert cache.put("k", feature_collection("too big")) is False
+    assert len(cache) == 0
+
+
+def test_replace_existing_key_keeps_byte_count(clock):
+    cache = ResponseCache(clock=clock)
+    cache.put("k", feature_collection("a"))
+    size = cache.stats()["bytes"]
+    cache.put("k", feature_collection("a"))
+    assert cache.stats()["bytes"] == size
+    assert len(cache) == 1
+
+
+def test_disabled_cache(clock):
+    cache = ResponseCache(max_entries=0, clock=clock)
+    assert not cache.enabled
+    assert cache.put("k", feature_collection("a")) is False
+    assert cache.get("k") is None
+
+
+def test_unserializable_value_not_cached(clock):
+    cache = ResponseCache(clock=clock)
+    assert cache.put("k", {"bad": object()}) is False
+    assert cache.get("k") is None
+
+
+# ============================================================================
+# soft / hard TTL (stale-while-revalidate) tests
+# ============================================================================
+
+def test_fresh_entries_are_not_stale(clock):
+    cache = ResponseCache(ttl=10, stale_ttl=100, clock=clock)
+    cache.put("k", feature_collection("a"))
+    assert not isinstance(cache.get("k"), StaleResponse)
+
+
+def test_stale_between_soft_and_hard_ttl(clock):
+    cache = ResponseCache(ttl=10, stale_ttl=100, clock=clock)
+    cache.put("k", feature_collection("a"))
+
+    clock.now += 50
+    ret_val = cache.get("k")
+    assert isinstance(ret_val, StaleResponse)
+    assert ret_val == feature_collection("a")
+    assert cache.stats()["stale_hits"] == 1
+
+    clock.now += 61
+    assert cache.get("k") is None
+
+
+def test_no_stale_ttl_means_never_stale(clock):
+    cache = ResponseCache(ttl=10, clock=clock)
+    cache.put("k", feature_collection("a"))
+    clock.now += 11
+    assert cache.get("k") is None
+
+
+def test_expiring_is_a_peek(clock):
+    cache = ResponseCache(ttl=60, stale_ttl=60, clock=clock)
+    assert cache.expiring("k")
+    cache.put("k", feature_collection("a"))
+    assert not cache.expiring("k")
+    assert cache.expiring("k", within=61)
+
+    clock.now += 61
+    assert cache.expiring("k")
+    stats = cache.stats()
+    assert stats["hits"] == 0
+    assert stats["misses"] == 0
+
+
+def test_put_refreshes_a_stale_entry(clock):
+    cache = ResponseCache(ttl=10, stale_ttl=100, clock=clock)
+    cache.put("k", feature_collection("a"))
+    clock.now += 50
+    cache.put("k", feature_collection("b"))
+    ret_val = cache.get("k")
+    assert not isinstance(ret_val, StaleResponse)
+    assert ret_val == feature_collection("b")
+
+
+def test_background_refresh(clock):
+    cache = ResponseCache(ttl=10, stale_ttl=100, clock=clock)
+    done = threading.Event()
+
+    def refresh(key, name):
+        cache.put(key, feature_collection(name))
+        done.set()
+
+    assert cache.refresh("k", refresh, "k", "b") is True
+    assert done.wait(5)
+    assert cache.get("k") == feature_collection("b")
+
+
+def test_one_refresh_per_key_in_flight(clock):
+    cache = ResponseCache(ttl=10, stale_ttl=100, clock=clock)
+    release = threading.Event()
+
+    assert cache.refresh("k", release.wait, 5) is True
+    assert cache.refresh("k", release.wait, 5) is False
+    assert cache.stats()["refreshing"] == 1
+    release.set()
+
+
+def test_failed_refresh_keeps_stale_entry(clock):
+    cache = ResponseCache(ttl=10, stale_ttl=100, clock=clock)
+    cache.put("k", feature_collection("a"))
+    clock.now += 50
+    done = threading.Event()
+
+    def pelias_is_down():
+        done.set()
+        raise IOError("503 Service Unavailable")
+
+    cache.refresh("k", pelias_is_down)
+    assert done.wait(5)
+    assert isinstance(cache.get("k"), StaleResponse)
+
+
+def test_allow_expired_serves_past_the_hard_ttl(clock):
+    """ e.g., Pelias is down (circuit breaker open) ... an old answer beats an error """
+    cache = ResponseCache(ttl=10, stale_ttl=10, clock=clock)
+    cache.put("k", feature_collection("a"))
+    clock.now += 100
+
+    ret_val = cache.get("k", allow_expired=True)
+    assert isinstance(ret_val, StaleResponse)
+    assert ret_val == feature_collection("a")
+    assert cache.get("k") is None
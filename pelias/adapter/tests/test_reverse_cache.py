@@ -0,0 +1,88 @@
+"""Tests for pelias.adapter.control.reverse_cache module."""
+
+import pytest
+
+from pelias.adapter.control.reverse_cache import ReverseCache, geohash, distance_km, redistance_features
+
+SCOPE = ("https://ws-st.trimet.org/pelias/v1/reverse", True, False, None, (("layers", "address"),))
+
+
+def feature(name, lon, lat, layer="address"):
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [lon, lat]},
+        "properties": {"name": name, "layer": layer, "distance": 0.0},
+    }
+
+
+def reverse_response(lat, lon):
+    return {
+        "geocoding": {"query": {"point.lat": lat, "point.lon": lon}},
+        "type": "FeatureCollection",
+        "features": [
+            feature("west", -122.6520, 45.5150),
+            feature("east", -122.6480, 45.5150),
+        ],
+    }
+
+
+@pytest.mark.parametrize("lat,lon,precision,expected", [
+    (57.64911, 10.40744, 11, "u4pruydqqvj"),
+    (45.5151, -122.6485, 6, "c20fcj"),
+    (0.0, 0.0, 1, "s"),
+])
+def test_geohash(lat, lon, precision, expected):
+    assert geohash(lat, lon, precision) == expected
+
+
+def test_nearby_points_share_a_cell():
+    assert geohash(45.514234, -122.709752, 8) == geohash(45.514235, -122.709751, 8)
+    assert geohash(45.514234, -122.709752, 8) != geohash(45.524234, -122.709752, 8)
+
+
+def test_distance_km():
+    # one degree of latitude is ~111km
+    assert distance_km(45.0, -122.0, 46.0, -122.0) == pytest.approx(111.19, rel=0.001)
+    assert distance_km(45.5, -122.6, 45.5, -122.6) == 0.0
+
+
+def test_redistance_features_sorts_nearest_first():
+    features = [feature("west", -122.6520, 45.5150), feature("east", -122.6480, 45.5150)]
+    ret_val = redistance_features(features, 45.5150, -122.6485)
+    assert [f["properties"]["name"] for f in ret_val] == ["east", "west"]
+    assert ret_val[0]["properties"]["distance"] < ret_val[1]["properties"]["distance"]
+
+
+def test_hit_is_resorted_relative_to_requested_point():
+    cache = ReverseCache(precision=6)
+    cache.put(SCOPE, 45.5151, -122.6505, reverse_response(45.5151, -122.6505))
+
+    ret_val = cache.get(SCOPE, 45.5151, -122.6485)
+    assert ret_val is not None
+    assert [f["properties"]["name"] for f in ret_val["features"]] == ["east", "west"]
+    assert ret_val["geocoding"]["query"]["point.lat"] == 45.5151
+    assert ret_val["geocoding"]["query"]["point.lon"] == -122.6485
+
+
+def test_different_cell_or_scope_is_a_miss():
+    cache = ReverseCache(precision=8)
+    cache.put(SCOPE, 45.5150, -122.6500, reverse_response(45.5150, -122.6500))
+
+    assert cache.get(SCOPE, 45.5250, -122.6500) is None
+    assert cache.get(SCOPE[:-1] + ((("layers", "venue"),),), 45.5150, -122.6500) is None
+
+
+def test_hit_rate_by_precision():
+    cache = ReverseCache(precision=9, shadow_precisions=(6, 9))
+    cache.get(SCOPE, 45.51500, -122.65000)
+    cache.get(SCOPE, 45.51510, -122.65010)  # ~14m away ... same 6 char cell, different 9 char cell
+
+    stats = cache.stats()
+    assert stats["misses"] == 2
+    assert stats["hit_rate_by_precision"][6] == 0.5
+    assert stats["hit_rate_by_precision"][9] == 0.0
+
+
+def test_disabled():
+    cache = ReverseCache(precision=0)
+    assert not cache.enabled
@@ -0,0 +1,140 @@
+"""Tests for the RouteStopRecords cache in pelias.adapter.model.solr.solr_response (no route stop service needed)."""
+
+import os
+import threading
+import time
+
+import pytest
+
+from pelias.adapter.model.solr import solr_response
+from pelias.adapter.model.solr.solr_response import RouteStopRecords, Response
+from pelias.adapter.tests.helpers import FakeResponse
+
+ROUTES = "37:37:Lake Grove:;78:78:Denney/Kerr Pkwy:snow"
+STOPS_TXT = "stop_id,stop_name,location_type\n4,SE Division & 60th,0\n5,SE Division & 62nd,\n6,Gateway TC,1\n"
+DATA = os.path.join(os.path.dirname(__file__), "data")
+
+
+@pytest.fixture
+def route_stops(monkeypatch):
+    """ route stop service stand-in, that records the urls it was asked for """
+    urls = []
+    fetched = threading.Event()
+
+    def get(url, timeout=None):
+        urls.append(url)
+        if url.endswith("/routes/str"):
+            fetched.set()
+            if "/stops/C" in url:
+                return FakeResponse(status_code=404)
+            return FakeResponse(text=ROUTES)
+        return FakeResponse(text=STOPS_TXT)
+
+    monkeypatch.setattr(solr_response.upstream, "get", get)
+    RouteStopRecords.config(url="http://localhost/ti/index/stops")
+    return urls, fetched
+
+
+def stop_feature(stop_id):
+    return {
+        "geometry": {"coordinates": [-122.6, 45.5]},
+        "properties": {"layer": "trimet:stops", "name": "stop", "addendum": {"gtfs": {"stop_id": stop_id}}},
+    }
+
+
+def test_miss_is_fetched_in_the_background(route_stops):
+    urls, fetched = route_stops
+    assert RouteStopRecords.find_record("4") is None
+    assert fetched.wait(5)
+    assert urls == ["http://localhost/ti/index/stops/4/routes/str"]
+
+
+def wait_for_refreshes():
+    cache = RouteStopRecords.cache
+    for _ in range(500):
+        if not cache._refreshing:
+            return
+        time.sleep(0.01)
+
+
+def test_failed_fetch_is_cached_until_the_negative_ttl(route_stops):
+    urls, fetched = route_stops
+    now = [1000.0]
+    RouteStopRecords.cache.clock = lambda: now[0]
+
+    assert RouteStopRecords.find_record("C123") is None
+    assert fetched.wait(5)
+    wait_for_refreshes()
+    assert RouteStopRecords.find_record("C123") is None
+    assert urls == ["http://localhost/ti/index/stops/C123/routes/str"]
+
+    now[0] += RouteStopRecords.negative_ttl + 1
+    assert RouteStopRecords.find_record("C123") is None
+    wait_for_refreshes()
+    assert len(urls) == 2
+
+
+def test_stale_hit_is_served_and_refreshed(route_stops):
+    urls, fetched = route_stops
+    now = [1000.0]
+    RouteStopRecords.cache.clock = lambda: now[0]
+    RouteStopRecords.put("4", ROUTES)
+
+    now[0] += RouteStopRecords.cache.ttl + 1
+    assert RouteStopRecords.find_record("4") == ROUTES
+    assert fetched.wait(5)
+
+
+def test_hit_makes_no_http_call(route_stops):
+    urls, fetched = route_stops
+    RouteStopRecords.put("4", ROUTES)
+    assert RouteStopRecords.find_record("4") == ROUTES
+    assert urls == []
+
+
+def test_preload_fetches_each_uncached_stop(route_stops):
+    urls, fetched = route_stops
+    RouteStopRecords.cache.clock = lambda: 1000.0
+    RouteStopRecords.stops_file = "http://localhost/gtfs/stops.txt"
+    RouteStopRecords.put("4", ROUTES)
+    sleeps = []
+    assert RouteStopRecords.preload(sleep=sleeps.append) == 1
+    assert urls == ["http://localhost/gtfs/stops.txt", "http://localhost/ti/index/stops/5/routes/str"]
+    assert sleeps == [1.0 / RouteStopRecords.preload_per_sec]
+
+
+def test_preload_refetches_stops_about_to_go_stale(route_stops):
+    urls, fetched = route_stops
+    now = [1000.0]
+    RouteStopRecords.cache.clock = lambda: now[0]
+    RouteStopRecords.stops_file = "http://localhost/gtfs/stops.txt"
+    RouteStopRecords.put("4", ROUTES)
+    RouteStopRecords.put("5", ROUTES)
+    assert RouteStopRecords.preload(sleep=lambda secs: None) == 0
+
+    # note: both go stale before the next preload ... and the peeks don't count as cache hits or misses
+    now[0] += RouteStopRecords.cache.ttl - RouteStopRecords.refresh_secs + 1
+    assert RouteStopRecords.preload(sleep=lambda secs: None) == 2
+    stats = RouteStopRecords.stats()
+    assert stats["hits"] == 0
+    assert stats["misses"] == 0
+
+
+def test_preload_off_without_a_stops_file(route_stops):
+    urls, fetched = route_stops
+    assert RouteStopRecords.preload() == 0
+    assert urls == []
+
+
+def test_stop_ids():
+    assert RouteStopRecords.stop_ids(STOPS_TXT) == ["4", "5"]
+    with open(os.path.join(DATA, "stops.csv")) as f:
+        ids = RouteStopRecords.stop_ids(f.read())
+    assert ids[:3] == ["364", "3326", "9257"]
+
+
+def test_parse_pelias_adds_cached_routes(route_stops):
+    RouteStopRecords.put("4", ROUTES)
+    response = Response()
+    response.parse_pelias({"features": [stop_feature("4")]}, add_routes=True)
+    assert response.docs[0].routes == ROUTES
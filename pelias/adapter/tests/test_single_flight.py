@@ -0,0 +1,140 @@
+"""Tests for pelias.adapter.control.single_flight module."""
+
+import threading
+
+import pytest
+
+from pelias.adapter.control.single_flight import SingleFlight
+
+
+def run_concurrently(num, func):
+    results = [None] * num
+    errors = [None] * num
+
+    def target(i):
+        try:
+            results[i] = func()
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(num)]
+    for t in threads:
+        t.start()
+    return threads, results, errors
+
+
+class TestSingleFlight:
+    def test_single_call(self):
+        sf = SingleFlight()
+        assert sf.do("k", lambda: {"features": []}) == {"features": []}
+        stats = sf.stats()
+        assert stats["leaders"] == 1
+        assert stats["coalesced"] == 0
+        assert stats["in_flight"] == 0
+
+    def test_concurrent_identical_calls_share_one_upstream_call(self):
+        sf = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def upstream():
+            calls.append(1)
+            release.wait(5)
+            return {"features": [{"properties": {"name": "zoo"}}]}
+
+        threads, results, errors = run_concurrently(5, lambda: sf.do("zoo", upstream))
+        while sf.stats()["leaders"] + sf.stats()["coalesced"] < 5:
+            pass
+        release.set()
+        for t in threads:
+            t.join(5)
+
+        assert len(calls) == 1
+        assert errors == [None] * 5
+        assert all(r == {"features": [{"properties": {"name": "zoo"}}]} for r in results)
+        assert sf.stats()["coalesced"] == 4
+        assert sf.stats()["coalesced_rate"] == 0.8
+
+    def test_each_caller_gets_an_independent_copy(self):
+        sf = SingleFlight()
+        release = threading.Event()
+
+        def upstream():
+            release.wait(5)
+            return {"features": [{"properties": {"name": "zoo"}}]}
+
+        def caller():
+            ret_val = sf.do("zoo", upstream)
+            ret_val["features"][0]["properties"]["name"] += " (mine)"
+            return ret_val
+
+        threads, results, errors = run_concurrently(3, caller)
+        while sf.stats()["leaders"] + sf.stats()["coalesced"] < 3:
+            pass
+        release.set()
+        for t in threads:
+            t.join(5)
+
+        assert [r["features"][0]["properties"]["name"] for r in results] == ["zoo (mine)"] * 3
+        assert len(set(id(r) for r in results)) == 3
+
+    def test_different_keys_do_not_coalesce(self):
+        sf = SingleFlight()
+        assert sf.do("a", lambda: 1) == 1
+        assert sf.do("b", lambda: 2) == 2
+        assert sf.stats()["coalesced"] == 0
+
+    def test_leader_error_is_shared(self):
+        sf = SingleFlight()
+        release = threading.Event()
+
+        def upstream():
+            release.wait(5)
+            raise ValueError("pelias down")
+
+        threads, results, errors = run_concurrently(3, lambda: sf.do("k", upstream))
+        while sf.stats()["leaders"] + sf.stats()["coalesced"] < 3:
+            pass
+        release.set()
+        for t in threads:
+            t.join(5)
+
+        assert all(isinstance(e, ValueError) for e in errors)
+        assert sf.stats()["in_flight"] == 0
+
+    def test_waiter_makes_its_own_call_after_wait_secs(self):
+        sf = SingleFlight()
+        release = threading.Event()
+        leader = threading.Thread(target=sf.do, args=("k", lambda: release.wait(5) and "slow"))
+        leader.start()
+        while sf.stats()["in_flight"] == 0:
+            pass
+
+        assert sf.do("k", lambda: "own", wait_secs=0.01) == "own"
+        assert sf.stats()["wait_timeouts"] == 1
+        release.set()
+        leader.join(5)
+
+    def test_non_json_results_are_deep_copied(self):
+        sf = SingleFlight()
+        release = threading.Event()
+        threads, results, errors = run_concurrently(2, lambda: sf.do("k", lambda: release.wait(5) and {"s": {1, 2}}))
+        while sf.stats()["leaders"] + sf.stats()["coalesced"] < 2:
+            pass
+        release.set()
+        for t in threads:
+            t.join(5)
+
+        assert results[0] == results[1] == {"s": {1, 2}}
+        assert results[0]["s"] is not results[1]["s"]
+
+    def test_unjoined_flight_is_not_snapshot(self):
+        class NoCopies:
+            """ not json, and blows up if deep copied ... so any snapshot would fail """
+            def __deepcopy__(self, memo):
+                raise AssertionError("snapshot taken")
+
+        sf = SingleFlight()
+        result = NoCopies()
+        assert sf.do("k", lambda: result) is result
+        assert sf.stats()["in_flight"] == 0
@@ -0,0 +1,296 @@
+"""Tests for pelias.adapter.control.upstream module (no network needed)."""
+
+import socket
+import threading
+
+import pytest
+
+from pelias.adapter.control.backends import BackendPool
+from pelias.adapter.control.upstream import CircuitBreaker, CircuitOpen, DnsCache, Hedging, UpstreamPool, observed
+from pelias.adapter.tests.helpers import FakeClock, FakeResponse
+
+
+class FakeResolver:
+    def __init__(self):
+        self.calls = 0
+        self.fail = False
+
+    def __call__(self, host, port, *args, **kwargs):
+        self.calls += 1
+        if self.fail:
+            raise socket.gaierror("dns is down")
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('10.0.0.{}'.format(self.calls), port))]
+
+
+def test_dns_cache_hits_until_ttl():
+    clock, resolver = FakeClock(), FakeResolver()
+    dns = DnsCache(ttl=60, getaddrinfo=resolver, clock=clock)
+    first = dns("ws.trimet.org", 443)
+    assert dns("ws.trimet.org", 443) == first
+    assert resolver.calls == 1
+
+    clock.now += 61
+    assert dns("ws.trimet.org", 443) != first
+    assert resolver.calls == 2
+    assert dns.stats()["hits"] == 1
+
+
+def test_dns_cache_serves_last_answer_when_dns_fails():
+    clock, resolver = FakeClock(), FakeResolver()
+    dns = DnsCache(ttl=60, getaddrinfo=resolver, clock=clock)
+    first = dns("ws.trimet.org", 443)
+
+    resolver.fail = True
+    clock.now += 61
+    assert dns("ws.trimet.org", 443) == first
+    with pytest.raises(socket.gaierror):
+        dns("maps.trimet.org", 80)
+
+
+def test_dns_cache_passes_other_hosts_thru():
+    clock, resolver = FakeClock(), FakeResolver()
+    dns = DnsCache(ttl=60, hosts={"ws.trimet.org"}, getaddrinfo=resolver, clock=clock)
+    dns("ws.trimet.org", 443)
+    dns("ws.trimet.org", 443)
+    assert dns("example.com", 443) != dns("example.com", 443)
+    assert resolver.calls == 3
+    assert dns.stats()["entries"] == 1
+
+
+@pytest.mark.parametrize("url,expected", [
+    ("https://ws.trimet.org/pelias/v1/search?text=5", "ws.trimet.org:443"),
+    ("http://maps.trimet.org/ti/index/stops", "maps.trimet.org:80"),
+    ("http://localhost:4000/v1/reverse", "localhost:4000"),
+])
+def test_host_name(url, expected):
+    assert UpstreamPool.host_name(url) == expected
+
+
+def test_stats_before_any_calls():
+    stats = UpstreamPool(pool_size=200).stats()
+    assert stats["pool_size"] == 200
+    assert stats["calls"] == 0
+    assert stats["hosts"] == {}
+
+
+# ============================================================================
+# hedging tests
+# ============================================================================
+
+def warmed_up_hedging(budget_pct=100):
+    """ hedging with a ~10ms p50 for 'pelias:443' """
+    hedging = Hedging(percentile=50, budget_pct=budget_pct, min_samples=10)
+    for i in range(20):
+        hedging.record("pelias:443", 0.01)
+    return hedging
+
+
+def test_no_hedging_until_enough_samples():
+    hedging = Hedging(percentile=95, budget_pct=5, min_samples=10)
+    assert hedging.delay("pelias:443") is None
+    assert hedging.call("pelias:443", lambda timeout: "ok") == "ok"
+    assert hedging.stats()["hedges"] == 0
+
+
+def test_slow_call_is_hedged_and_the_hedge_wins():
+    hedging = warmed_up_hedging()
+    release = threading.Event()
+    calls = []
+
+    def func(timeout):
+        calls.append(1)
+        if len(calls) == 1:
+            release.wait(5)  # the first (slow shard) call
+            return "slow"
+        return "fast"
+
+    assert hedging.call("pelias:443", func) == "fast"
+    release.set()
+    stats = hedging.stats()
+    assert stats["hedges"] == 1
+    assert stats["hedge_wins"] == 1
+
+
+def test_fast_call_is_not_hedged():
+    hedging = warmed_up_hedging()
+    assert hedging.call("pelias:443", lambda timeout: "ok") == "ok"
+    assert hedging.stats()["hedges"] == 0
+
+
+def test_budget_caps_hedges():
+    hedging = warmed_up_hedging(budget_pct=1)
+
+    def slow(timeout):
+        threading.Event().wait(0.05)
+        return "ok"
+
+    for i in range(10):
+        hedging.call("pelias:443", slow)
+    stats = hedging.stats()
+    assert stats["hedges"] <= 1
+    assert stats["budget_denied"] >= 9
+
+
+def test_unused_budget_does_not_pile_up():
+    clock = FakeClock()
+    hedging = Hedging(percentile=50, budget_pct=10, budget_secs=10, clock=clock)
+
+    # note: a calm spell of 1000 unhedged calls ... then a slowdown, 10 secs later
+    hedging._recent_calls.extend([clock.now] * 1000)
+    clock.now += 11
+    hedging._recent_calls.extend([clock.now] * 10)
+    assert hedging.allow()
+    assert not hedging.allow()
+
+
+def test_hedge_gets_what_is_left_of_the_timeout():
+    hedging = warmed_up_hedging()
+    release = threading.Event()
+    timeouts = []
+
+    def func(timeout):
+        timeouts.append(timeout)
+        if len(timeouts) == 1:
+            release.wait(5)
+            return "slow"
+        return "fast"
+
+    assert hedging.call("pelias:443", func, timeout=2.0) == "fast"
+    release.set()
+    assert timeouts[0] == 2.0
+    assert 0 < timeouts[1] < 2.0
+
+
+def test_no_hedge_once_the_timeout_is_used_up():
+    hedging = warmed_up_hedging()
+
+    def func(timeout):
+        threading.Event().wait(0.05)
+        return "ok"
+
+    assert hedging.call("pelias:443", func, timeout=0.01) == "ok"
+    assert hedging.stats()["hedges"] == 0
+
+
+# ============================================================================
+# circuit breaker tests
+# ============================================================================
+
+def test_breaker_opens_after_straight_failures():
+    clock = FakeClock()
+    breaker = CircuitBreaker("pelias", failure_threshold=3, reset_secs=30, clock=clock)
+    breaker.failure()
+    breaker.failure()
+    breaker.success()  # resets the count
+    breaker.failure()
+    breaker.failure()
+    assert breaker.allow()
+
+    breaker.failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.is_open()
+    assert not breaker.allow()
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_breaker_half_open_probe():
+    clock = FakeClock()
+    breaker = CircuitBreaker("pelias", failure_threshold=1, reset_secs=30, clock=clock)
+    breaker.failure()
+
+    clock.now += 31
+    assert breaker.allow()      # the probe
+    assert not breaker.allow()  # only one probe at a time
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    breaker.failure()           # probe failed ... back to open
+    assert breaker.is_open()
+
+    clock.now += 31
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats()["transitions"] == {"closed->open": 1, "open->half_open": 2, "half_open->open": 1, "half_open->closed": 1}
+
+
+def test_breaker_per_configured_url():
+    pool = UpstreamPool(breaker_failures=1)
+    pool.add_breaker("http://maps.trimet.org/ti/index/stops")
+    pool.add_breaker("https://ws.trimet.org/pelias/v1/search")
+    assert pool.breaker("http://maps.trimet.org/ti/index/stops/4/routes/str").name == "http://maps.trimet.org/ti/index/stops"
+    assert pool.breaker("https://ws.trimet.org/pelias/v1/reverse?point.lat=45") is None
+
+
+def test_open_breaker_fails_fast():
+    pool = UpstreamPool(breaker_failures=1)
+    pool.add_breaker("http://localhost:1/v1/search")
+    pool.breaker("http://localhost:1/v1/search").failure()
+    with pytest.raises(CircuitOpen):
+        pool.get("http://localhost:1/v1/search?text=5")
+
+    ret_val = pool.proxy_json("http://localhost:1/v1/search", "text=5")
+    assert ret_val["features"] == []
+    assert "circuit breaker is open" in ret_val["geocoding"]["errors"][0]
+
+
+class RecordingPool(UpstreamPool):
+    """ send() records the (backend) urls, and answers 503 for pelias-a """
+    def __init__(self, **kwargs):
+        super(RecordingPool, self).__init__(**kwargs)
+        self.sent = []
+
+    def send(self, url, params, timeout):
+        self.sent.append(url)
+        return FakeResponse(503 if "pelias-a" in url else 200)
+
+
+def test_pelias_calls_go_to_a_backend():
+    backends = BackendPool("https://ws.trimet.org/pelias", ["http://pelias-a:4000", "http://pelias-b:4000"], eject_failures=1)
+    pool = RecordingPool(backends=backends, breaker_failures=5)
+    pool.add_breaker("https://ws.trimet.org/pelias/v1/search")
+
+    for _ in range(6):
+        pool.get("https://ws.trimet.org/pelias/v1/search?text=zoo")
+    pool.get("http://maps.trimet.org/ti/index/stops/4/routes/str")
+
+    # note: untried backends go first, so pelias-a gets a call, 503s, and sits out ... the route stop call isn't a Pelias call
+    assert pool.sent.count("http://pelias-a:4000/v1/search?text=zoo") == 1
+    assert pool.sent.count("http://pelias-b:4000/v1/search?text=zoo") == 5
+    assert pool.sent[-1] == "http://maps.trimet.org/ti/index/stops/4/routes/str"
+
+    stats = pool.stats()["pelias_backends"]["backends"]
+    assert stats["http://pelias-a:4000"]["errors"] == 1
+    assert stats["http://pelias-a:4000"]["ejected"]
+    assert stats["http://pelias-b:4000"]["requests"] == 5
+
+
+def test_latency_observer_sees_each_observed_call():
+    pool = RecordingPool()
+    seen = []
+
+    def calls():
+        pool.get("http://pelias-b:4000/v1/search?text=zoo")
+        pool.get("http://pelias-a:4000/v1/search?text=zoo")
+    observed(lambda secs, ok: seen.append(ok), calls)
+    assert seen == [True, False]
+
+
+def test_latency_observer_ignores_calls_made_outside_observed():
+    """ e.g., route stop preload / refresh and cache warming calls, which aren't admitted by the limiter """
+    pool = RecordingPool()
+    seen = []
+    observed(lambda secs, ok: seen.append(ok), lambda: None)
+    pool.get("http://maps.trimet.org/ti/index/stops/4/routes/str")
+
+    background = threading.Thread(target=pool.get, args=("http://pelias-b:4000/v1/search?text=zoo",))
+    observed(lambda secs, ok: seen.append(ok), background.start)
+    background.join()
+    assert seen == []
+
+
+def test_latency_observer_sees_the_hedged_calls():
+    hedging = warmed_up_hedging()
+    pool = RecordingPool(hedging=hedging)
+    seen = []
+    observed(lambda secs, ok: seen.append(ok), hedging.call, "pelias-b:4000", lambda timeout: pool.get("http://pelias-b:4000/v1/search?text=zoo"))
+    assert seen == [True]